@@ -1,20 +1,29 @@
-import os, subprocess
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import argparse
 import datetime
-from typing import Dict, Any
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional
 from dotenv import load_dotenv
-import openai
+
+from cad_common import metrics, openscad
+from cad_common.aio import run_sync
+from cad_common.providers import close_session, get_provider
 
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
-LOG_PATH = "design.log"
+MODEL = "gpt-4o"
 
-def log_event(event: str):
-    with open(LOG_PATH, "a") as f: 
-        f.write(f"[{datetime.datetime.now()}] {event}\n")
+# events and metrics spans (LLM call, file I/O, OpenSCAD export) as buffered JSON lines
+LOG_PATH = "design.jsonl"
 
-def generate_scad_from_prompt(prompt: str) -> str:
-    system_prompt = """
+SYSTEM_PROMPT = """
 You are an expert CAD engineer. Given the user's design request, output only valid OpenSCAD code.
 Start with a comment summarizing the design.
 
@@ -23,38 +32,243 @@ Example Output:
 // Cube 10x10x10 mm
 cube([10,10,10]);
 """
-    response = openai.ChatCompletion.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt}
-        ],
+
+_log = None
+
+def log_event(event: str, **fields):
+    global _log
+    if _log is None:
+        # one buffered handle for the whole run, also receiving the spans
+        _log = metrics.add_sink(metrics.JsonlSink(LOG_PATH))
+    _log.write({"time": datetime.datetime.now().isoformat(), "event": event, **fields})
+
+def generate_scad_from_prompt(prompt: str) -> str:
+    completion = run_sync(get_provider("openai", MODEL).complete(
+        prompt,
+        system=SYSTEM_PROMPT,
         temperature=0
-    )
-    return response.choices[0].message.content.strip()
+    ))
+    return completion.text.strip()
 
-def generate_3d_geometry(prompt: str, confirm: bool = True) -> Dict[str, Any]:
-    log_event(f"Prompt received: {prompt}")
-    scad_code = generate_scad_from_prompt(prompt)
-    log_event(f"SCAD code generated:\n{scad_code}")
+def export_model(scad_path: str, model_path: str, timeout: Optional[float] = None) -> openscad.RenderResult:
+    """Export `scad_path` to a mesh; the format follows the extension of `model_path`."""
+    cmd = openscad.build_command(scad_path, model_path)
+    return openscad.run(cmd, model_path, timeout=timeout)
 
-    with open("design.scad", "w") as f:
-        f.write(scad_code)
-    log_event("SCAD file saved as design.scad")
+def _error_message(result: openscad.RenderResult) -> str:
+    if result.timed_out:
+        return "OpenSCAD CLI timed out"
+    lines = [line for line in result.stderr.splitlines() if line.strip()]
+    return "OpenSCAD CLI failed" + (": " + lines[-1] if lines else "")
+
+def generate_3d_geometry(prompt: str, confirm: bool = True, out_dir: str = ".",
+                         name: Optional[str] = None) -> Dict[str, Any]:
+    # unique per call, so parallel runs never overwrite each other's files
+    name = name or f"design-{datetime.datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+    scad_path = os.path.join(out_dir, f"{name}.scad")
+    os.makedirs(out_dir, exist_ok=True)
+
+    log_event("prompt_received", prompt=prompt)
+    with metrics.trace("generate", name=name):
+        scad_code = generate_scad_from_prompt(prompt)
+        log_event("scad_generated", code=scad_code)
+
+        with metrics.span("file_io", op="save"):
+            with open(scad_path, "w") as f:
+                f.write(scad_code)
+    log_event("scad_saved", path=scad_path)
 
     if confirm:
         print("\n--- Generated OpenSCAD Code ---")
         print(scad_code)
         choice = input("Proceed to generate STL? (y/n): ").strip().lower()
         if choice not in ("y", "yes"):
-            log_event("User canceled before STL generation")
-            return {"status": "canceled"}
+            log_event("canceled", reason="user declined STL generation")
+            return {"status": "canceled", "scad_file": scad_path}
+
+    stl_path = os.path.join(out_dir, f"{name}.stl")
+    with metrics.trace("export", name=name):
+        result = export_model(scad_path, stl_path)
+    if result.ok:
+        log_event("stl_generated", path=stl_path, seconds=round(result.elapsed, 3))
+        return {"status": "success", "model_file": stl_path, "scad_file": scad_path}
+    log_event("stl_failed", error=_error_message(result))
+    return {"status": "error", "error_message": _error_message(result), "scad_file": scad_path}
+
+# -------------------------------------------------
+# Batch generation
+# -------------------------------------------------
+def part_name(prompt: str) -> str:
+    """Stable file name for a prompt: readable slug plus a hash of the prompt."""
+    slug = re.sub(r"[^a-z0-9]+", "-", prompt.lower()).strip("-")[:40].rstrip("-") or "part"
+    return f"{slug}-{hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8]}"
+
+def read_prompts(path: str) -> list:
+    """
+    (name, prompt) pairs from a prompt file: one prompt per line, or JSON
+    lines with "prompt" and an optional "name". Blank lines and lines
+    starting with '#' are skipped, repeated prompts are kept once.
+    """
+    parts, names = [], set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                row = json.loads(line)
+                prompt = row["prompt"].strip()
+                name = re.sub(r"[^\w.-]+", "_", row.get("name") or part_name(prompt))
+            else:
+                prompt, name = line, part_name(line)
+            if name in names:
+                continue
+            names.add(name)
+            parts.append((name, prompt))
+    return parts
 
-    stl_path = "design.stl"
+def load_manifest(path: str) -> set:
+    """Names of parts a previous run already exported successfully."""
+    done = set()
     try:
-        subprocess.run(["openscad", "design.scad", "-o", stl_path], check=True)
-        log_event("STL generated successfully")
-        return {"status": "success", "model_file": stl_path}
-    except subprocess.CalledProcessError:
-        log_event("OpenSCAD STL generation failed")
-        return {"status": "error", "error_message": "OpenSCAD CLI failed"}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # line cut short by an interrupted run
+                if entry.get("status") == "success":
+                    done.add(entry["name"])
+    except FileNotFoundError:
+        pass
+    return done
+
+async def generate_batch(prompts: list, out_dir: str, llm_concurrency: int = 8,
+                         openscad_concurrency: Optional[int] = None, fmt: str = "stl",
+                         timeout: Optional[float] = 300, resume: bool = True) -> dict:
+    """
+    Generate and export many parts without supervision. LLM calls and
+    OpenSCAD exports are separate worker pools with their own limits,
+    connected by a bounded queue, so a slow stage never starves the other.
+    Every finished part appends one line (status and timings) to
+    <out_dir>/manifest.jsonl; with `resume` parts already exported are
+    skipped. Returns a count per status.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    openscad_concurrency = openscad_concurrency or os.cpu_count() or 1
+    manifest_path = os.path.join(out_dir, "manifest.jsonl")
+    done = load_manifest(manifest_path) if resume else set()
+    todo = [(name, prompt) for name, prompt in prompts if name not in done]
+    counts = {"skipped": len(prompts) - len(todo)}
+
+    provider = get_provider("openai", MODEL)
+    prompt_queue = asyncio.Queue()
+    export_queue = asyncio.Queue(maxsize=openscad_concurrency * 2)
+    for item in todo:
+        prompt_queue.put_nowait(item)
+    for _ in range(llm_concurrency):
+        prompt_queue.put_nowait(None)
+
+    loop = asyncio.get_running_loop()
+    # OpenSCAD is a subprocess; the pool size is the export concurrency
+    exporter = ThreadPoolExecutor(max_workers=openscad_concurrency, thread_name_prefix="openscad")
+    manifest = open(manifest_path, "a", encoding="utf-8")
+    started = time.monotonic()
+
+    def record(entry: dict):
+        manifest.write(json.dumps(entry) + "\n")
+        manifest.flush()
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        finished = sum(counts.values()) - counts["skipped"]
+        print(f"[{finished}/{len(todo)}] {entry['name']}: {entry['status']}")
+
+    async def llm_worker():
+        while True:
+            item = await prompt_queue.get()
+            if item is None:
+                return
+            name, prompt = item
+            entry = {"name": name, "prompt": prompt, "scad_file": os.path.join(out_dir, f"{name}.scad"),
+                     "started": datetime.datetime.now().isoformat(timespec="seconds")}
+            t0 = time.monotonic()
+            with metrics.trace("part", name=name):
+                try:
+                    completion = await provider.complete(prompt, system=SYSTEM_PROMPT, temperature=0)
+                except Exception as exc:
+                    entry.update(status="llm_error", error=str(exc), llm_seconds=round(time.monotonic() - t0, 3))
+                    record(entry)
+                    continue
+                entry.update(llm_seconds=round(time.monotonic() - t0, 3),
+                             prompt_tokens=completion.prompt_tokens,
+                             completion_tokens=completion.completion_tokens)
+                with metrics.span("file_io", op="save"):
+                    with open(entry["scad_file"], "w") as f:
+                        f.write(completion.text.strip())
+                # the export runs on a pool thread; its span joins this part's trace
+                context = contextvars.copy_context()
+            await export_queue.put((entry, context))
+
+    async def export_worker():
+        while True:
+            item = await export_queue.get()
+            if item is None:
+                return
+            entry, context = item
+            model_path = os.path.join(out_dir, f"{entry['name']}.{fmt}")
+            result = await loop.run_in_executor(exporter, context.run, export_model,
+                                                entry["scad_file"], model_path, timeout)
+            entry["openscad_seconds"] = round(result.elapsed, 3)
+            if result.ok:
+                entry.update(status="success", model_file=model_path)
+            else:
+                entry.update(status="timeout" if result.timed_out else "openscad_error",
+                             error=_error_message(result))
+            record(entry)
+
+    log_event("batch_started", parts=len(todo), skipped=counts["skipped"], out_dir=out_dir)
+    exporters = [asyncio.create_task(export_worker()) for _ in range(openscad_concurrency)]
+    try:
+        await asyncio.gather(*(llm_worker() for _ in range(llm_concurrency)))
+        for _ in exporters:
+            await export_queue.put(None)
+        await asyncio.gather(*exporters)
+    finally:
+        for task in exporters:
+            task.cancel()
+        exporter.shutdown(wait=False, cancel_futures=True)
+        manifest.close()
+        await close_session()
+    log_event("batch_finished", seconds=round(time.monotonic() - started, 3), counts=counts)
+    print(f"Time per stage: {metrics.stage_summary()}")
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate OpenSCAD parts and export them to meshes")
+    parser.add_argument("--prompt_file", type=str, default=None,
+                        help="Text file with one prompt per line (or JSON lines with 'prompt' and 'name'); "
+                             "without it a single prompt is read interactively")
+    parser.add_argument("--out_dir", type=str, default=".",
+                        help="Directory for the .scad/.stl files and manifest.jsonl")
+    parser.add_argument("--llm_concurrency", type=int, default=8,
+                        help="Concurrent LLM requests; the provider's rate limiter may go lower")
+    parser.add_argument("--openscad_concurrency", type=int, default=None,
+                        help="Concurrent OpenSCAD exports (default: one per CPU core)")
+    parser.add_argument("--format", type=str, default="stl", choices=["stl", "3mf", "off", "amf"],
+                        help="Mesh format of the exported parts")
+    parser.add_argument("--timeout", type=float, default=300,
+                        help="Seconds before an OpenSCAD export is killed")
+    parser.add_argument("--no_resume", dest="resume", action="store_false",
+                        help="Regenerate parts the manifest already lists as exported")
+    args = parser.parse_args()
+
+    if args.prompt_file is None:
+        print(generate_3d_geometry(input("Design prompt: "), out_dir=args.out_dir))
+        return
+
+    counts = asyncio.run(generate_batch(read_prompts(args.prompt_file), args.out_dir,
+                                        args.llm_concurrency, args.openscad_concurrency,
+                                        args.format, args.timeout, args.resume))
+    print(f"Done! {counts}; manifest in {os.path.join(args.out_dir, 'manifest.jsonl')}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+"""
+Offline benchmarks: a local stub LLM server plus a load driver for the
+batch generator, agent.py and both Flask apps. See bench/run.py.
+"""
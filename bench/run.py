@@ -0,0 +1,289 @@
+"""
+Offline load benchmark for the CAD generation paths.
+
+Starts bench/stub_server.py in-process, then drives each scenario in its
+own child process (so peak RSS is per scenario) at a fixed concurrency:
+
+  thoughts    generate_cad_thoughts pipeline, one request per prompt
+  agent       agent.generate_3d_geometry(prompt, confirm=False)
+  llm_to_cad  POST /submit on llm_to_cad/app.py
+  text2cad    POST /submit on text-2-cad/app.py
+
+and reports p50/p95/p99 latency, requests/sec and peak RSS.
+
+    python -m bench.run --scenarios llm_to_cad text2cad --requests 200 --concurrency 16 \\
+        --latency 0.3 --tokens-per-sec 80 --rate-429 0.05
+
+`-m bench.run` needs the repo root as the working directory (or on
+PYTHONPATH); from anywhere else run the file itself, `python path/to/bench/run.py`,
+which puts the repo root on sys.path.
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty
+from types import SimpleNamespace
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from bench.stub_server import StubConfig, create_app  # noqa: E402
+
+SCENARIOS = ("thoughts", "agent", "llm_to_cad", "text2cad")
+
+
+# ---------------------------------------------------------------- stub server
+def start_stub(config: StubConfig, port: int) -> str:
+    from aiohttp import web
+
+    started = threading.Event()
+
+    def serve():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(create_app(config))
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, name="stub-llm", daemon=True).start()
+    started.wait(10)
+    return f"http://127.0.0.1:{port}"
+
+
+def stub_env(url: str) -> dict:
+    return {
+        "OPENAI_BASE_URL": f"{url}/v1",
+        "TOGETHER_BASE_URL": f"{url}/v1",
+        "ANTHROPIC_BASE_URL": f"{url}/v1",
+        "GEMINI_BASE_URL": f"{url}/v1beta",
+        "OPENAI_API_KEY": "stub",
+        "CLAUDE_API_KEY": "stub",
+        "TOGETHER_API_KEY": "stub",
+        "GEMINI_API_KEY": "stub",
+    }
+
+
+# ------------------------------------------------------------------ helpers
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def run_concurrent(fn, items, concurrency):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def timed(item):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            ok = fn(item)
+        except Exception as exc:
+            print(f"  request failed: {exc}", file=sys.stderr)
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, items))
+    return latencies, errors
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def wait_for_job(client, job_id, timeout=300):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/jobs/{job_id}").get_json()
+        if job.get("status") not in ("queued", "running"):
+            return job.get("status") == "done"
+        time.sleep(0.05)
+    return False
+
+
+# ---------------------------------------------------------------- scenarios
+def bench_thoughts(prompts, opts):
+    import generate_cad_thoughts as gct
+
+    latencies = []
+    fetch = gct.fetch_completion
+
+    async def timed_fetch(*args, **kwargs):
+        start = time.perf_counter()
+        result = await fetch(*args, **kwargs)
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    gct.fetch_completion = timed_fetch
+    # the generator drops duplicate prompts, so number the repeats of a cycled
+    # prompt file to send every requested one
+    seen = set()
+    prompts = [p if p not in seen and not seen.add(p) else f"{p} (#{i})" for i, p in enumerate(prompts)]
+    with open("prompts.txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(prompts) + "\n")
+    args = SimpleNamespace(input_file="prompts.txt", output_file="out.jsonl", shard_size=0,
+                           partial_file="partial.jsonl", resume=False, reparse_only=False,
+                           workers=opts.concurrency,
+                           temperature=0.6, top_p=0.95, max_tokens=2048,
+                           metrics_file="metrics.jsonl", parquet_dir="thoughts_parquet",
+                           parquet_rows_per_shard=100_000, render=opts.render_thoughts,
+                           render_dir="renders", render_workers=0, render_timeout=120)
+    asyncio.run(gct.generate_cad_thoughts(args))
+    with open("out.jsonl", encoding="utf-8") as f:
+        errors = sum(1 for line in f if '"error"' in line)
+    return latencies, errors
+
+
+def bench_agent(prompts, opts):
+    import agent
+
+    def call(prompt):
+        return agent.generate_3d_geometry(prompt, confirm=False).get("status") == "success"
+
+    return run_concurrent(call, prompts, opts.concurrency)
+
+
+def _bench_flask(app_path, form, prompts, opts):
+    module = load_module(f"bench_app_{len(sys.modules)}", app_path)
+    client = module.app.test_client()
+
+    def call(prompt):
+        res = client.post("/submit", data=dict(form, text=prompt)).get_json()
+        if res.get("error"):
+            return False
+        if opts.wait_render and res.get("job"):
+            return wait_for_job(client, res["job"])
+        return True
+
+    return run_concurrent(call, prompts, opts.concurrency)
+
+
+def bench_llm_to_cad(prompts, opts):
+    return _bench_flask(os.path.join(REPO_ROOT, "llm_to_cad", "app.py"),
+                        {"provider": opts.provider}, prompts, opts)
+
+
+def bench_text2cad(prompts, opts):
+    return _bench_flask(os.path.join(REPO_ROOT, "text-2-cad", "app.py"),
+                        {"toggleRag": "off"}, prompts, opts)
+
+
+def _child(scenario, prompts, opts, env, queue):
+    workdir = tempfile.mkdtemp(prefix=f"bench-{scenario}-")
+    os.chdir(workdir)
+    os.environ.update(env)
+    with open("keys.json", "w") as f:
+        json.dump({"gpt": "stub", "claude": "stub", "gemini": "stub", "together": "stub"}, f)
+    fn = globals()[f"bench_{scenario}"]
+    start = time.perf_counter()
+    latencies, errors = fn(prompts, opts)
+    wall = time.perf_counter() - start
+    queue.put({
+        "scenario": scenario,
+        "requests": len(latencies),
+        "errors": errors,
+        "wall_s": wall,
+        "rps": len(latencies) / wall if wall else None,
+        "p50_s": percentile(latencies, 0.50),
+        "p95_s": percentile(latencies, 0.95),
+        "p99_s": percentile(latencies, 0.99),
+        # ru_maxrss is KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+def load_prompts(path, count, cold):
+    with open(path, encoding="utf-8") as f:
+        base = [line.strip() for line in f if line.strip()]
+    prompts = [base[i % len(base)] for i in range(count or len(base))]
+    if cold:
+        # unique suffix defeats the response and render caches
+        prompts = [f"{p} (#{i})" for i, p in enumerate(prompts)]
+    return prompts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark against a stub LLM server")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--prompts", default=os.path.join(REPO_ROOT, "prompt.txt"))
+    parser.add_argument("--requests", type=int, default=0,
+                        help="Requests per scenario (cycles the prompt file; 0 = one pass)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--cold", action="store_true", help="Make every prompt unique to bypass caches")
+    parser.add_argument("--provider", default="gpt", help="Provider field for llm_to_cad /submit")
+    parser.add_argument("--wait-render", action="store_true",
+                        help="Count /submit as finished only when its render job is done")
+    parser.add_argument("--render-thoughts", action="store_true",
+                        help="Run the thoughts scenario with its render-verification stage")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--stub-url", default=None, help="Use an already running stub server")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--json", dest="json_out", default=None, help="Also write results to this file")
+    opts = parser.parse_args()
+
+    url = opts.stub_url or start_stub(
+        StubConfig(opts.latency, opts.tokens_per_sec, opts.rate_429, opts.retry_after), opts.port)
+    env = stub_env(url)
+    prompts = load_prompts(opts.prompts, opts.requests, opts.cold)
+
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for scenario in opts.scenarios:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_child, args=(scenario, prompts, opts, env, queue))
+        proc.start()
+        # read the result before joining: a child blocks on exit until its
+        # queued report has been read
+        result = None
+        while result is None and (proc.is_alive() or not queue.empty()):
+            try:
+                result = queue.get(timeout=1)
+            except Empty:
+                pass
+        proc.join()
+        if result is None:
+            print(f"{scenario}: failed (exit code {proc.exitcode})")
+            continue
+        if result["requests"] != len(prompts):
+            print(f"{scenario}: {result['requests']} of {len(prompts)} requests measured")
+        results.append(result)
+
+    header = f"{'scenario':<12}{'reqs':>6}{'errs':>6}{'rps':>9}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'RSS MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['scenario']:<12}{r['requests']:>6}{r['errors']:>6}{r['rps'] or 0:>9.2f}"
+              f"{r['p50_s'] or 0:>9.3f}{r['p95_s'] or 0:>9.3f}{r['p99_s'] or 0:>9.3f}{r['peak_rss_mb']:>9.1f}")
+    if opts.json_out:
+        with open(opts.json_out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Local stand-in for the OpenAI, Anthropic, Together and Gemini HTTP APIs.
+
+Responses have the real providers' JSON shapes, with configurable latency,
+output token rate and 429 injection (and SSE streaming when the request asks
+for it), so the rest of the repo can be
+load-tested without paying for API calls. Point the clients at it with
+OPENAI_BASE_URL / TOGETHER_BASE_URL = http://host:port/v1,
+ANTHROPIC_BASE_URL = http://host:port/v1 and
+GEMINI_BASE_URL = http://host:port/v1beta.
+
+    python -m bench.stub_server --port 8089 --latency 0.3 --tokens-per-sec 80 --rate-429 0.05
+"""
+import argparse
+import asyncio
+import json
+import random
+from dataclasses import dataclass
+
+from aiohttp import web
+
+SCAD_RESPONSE = """// Mounting plate with four corner holes
+difference() {
+    cube([100, 60, 5]);
+    for (x = [10, 90], y = [10, 50])
+        translate([x, y, -1]) cylinder(d = 6, h = 7, $fn = 32);
+}"""
+
+
+@dataclass
+class StubConfig:
+    latency: float = 0.2         # seconds before the first token
+    tokens_per_sec: float = 0.0  # output rate; 0 = instant
+    rate_429: float = 0.0        # probability of answering 429
+    retry_after: float = 1.0
+    embedding_dim: int = 256
+
+
+def _answer(system: str, prompt: str) -> str:
+    # the CAD-THOUGHTS generator asks for JSON, everything else for plain SCAD
+    if "json" in (system or "").lower():
+        return json.dumps({"code_scad": SCAD_RESPONSE,
+                           "chain_of_thought": [f"Read the request: {prompt[:80]}",
+                                                "Subtract the holes from the plate."]})
+    return SCAD_RESPONSE
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _chunks(text: str, size: int = 16) -> list:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def create_app(config: StubConfig) -> web.Application:
+    stats = {"requests": 0, "throttled": 0}
+
+    async def delay(text: str):
+        seconds = config.latency
+        if config.tokens_per_sec:
+            seconds += _tokens(text) / config.tokens_per_sec
+        await asyncio.sleep(seconds)
+
+    async def sse(request, text: str, event, done: bool = False):
+        """
+        Stream `text` as server-sent events, `event(chunk)` building each
+        payload, at the configured first-token latency and token rate.
+        """
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream",
+                                           "Cache-Control": "no-cache"})
+        await resp.prepare(request)
+        await asyncio.sleep(config.latency)
+        for chunk in _chunks(text):
+            if config.tokens_per_sec:
+                await asyncio.sleep(_tokens(chunk) / config.tokens_per_sec)
+            await resp.write(f"data: {json.dumps(event(chunk))}\n\n".encode())
+        if done:
+            await resp.write(b"data: [DONE]\n\n")
+        await resp.write_eof()
+        return resp
+
+    def throttled():
+        if config.rate_429 and random.random() < config.rate_429:
+            stats["throttled"] += 1
+            return web.json_response({"error": {"message": "rate limited (stub)"}}, status=429,
+                                     headers={"Retry-After": str(config.retry_after)})
+        return None
+
+    async def chat_completions(request):
+        stats["requests"] += 1
+        if (resp := throttled()) is not None:
+            return resp
+        body = await request.json()
+        messages = body.get("messages", [])
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+        prompt = messages[-1]["content"] if messages else ""
+        text = _answer(system, prompt)
+        if body.get("stream"):
+            return await sse(request, text, lambda chunk: {
+                "id": "stub", "object": "chat.completion.chunk", "model": body.get("model"),
+                "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}],
+            }, done=True)
+        await delay(text)
+        n = int(body.get("n") or 1)
+        return web.json_response({
+            "id": "stub", "object": "chat.completion", "model": body.get("model"),
+            "choices": [{"index": i, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": text}} for i in range(n)],
+            "usage": {"prompt_tokens": _tokens(system + prompt), "completion_tokens": n * _tokens(text),
+                      "total_tokens": _tokens(system + prompt) + n * _tokens(text)},
+        })
+
+    async def embeddings(request):
+        stats["requests"] += 1
+        if (resp := throttled()) is not None:
+            return resp
+        body = await request.json()
+        inputs = body.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        dim = body.get("dimensions") or config.embedding_dim
+        data = []
+        for i, text in enumerate(inputs):
+            rng = random.Random(text)
+            data.append({"object": "embedding", "index": i,
+                         "embedding": [rng.uniform(-1, 1) for _ in range(dim)]})
+        return web.json_response({"object": "list", "data": data, "model": body.get("model"),
+                                  "usage": {"prompt_tokens": sum(map(_tokens, inputs)),
+                                            "total_tokens": sum(map(_tokens, inputs))}})
+
+    async def anthropic_messages(request):
+        stats["requests"] += 1
+        if (resp := throttled()) is not None:
+            return resp
+        body = await request.json()
+        messages = body.get("messages", [])
+        prompt = messages[-1]["content"] if messages else ""
+        text = _answer(body.get("system", ""), prompt)
+        if body.get("stream"):
+            return await sse(request, text, lambda chunk: {
+                "type": "content_block_delta", "index": 0,
+                "delta": {"type": "text_delta", "text": chunk},
+            })
+        await delay(text)
+        return web.json_response({
+            "id": "stub", "type": "message", "role": "assistant", "model": body.get("model"),
+            "content": [{"type": "text", "text": text}], "stop_reason": "end_turn",
+            "usage": {"input_tokens": _tokens(prompt), "output_tokens": _tokens(text)},
+        })
+
+    async def gemini_generate(request):
+        stats["requests"] += 1
+        if (resp := throttled()) is not None:
+            return resp
+        body = await request.json()
+        system = "".join(p.get("text", "") for p in body.get("system_instruction", {}).get("parts", []))
+        contents = body.get("contents", [])
+        prompt = "".join(p.get("text", "") for p in contents[-1]["parts"]) if contents else ""
+        text = _answer(system, prompt)
+        if request.match_info["method"] == "streamGenerateContent":
+            return await sse(request, text, lambda chunk: {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": chunk}]}}],
+            })
+        await delay(text)
+        return web.json_response({
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]},
+                            "finishReason": "STOP"}],
+            "usageMetadata": {"promptTokenCount": _tokens(prompt),
+                              "candidatesTokenCount": _tokens(text)},
+        })
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app["stats"] = stats
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_post("/v1/embeddings", embeddings)
+    app.router.add_post("/v1/messages", anthropic_messages)
+    app.router.add_post("/v1beta/models/{model}:{method:(generateContent|streamGenerateContent)}",
+                        gemini_generate)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub LLM provider server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    args = parser.parse_args()
+    config = StubConfig(args.latency, args.tokens_per_sec, args.rate_429, args.retry_after)
+    web.run_app(create_app(config), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+"""
+Shared building blocks for the LLM -> OpenSCAD tools in this repo
+(generate_cad_thoughts.py, agent.py and the two Flask apps).
+"""
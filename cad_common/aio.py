@@ -0,0 +1,78 @@
+"""
+Bridge between synchronous callers (Flask views, agent.py) and the async
+provider layer. All such calls run on one long-lived event loop in a daemon
+thread, so the pooled HTTP session and its keep-alive connections are
+shared across requests instead of being rebuilt per call.
+"""
+import asyncio
+import atexit
+import queue
+import threading
+from typing import AsyncIterator, Iterator, Optional
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
+
+
+def background_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="cad-common-loop", daemon=True).start()
+            atexit.register(_shutdown)
+    return _loop
+
+
+def _shutdown():
+    from .providers import close_session
+    try:
+        asyncio.run_coroutine_threadsafe(close_session(), _loop).result(5)
+    except Exception:
+        pass
+
+
+def run_sync(coro, timeout: Optional[float] = None):
+    """
+    Run `coro` on the shared background loop and block for its result.
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, background_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+def iter_sync(agen: AsyncIterator, timeout: Optional[float] = None) -> Iterator:
+    """
+    Iterate an async generator on the shared background loop from
+    synchronous code. `timeout` bounds the wait for each item; closing the
+    iterator early (e.g. the client went away) cancels the generator.
+    """
+    items: queue.Queue = queue.Queue()
+    end = object()
+
+    async def pump():
+        try:
+            async for item in agen:
+                items.put((item, None))
+        except Exception as exc:
+            items.put((end, exc))
+        else:
+            items.put((end, None))
+
+    future = asyncio.run_coroutine_threadsafe(pump(), background_loop())
+    try:
+        while True:
+            try:
+                item, exc = items.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError(f"no data for {timeout}s") from None
+            if item is end:
+                if exc is not None:
+                    raise exc
+                return
+            yield item
+    finally:
+        future.cancel()
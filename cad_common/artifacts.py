@@ -0,0 +1,145 @@
+"""
+Sharded artifact storage with background garbage collection.
+
+Artifacts (generated .scad files) get random UUID keys instead of
+second-resolution timestamps and live under <root>/<id[:2]>/<id>.<ext>.
+Writes go through a temp file and an atomic rename, so any number of
+workers can share one volume. A daemon thread sweeps the store, dropping
+files older than `max_age` and then the least recently used ones until the
+total is under `max_bytes`. Every worker may run its own sweeper, since
+deleting a file twice is harmless.
+
+    store = ArtifactStore("scad_scripts").start_gc()
+    artifact_id = store.save(code, "scad")
+    path = store.get(artifact_id, "scad")
+"""
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from typing import Optional
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+_ID = re.compile(r"[0-9a-f]{32}")
+
+
+def valid_id(artifact_id: str) -> bool:
+    return bool(_ID.fullmatch(artifact_id or ""))
+
+
+def sweep(root: str, max_bytes: Optional[int] = None, max_age: Optional[float] = None) -> int:
+    """
+    Delete files under `root` older than `max_age` seconds, then the oldest
+    by mtime until at most `max_bytes` remain. Returns the remaining total.
+    Stray temp files from crashed writers are removed after an hour.
+    """
+    now = time.time()
+    entries = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            age = now - st.st_mtime
+            if (name.startswith(".tmp-") and age > 3600) or (max_age is not None and age > max_age):
+                _remove(path)
+            elif not name.startswith(".tmp-"):
+                entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    if max_bytes is not None and total > max_bytes:
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            _remove(path)
+            total -= size
+    return total
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ArtifactStore:
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_age: float = DEFAULT_MAX_AGE, sweep_interval: float = 600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self._gc_thread = None
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+    def path_for(self, artifact_id: str, ext: str) -> str:
+        if not valid_id(artifact_id):
+            raise ValueError(f"Invalid artifact id: {artifact_id!r}")
+        return os.path.join(self.root, artifact_id[:2], f"{artifact_id}.{ext}")
+
+    def save(self, content, ext: str, artifact_id: Optional[str] = None) -> str:
+        """
+        Store `content` (str or bytes) atomically and return its id. Passing
+        an existing id replaces that artifact, e.g. with repaired code.
+        """
+        artifact_id = artifact_id or self.new_id()
+        path = self.path_for(artifact_id, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = content.encode("utf-8") if isinstance(content, str) else content
+        fd, tmp = tempfile.mkstemp(suffix=f".{ext}", prefix=".tmp-", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            _remove(tmp)
+            raise
+        return artifact_id
+
+    def get(self, artifact_id: str, ext: str) -> Optional[str]:
+        """Path of a stored artifact, or None; a hit counts as a use for eviction."""
+        if not valid_id(artifact_id):
+            return None
+        path = self.path_for(artifact_id, ext)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def read(self, artifact_id: str, ext: str) -> Optional[str]:
+        path = self.get(artifact_id, ext)
+        if path is None:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None  # evicted in between
+
+    def sweep(self) -> int:
+        return sweep(self.root, self.max_bytes, self.max_age)
+
+    def start_gc(self) -> "ArtifactStore":
+        """Start the background sweeper (once); returns self for chaining."""
+        if self._gc_thread is None:
+            self._gc_thread = threading.Thread(target=self._gc_loop, name="artifact-gc", daemon=True)
+            self._gc_thread.start()
+        return self
+
+    def _gc_loop(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as exc:
+                print(f"Artifact sweep of {self.root} failed: {exc}")
+            time.sleep(self.sweep_interval)
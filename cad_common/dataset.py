@@ -0,0 +1,231 @@
+"""
+Columnar CAD-THOUGHTS datasets (sharded, compressed Parquet).
+
+A JSON list of rows has to be parsed in full before the first row can be
+used. Parquet shards are read column by column and row group by row
+group, memory-mapped, with filters pushed down to the row-group
+statistics, so "only rows whose SCAD renders" reads just those rows.
+
+    writer = ParquetShardWriter("thoughts_parquet")
+    writer.write(row)
+    writer.close()
+
+    table = read("thoughts_parquet", columns=["prompt", "code_scad"], where=RENDERED)
+    df = summary("thoughts_parquet")
+
+    python -m cad_common.dataset convert cad_thoughts.jsonl thoughts_parquet
+    python -m cad_common.dataset summary thoughts_parquet
+    python -m cad_common.dataset filter thoughts_parquet rendered.jsonl --where rendered
+"""
+import argparse
+import glob
+import json
+import os
+from typing import Iterator, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+SCHEMA = pa.schema([
+    ("prompt", pa.string()),
+    ("prompt_hash", pa.string()),
+    ("model", pa.string()),
+    # ok, parse_error or request_error
+    ("parse_status", pa.string()),
+    # how the answer was found: json, json_repaired or fenced_scad
+    ("extraction", pa.string()),
+    ("code_scad", pa.string()),
+    ("chain_of_thought", pa.list_(pa.string())),
+    ("valid", pa.bool_()),  # passes cad_common.scad_lint
+    ("lint_errors", pa.int32()),
+    # ok, failed, timeout, empty (no geometry) or invalid (not rendered,
+    # rejected by the linter); null when rendering was off
+    ("render_status", pa.string()),
+    ("render_error", pa.string()),
+    ("mesh_triangles", pa.int64()),
+    ("mesh_size", pa.list_(pa.float64())),
+    ("mesh_volume", pa.float64()),
+    ("thumbnail", pa.string()),
+    ("latency", pa.float64()),
+    ("prompt_tokens", pa.int32()),
+    ("completion_tokens", pa.int32()),
+    ("error", pa.string()),
+    ("raw_response", pa.string()),
+])
+
+PARSED = ds.field("parse_status") == "ok"
+VALID = ds.field("valid")
+RENDERED = ds.field("render_status") == "ok"
+FILTERS = {"parsed": PARSED, "valid": VALID, "rendered": RENDERED}
+
+
+def _coerce(row: dict) -> dict:
+    """A row with exactly the schema's fields; anything else is dropped."""
+    out = {name: row.get(name) for name in SCHEMA.names}
+    mesh = row.get("mesh") or {}
+    out.update(mesh_triangles=mesh.get("triangles"), mesh_size=mesh.get("size"), mesh_volume=mesh.get("volume"))
+    cot = out["chain_of_thought"]
+    if isinstance(cot, str):
+        out["chain_of_thought"] = [cot]
+    elif cot is not None:
+        out["chain_of_thought"] = [c if isinstance(c, str) else json.dumps(c, ensure_ascii=False) for c in cot]
+    return out
+
+
+class ParquetShardWriter:
+    """
+    Write rows into `<directory>/part-NNNNN.parquet`, zstd-compressed, one
+    row group per `row_group_size` rows and a new shard every
+    `rows_per_shard` rows, so memory stays at one row group.
+    """
+    def __init__(self, directory: str, rows_per_shard: int = 100_000,
+                 row_group_size: int = 1_000, compression: str = "zstd"):
+        self.directory = directory
+        self.rows_per_shard = rows_per_shard
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.paths = []
+        self._writer: Optional[pq.ParquetWriter] = None
+        self._buffer: list = []
+        self._shard_rows = 0
+        os.makedirs(directory, exist_ok=True)
+        # the directory holds one dataset; shards of an earlier run would mix in
+        for stale in glob.glob(os.path.join(directory, "part-*.parquet")):
+            os.remove(stale)
+
+    def write(self, row: dict):
+        self._buffer.append(_coerce(row))
+        if len(self._buffer) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        if self._writer is None:
+            path = os.path.join(self.directory, f"part-{len(self.paths):05d}.parquet")
+            self.paths.append(path)
+            self._writer = pq.ParquetWriter(path, SCHEMA, compression=self.compression)
+        self._writer.write_table(pa.Table.from_pylist(self._buffer, schema=SCHEMA))
+        self._shard_rows += len(self._buffer)
+        self._buffer = []
+        if self._shard_rows >= self.rows_per_shard:
+            self._writer.close()
+            self._writer, self._shard_rows = None, 0
+
+    def close(self):
+        self._flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def open_dataset(path: str) -> ds.Dataset:
+    """A lazy dataset over a shard directory (or one file), memory-mapped."""
+    return ds.dataset(path, schema=SCHEMA, format="parquet", filesystem=fs.LocalFileSystem(use_mmap=True))
+
+
+def _where(where):
+    return FILTERS[where] if isinstance(where, str) else where
+
+
+def read(path: str, columns: Optional[list] = None, where=None) -> pa.Table:
+    """
+    Only `columns` of the rows matching `where` (an Arrow expression, or
+    one of "parsed", "valid", "rendered").
+    """
+    return open_dataset(path).to_table(columns=columns, filter=_where(where))
+
+
+def scan(path: str, columns: Optional[list] = None, where=None,
+         batch_size: int = 10_000) -> Iterator[dict]:
+    """Rows as dicts, one record batch in memory at a time."""
+    for batch in open_dataset(path).to_batches(columns=columns, filter=_where(where), batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+def count(path: str, where=None) -> int:
+    return open_dataset(path).count_rows(filter=_where(where))
+
+
+def summary(path: str) -> pd.DataFrame:
+    """
+    Per model and status: rows, latency percentiles and token totals,
+    read from the metadata columns only.
+    """
+    df = read(path, columns=["model", "parse_status", "valid", "render_status", "latency",
+                             "prompt_tokens", "completion_tokens"]).to_pandas()
+    if df.empty:
+        return df
+    df["render_status"] = df["render_status"].fillna("not rendered")
+    return df.groupby(["model", "parse_status", "render_status"], dropna=False).agg(
+        rows=("parse_status", "size"),
+        valid=("valid", "sum"),
+        latency_p50=("latency", "median"),
+        latency_p95=("latency", lambda s: s.quantile(0.95)),
+        prompt_tokens=("prompt_tokens", "sum"),
+        completion_tokens=("completion_tokens", "sum"),
+    ).reset_index()
+
+
+def iter_json_rows(paths: list) -> Iterator[dict]:
+    """Rows from JSONL files or a JSON list file (the --json_output format)."""
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            if f.read(1) == "[":
+                f.seek(0)
+                yield from json.load(f)
+                continue
+            f.seek(0)
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def convert(paths: list, directory: str, **writer_kwargs) -> list:
+    """Convert CAD-THOUGHTS JSON/JSONL files into Parquet shards; returns the shard paths."""
+    writer = ParquetShardWriter(directory, **writer_kwargs)
+    try:
+        for row in iter_json_rows(paths):
+            writer.write(row)
+    finally:
+        writer.close()
+    return writer.paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CAD-THOUGHTS Parquet datasets")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("convert", help="JSON/JSONL rows -> Parquet shards")
+    p.add_argument("inputs", nargs="+")
+    p.add_argument("directory")
+    p.add_argument("--rows_per_shard", type=int, default=100_000)
+    p = sub.add_parser("summary", help="Rows, latency and tokens per model and status")
+    p.add_argument("directory")
+    p = sub.add_parser("filter", help="Write the matching rows as JSONL")
+    p.add_argument("directory")
+    p.add_argument("output")
+    p.add_argument("--where", choices=sorted(FILTERS), default="rendered")
+    p.add_argument("--columns", nargs="*", default=None)
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        shards = convert(args.inputs, args.directory, rows_per_shard=args.rows_per_shard)
+        print(f"{count(args.directory)} rows in {len(shards)} shard(s) under {args.directory}")
+    elif args.command == "summary":
+        with pd.option_context("display.width", 200, "display.max_columns", None):
+            print(summary(args.directory).to_string(index=False))
+    else:
+        rows = 0
+        with open(args.output, "w", encoding="utf-8") as out:
+            for row in scan(args.directory, args.columns, args.where):
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                rows += 1
+        print(f"{rows} {args.where} rows written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
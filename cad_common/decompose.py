@@ -0,0 +1,246 @@
+"""
+Parallel subtask generation for complex designs.
+
+The request is split once into named parts with explicit dependencies. Each
+part is then generated as its own OpenSCAD module, concurrently with every
+other part whose dependencies are done, and sees only the request and the
+code of the parts it depends on. Previously each call re-sent the whole
+growing history. An assembly step needs only the part names, so it runs
+alongside the first parts. The modules and the assembly are composed into
+one SCAD file.
+
+    design = decompose(request, complete=lambda prompt: ask_llm(prompt))
+    scad = design.code
+"""
+import contextvars
+import json
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from .scad_lint import BUILTIN_FUNCTIONS, BUILTIN_MODULES
+
+MAX_PARTS = 8
+# a part named after one of these would shadow or clash with it
+RESERVED = BUILTIN_MODULES | BUILTIN_FUNCTIONS | {"module", "function", "else", "true", "false", "undef"}
+
+PLAN_PROMPT = (
+    "You have the following objective:\n"
+    "Create the OpenSCAD code to generate the 3D model for a {request}\n\n"
+    "Split the design into at most {max_parts} parts, each of which will become one "
+    "OpenSCAD module written separately. Give every part a short snake_case name, a "
+    "description with its dimensions, and the names of the parts it must fit or "
+    "reference (only those). Answer ONLY with JSON of the form\n"
+    '{{"parts": [{{"name": "...", "description": "...", "depends_on": ["..."]}}]}}'
+)
+
+PART_PROMPT = (
+    "Objective: the 3D model for a {request}\n"
+    "It is built from these parts: {names}.\n\n"
+    "Write the part `{name}`: {description}\n"
+    "{context}"
+    "Answer ONLY with OpenSCAD code defining `module {name}() {{ ... }}` "
+    "(helper modules are fine), no other text."
+)
+
+ASSEMBLY_PROMPT = (
+    "Objective: the 3D model for a {request}\n"
+    "The following OpenSCAD modules exist, each modelled around the origin:\n{parts}\n\n"
+    "Write ONLY the top-level OpenSCAD statements that instantiate and position "
+    "these modules to form the final model. Do not define the modules. "
+    "Answer ONLY with OpenSCAD code, no other text."
+)
+
+
+@dataclass
+class Subtask:
+    name: str
+    description: str
+    depends_on: list = field(default_factory=list)
+    code: str = ""
+    elapsed: float = 0.0
+
+
+@dataclass
+class Design:
+    request: str
+    parts: list
+    assembly: str = ""
+    elapsed: float = 0.0
+
+    @property
+    def code(self) -> str:
+        header = [f"// {self.request}"] + [f"//   {p.name}: {p.description}" for p in self.parts]
+        blocks = ["\n".join(header)] + [p.code for p in self.parts] + [self.assembly]
+        return "\n\n".join(b.strip() for b in blocks if b.strip()) + "\n"
+
+    def to_dict(self) -> dict:
+        return {"parts": [{"name": p.name, "depends_on": p.depends_on,
+                           "elapsed": round(p.elapsed, 2)} for p in self.parts],
+                "elapsed": round(self.elapsed, 2)}
+
+
+def _identifier(name: str) -> str:
+    ident = re.sub(r"\W+", "_", str(name).strip().lower()).strip("_")
+    if not ident or ident[0].isdigit():
+        ident = f"part_{ident}"
+    if ident in RESERVED:
+        ident = f"{ident}_part"
+    return ident
+
+
+def _strip_code(text: str) -> str:
+    m = re.search(r"```(?:scad|openscad)?\s*([\s\S]*?)```", text, flags=re.IGNORECASE)
+    return (m.group(1) if m else text).strip()
+
+
+def parse_plan(text: str, max_parts: int = MAX_PARTS) -> list:
+    """
+    Subtasks from the planner's JSON answer (the outermost {...} in `text`),
+    in dependency order. A part may be just its name. Names become unique
+    SCAD identifiers that don't clash with OpenSCAD builtins, references to
+    unknown parts are dropped; a plan without usable parts, or with
+    cycles, raises ValueError.
+    """
+    start, end = text.find("{"), text.rfind("}") + 1
+    if start == -1 or end == 0:
+        raise ValueError("No JSON object in the plan")
+    plan = json.loads(text[start:end])
+    parts = plan.get("parts") if isinstance(plan, dict) else None
+    parts = [{"name": p, "description": p} if isinstance(p, str) else p
+             for p in (parts if isinstance(parts, list) else [])]
+    parts = [p for p in parts if isinstance(p, dict)]
+    if not parts:
+        raise ValueError("The plan has no parts")
+
+    subtasks, names = [], {}
+    for part in parts[:max_parts]:
+        ident = base = _identifier(part.get("name", "part"))
+        n = 2
+        while ident in names.values():
+            ident, n = f"{base}_{n}", n + 1
+        names[str(part.get("name", "part"))] = ident
+        deps = part.get("depends_on") or []
+        if not isinstance(deps, list):
+            deps = [deps] if isinstance(deps, str) else []
+        subtasks.append(Subtask(ident, str(part.get("description", "")).strip(), deps))
+    for task in subtasks:
+        deps = [names.get(str(d), _identifier(d)) for d in task.depends_on]
+        task.depends_on = [d for d in dict.fromkeys(deps) if d in names.values() and d != task.name]
+    return topological_order(subtasks)
+
+
+def topological_order(subtasks: list) -> list:
+    ordered, done = [], set()
+    pending = list(subtasks)
+    while pending:
+        ready = [t for t in pending if all(d in done for d in t.depends_on)]
+        if not ready:
+            raise ValueError("Cyclic dependencies between parts: "
+                             + ", ".join(t.name for t in pending))
+        for t in ready:
+            ordered.append(t)
+            done.add(t.name)
+        pending = [t for t in pending if t.name not in done]
+    return ordered
+
+
+def part_prompt(request: str, task: Subtask, parts: list) -> str:
+    by_name = {p.name: p for p in parts}
+    context = "".join(
+        f"\nIt must fit `{dep}`, which is already written:\n{by_name[dep].code}\n"
+        for dep in task.depends_on)
+    return PART_PROMPT.format(request=request, names=", ".join(p.name for p in parts),
+                              name=task.name, description=task.description,
+                              context=context + "\n" if context else "")
+
+
+def assembly_prompt(request: str, parts: list) -> str:
+    listing = "\n".join(f"- {p.name}(): {p.description}" for p in parts)
+    return ASSEMBLY_PROMPT.format(request=request, parts=listing)
+
+
+def _module_code(task: Subtask, text: str) -> str:
+    code = _strip_code(text)
+    if re.search(rf"\bmodule\s+{re.escape(task.name)}\s*\(", code):
+        return code
+    # the model answered with bare geometry: make it the module body
+    body = "\n".join("    " + line for line in code.splitlines())
+    return f"module {task.name}() {{\n{body}\n}}"
+
+
+def default_assembly(parts: list) -> str:
+    """
+    Union of the parts, leaving out those whose module another part's code
+    actually calls (depending on a part only means fitting it).
+    """
+    used = {d for p in parts for d in p.depends_on if _calls(p.code, d)}
+    roots = [p.name for p in parts if p.name not in used] or [p.name for p in parts]
+    return "union() {\n" + "".join(f"    {name}();\n" for name in roots) + "}"
+
+
+def _calls(code: str, name: str) -> bool:
+    # a call of module `name`, not a (copied) definition of it
+    code = re.sub(rf"\bmodule\s+{re.escape(name)}\s*\(", "", code)
+    return re.search(rf"\b{re.escape(name)}\s*\(", code) is not None
+
+
+def _assembly_code(text: str, parts: list) -> str:
+    code = _strip_code(text)
+    if not any(re.search(rf"\b{re.escape(p.name)}\s*\(", code) for p in parts):
+        return default_assembly(parts)
+    return code
+
+
+def decompose(request: str, complete: Callable[[str], str], max_workers: int = 4,
+              max_parts: int = MAX_PARTS, plan: Optional[list] = None) -> Design:
+    """
+    Plan `request` into parts, generate them concurrently as their
+    dependencies complete, and compose one SCAD design. `complete(prompt)`
+    is a blocking LLM call returning the answer text; it is called from
+    worker threads, in the caller's context (metrics spans nest). A plan
+    that can't be used makes the whole request a single part.
+    """
+    started = time.monotonic()
+    parts = plan
+    if not parts:
+        try:
+            parts = parse_plan(complete(PLAN_PROMPT.format(request=request, max_parts=max_parts)),
+                               max_parts)
+        except ValueError as exc:
+            print(f"Unusable plan, generating the design in one piece: {exc}")
+            parts = [Subtask("model", request)]
+    design = Design(request, parts)
+
+    def generate(task: Subtask):
+        t0 = time.monotonic()
+        task.code = _module_code(task, complete(part_prompt(request, task, parts)))
+        task.elapsed = time.monotonic() - t0
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="decompose") as pool:
+        assembly = pool.submit(contextvars.copy_context().run, complete, assembly_prompt(request, parts))
+        done, running = set(), {}
+        try:
+            while len(done) < len(parts):
+                for task in parts:
+                    if (task.name not in done and task.name not in running.values()
+                            and all(d in done for d in task.depends_on)):
+                        running[pool.submit(contextvars.copy_context().run, generate, task)] = task.name
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()  # re-raise a failed part
+                    done.add(running.pop(future))
+            try:
+                design.assembly = _assembly_code(assembly.result(), parts)
+            except Exception as exc:
+                print(f"Assembly generation failed, using a plain union: {exc}")
+                design.assembly = default_assembly(parts)
+        except BaseException:
+            for future in list(running) + [assembly]:
+                future.cancel()
+            raise
+
+    design.elapsed = time.monotonic() - started
+    return design
@@ -0,0 +1,224 @@
+"""
+Recover structured answers from reasoning-model output.
+
+DeepSeek-R1 style responses open with a long `<think>` block (sometimes
+without the opening tag) and often wrap the JSON answer in a markdown
+fence or some prose, so `json.loads(response)` fails on answers that are
+perfectly usable. `extract_answer` strips the reasoning, finds the
+outermost JSON object with the required keys and parses it tolerantly
+(raw newlines in strings, trailing commas, stray backslashes). When there
+is no usable JSON it falls back to the last fenced OpenSCAD block.
+
+    answer = extract_answer(response)
+    if answer is not None:
+        code, steps = answer["code_scad"], answer["chain_of_thought"]
+
+`ObjectScanner` is the incremental part: feed it text as it arrives and it
+returns each top-level `{...}` object as soon as it is complete.
+"""
+import json
+import re
+from typing import Optional
+
+_THINK_OPEN = re.compile(r"<think>", re.IGNORECASE)
+_THINK_CLOSE = re.compile(r"</think>", re.IGNORECASE)
+_FENCE = re.compile(r"```[ \t]*([\w+-]*)[ \t]*\n(.*?)```", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+# an escaped backslash, or a backslash that starts no valid JSON escape
+_BACKSLASH = re.compile(r'\\\\|\\(?!["\\/bfnrtu])')
+_SIGNIFICANT = re.compile(r'[{}"\\]')
+_OBJECT_START = re.compile(r'\{\s*["}]')
+_SCAD_HINT = re.compile(r"\b(cube|cylinder|sphere|difference|union|translate|module|linear_extrude|polygon)\s*\(")
+
+
+def split_reasoning(text: str) -> tuple:
+    """
+    (reasoning, answer). Everything up to the last `</think>` is reasoning,
+    opening tag or not; an unterminated `<think>` (a truncated response)
+    makes the rest of the text reasoning.
+    """
+    closes = list(_THINK_CLOSE.finditer(text))
+    if closes:
+        reasoning = _THINK_OPEN.sub("", text[:closes[-1].start()])
+        return reasoning.strip(), text[closes[-1].end():].strip()
+    opened = _THINK_OPEN.search(text)
+    if opened:
+        return text[opened.end():].strip(), text[:opened.start()].strip()
+    return "", text.strip()
+
+
+class ObjectScanner:
+    """
+    Finds top-level JSON objects in free text, one character at a time.
+    Braces inside string values (SCAD code is full of them) are skipped, so
+    an object is returned only when its own closing brace arrives.
+    """
+    def __init__(self):
+        self.depth = 0
+        self._in_string = False
+        self._escape = False
+        self._buffer: list = []
+
+    def feed(self, chunk: str) -> list:
+        """Texts of the objects completed by `chunk`."""
+        done = []
+        for ch in chunk:
+            if self.depth == 0:
+                if ch == "{":
+                    self.depth, self._buffer = 1, ["{"]
+                continue
+            self._buffer.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self.depth += 1
+            elif ch == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    done.append("".join(self._buffer))
+                    self._buffer = []
+        return done
+
+
+def loads_tolerant(text: str) -> tuple:
+    """
+    (value, repaired) for JSON as models write it, or (None, False).
+    Control characters inside strings are always accepted; trailing commas
+    and invalid backslash escapes are repaired if the plain parse fails.
+    """
+    try:
+        return json.loads(text, strict=False), False
+    except ValueError:
+        pass
+    repaired = _BACKSLASH.sub(lambda m: m.group() if len(m.group()) == 2 else "\\\\",
+                              _TRAILING_COMMA.sub(r"\1", text))
+    try:
+        return json.loads(repaired, strict=False), True
+    except ValueError:
+        return None, False
+
+
+def unfence(code: str) -> str:
+    """Code without a markdown fence around it, if it has one."""
+    m = _FENCE.search(code)
+    return m.group(2).strip() if m else code.strip()
+
+
+def fenced_blocks(text: str) -> list:
+    """(language, body) of every fenced code block, in order."""
+    return [(lang.lower(), body.strip()) for lang, body in _FENCE.findall(text)]
+
+
+def _steps(reasoning: str) -> list:
+    return [p.strip() for p in re.split(r"\n\s*\n", reasoning) if p.strip()]
+
+
+def _code(value) -> Optional[str]:
+    """code_scad as a string: a string, or a list of lines; anything else is unusable."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list) and all(isinstance(line, str) for line in value):
+        return "\n".join(value)
+    return None
+
+
+def _spans(text: str) -> tuple:
+    """
+    One pass over `text`: the (start, end) of every balanced {...}, at any
+    depth and in order of their opening brace, and the openings of
+    JSON-looking objects seen inside a string. Braces inside strings are
+    skipped and a stray brace in prose only nests what follows it, so an
+    object after it is still found.
+    """
+    spans, quoted, stack = [], [], []
+    in_string, skip = False, -1
+    for m in _SIGNIFICANT.finditer(text):
+        i, ch = m.start(), m.group()
+        if i == skip:
+            continue
+        if in_string:
+            if ch == "\\":
+                skip = i + 1
+            elif ch == '"':
+                in_string = False
+            elif ch == "{" and _OBJECT_START.match(text, i):
+                quoted.append(i)
+        elif ch == '"':
+            in_string = bool(stack)  # quotes in prose outside any braces don't count
+        elif ch == "{":
+            stack.append(i)
+        elif ch == "}" and stack:
+            spans.append((stack.pop(), i + 1))
+    spans.sort()
+    return spans, quoted
+
+
+def _json_answer(text: str, required: tuple) -> Optional[tuple]:
+    while True:
+        spans, quoted = _spans(text)
+        skip_to = 0
+        for start, end in spans:
+            if start < skip_to or not _OBJECT_START.match(text, start):
+                continue  # inside an object already read, or not JSON (SCAD blocks)
+            value, repaired = loads_tolerant(text[start:end])
+            if not isinstance(value, dict):
+                continue  # the objects nested in it are tried next
+            if "code_scad" in value:
+                value = {**value, "code_scad": _code(value["code_scad"])}
+            if all(value.get(key) for key in required):
+                return value, repaired
+            skip_to = end
+        if not quoted:
+            return None
+        # an unterminated string (a truncated object) hid the rest of the
+        # text; read on from the first object it swallowed
+        text = text[quoted[0]:]
+
+
+def _scad_answer(text: str) -> Optional[str]:
+    blocks = fenced_blocks(text)
+    for lang, body in reversed(blocks):
+        if lang in ("scad", "openscad"):
+            return body
+    for lang, body in reversed(blocks):
+        if lang in ("", "c", "cpp") and _SCAD_HINT.search(body):
+            return body
+    return None
+
+
+def extract_answer(text: str, required: tuple = ("code_scad",)) -> Optional[dict]:
+    """
+    The answer object in a model response, or None if nothing usable is
+    in it. The result has an "extraction" key: "json", "json_repaired"
+    or "fenced_scad". A missing "chain_of_thought" is filled from the
+    reasoning block, one step per paragraph.
+    """
+    if not text:
+        return None
+    reasoning, answer = split_reasoning(text)
+    # the answer part first; a truncated response may only have it in the reasoning
+    parts = [part for part in (answer, reasoning) if part]
+    for part in parts:
+        found = _json_answer(part, required)
+        if found is not None:
+            value, repaired = found
+            if value.get("code_scad"):
+                value["code_scad"] = unfence(value["code_scad"])
+            if not value.get("chain_of_thought") and reasoning:
+                value["chain_of_thought"] = _steps(reasoning)
+            value["extraction"] = "json_repaired" if repaired else "json"
+            return value
+    if tuple(required) != ("code_scad",):
+        return None  # a fenced block can only stand in for the code
+    for part in parts:
+        code = _scad_answer(part)
+        if code:
+            return {"code_scad": code, "chain_of_thought": _steps(reasoning), "extraction": "fenced_scad"}
+    return None
@@ -0,0 +1,97 @@
+"""
+Statistics and sanity checks for exported STL meshes.
+
+Used to verify a render beyond "OpenSCAD exited 0": the mesh must have
+triangles, a finite, non-degenerate bounding box and, when the prompt
+states overall dimensions ("40x20x10 mm"), roughly that size in some
+orientation.
+
+    stats = mesh_stats("part.stl")
+    ok, reason, score = verify(stats, expected_size(prompt))
+"""
+import math
+import os
+import re
+import struct
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+_BINARY_TRIANGLE = np.dtype([("normal", "<f4", 3), ("vertices", "<f4", (3, 3)), ("attr", "<u2")])
+_VERTEX = re.compile(rb"vertex\s+(\S+)\s+(\S+)\s+(\S+)")
+_DIMENSIONS = re.compile(
+    r"(\d+(?:\.\d+)?)\s*(?:mm)?\s*[x×*]\s*(\d+(?:\.\d+)?)\s*(?:mm)?\s*[x×*]\s*(\d+(?:\.\d+)?)",
+    re.IGNORECASE)
+
+
+@dataclass
+class MeshStats:
+    triangles: int
+    bbox_min: tuple = (0.0, 0.0, 0.0)
+    bbox_max: tuple = (0.0, 0.0, 0.0)
+    volume: float = 0.0
+
+    @property
+    def size(self) -> tuple:
+        return tuple(hi - lo for lo, hi in zip(self.bbox_min, self.bbox_max))
+
+    def to_dict(self) -> dict:
+        return {"triangles": self.triangles, "size": [round(v, 3) for v in self.size],
+                "bbox_min": [round(v, 3) for v in self.bbox_min],
+                "bbox_max": [round(v, 3) for v in self.bbox_max], "volume": round(self.volume, 3)}
+
+
+def _triangles(path: str) -> np.ndarray:
+    """(n, 3, 3) float array of triangle vertices from an ASCII or binary STL."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    if size >= 84:
+        (count,) = struct.unpack_from("<I", data, 80)
+        # a binary file may also start with "solid"; the length is what tells them apart
+        if size == 84 + count * _BINARY_TRIANGLE.itemsize:
+            return np.frombuffer(data, dtype=_BINARY_TRIANGLE, count=count, offset=84)["vertices"].astype(float)
+    if not data.lstrip().startswith(b"solid"):
+        raise ValueError(f"Not an STL file: {path}")
+    vertices = np.array(_VERTEX.findall(data), dtype=float)
+    return vertices[: len(vertices) // 3 * 3].reshape(-1, 3, 3)
+
+
+def mesh_stats(path: str) -> MeshStats:
+    tris = _triangles(path)
+    if not len(tris):
+        return MeshStats(0)
+    points = tris.reshape(-1, 3)
+    # divergence theorem: sum of signed tetrahedra against the origin
+    volume = float(np.einsum("ij,ij->i", tris[:, 0], np.cross(tris[:, 1], tris[:, 2])).sum() / 6.0)
+    return MeshStats(len(tris), tuple(points.min(axis=0).tolist()), tuple(points.max(axis=0).tolist()),
+                     abs(volume))
+
+
+def expected_size(text: str) -> Optional[tuple]:
+    """Overall dimensions stated as "A x B x C" in a prompt, or None."""
+    m = _DIMENSIONS.search(text or "")
+    return tuple(float(v) for v in m.groups()) if m else None
+
+
+def verify(stats: MeshStats, expected: Optional[tuple] = None, tolerance: float = 0.15) -> tuple:
+    """
+    (ok, reason, score) for a rendered mesh. The score ranks meshes that
+    failed only the size check: 0 is a perfect match, more negative is
+    further off.
+    """
+    if stats.triangles == 0:
+        return False, "empty mesh", -math.inf
+    size = stats.size
+    if not all(math.isfinite(v) for v in size) or min(size) <= 0:
+        return False, "degenerate bounding box", -math.inf
+    if not expected:
+        return True, "", 0.0
+    # orientation is up to the model, so compare sorted extents
+    error = max(abs(a - b) / b for a, b in zip(sorted(size), sorted(expected)) if b > 0)
+    if error > tolerance:
+        got = " x ".join(f"{v:g}" for v in size)
+        want = " x ".join(f"{v:g}" for v in expected)
+        return False, f"bounding box {got} does not match {want}", -error
+    return True, "", -error
@@ -0,0 +1,333 @@
+"""
+In-process metrics: counters, latency histograms and per-request spans.
+
+Every stage of a request (prompt build, provider call, SCAD stripping,
+validation, OpenSCAD render, file I/O) runs in a span. A span is timed into
+the `cad_stage_seconds{stage=...}` histogram, and finished spans go to any
+registered sinks, e.g. a buffered JSON-lines file for the batch scripts.
+Spans nest through a context variable, so a provider call made on the
+shared event loop (cad_common.aio) still belongs to the request that made
+it. `exposition()` renders everything in the Prometheus text format for a
+`/metrics` endpoint. Values are per process.
+
+    with metrics.trace("submit", provider="gpt"):
+        with metrics.span("validate") as s:
+            s.set(ok=checked.ok)
+    metrics.counter("cad_render_cache_total", "...").inc(result="hit")
+"""
+import atexit
+import contextvars
+import json
+import math
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: tuple, extra: Optional[tuple] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: dict = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_labels_key(labels), 0)
+
+    def samples(self) -> list:
+        with self._lock:
+            return [(self.name, key, None, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._values: dict = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(_labels_key(labels))
+        return entry[-1] if entry else 0
+
+    def totals(self, label: str) -> dict:
+        """{value of `label`: (count, sum)} over all series, e.g. time per stage."""
+        out: dict = {}
+        with self._lock:
+            for key, entry in self._values.items():
+                value = dict(key).get(label)
+                count, total = out.get(value, (0, 0.0))
+                out[value] = (count + entry[-1], total + entry[-2])
+        return out
+
+    def samples(self) -> list:
+        out = []
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                for bound, n in zip(self.buckets, entry):
+                    out.append((f"{self.name}_bucket", key, ("le", _format_value(bound)), n))
+                out.append((f"{self.name}_bucket", key, ("le", "+Inf"), entry[-1]))
+                out.append((f"{self.name}_sum", key, None, entry[-2]))
+                out.append((f"{self.name}_count", key, None, entry[-1]))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, help: str, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        return self._get(Counter, name, help)
+
+    def histogram(self, name: str, help: str = "", buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def exposition(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        for metric in metrics:
+            if metric.help:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{_format_labels(key, extra)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = REGISTRY.histogram("cad_stage_seconds", "Time spent per request stage")
+STAGE_ERRORS = REGISTRY.counter("cad_stage_errors_total", "Stages that raised")
+
+# provider calls, from cad_common.providers and from apps calling an SDK directly
+LLM_SECONDS = REGISTRY.histogram("cad_llm_request_seconds", "Provider call latency, including retries")
+LLM_FIRST_TOKEN = REGISTRY.histogram("cad_llm_first_token_seconds", "Time to the first streamed token")
+LLM_TOKENS = REGISTRY.counter("cad_llm_tokens_total", "Tokens sent and received (estimated when streaming)")
+LLM_ERRORS = REGISTRY.counter("cad_llm_errors_total", "Provider calls that failed after retries")
+
+
+def counter(name: str, help: str = "") -> Counter:
+    return REGISTRY.counter(name, help)
+
+
+def histogram(name: str, help: str = "", buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.histogram(name, help, buckets)
+
+
+def exposition() -> str:
+    return REGISTRY.exposition()
+
+
+def record_llm(provider: str, model: str, seconds: float,
+               tokens_in: Optional[int] = None, tokens_out: Optional[int] = None):
+    LLM_SECONDS.observe(seconds, provider=provider, model=model)
+    LLM_TOKENS.inc(tokens_in or 0, provider=provider, model=model, direction="in")
+    LLM_TOKENS.inc(tokens_out or 0, provider=provider, model=model, direction="out")
+
+
+# ------------------------------------------------------------------ spans
+class Span:
+    def __init__(self, stage: str, trace_id: str, parent: Optional[str], attrs: dict):
+        self.stage = stage
+        self.trace_id = trace_id
+        self.id = uuid.uuid4().hex[:16]
+        self.parent = parent
+        self.attrs = attrs
+        self.start = time.time()
+        self._t0 = time.monotonic()
+        self.duration: Optional[float] = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.duration = time.monotonic() - self._t0
+        STAGE_SECONDS.observe(self.duration, stage=self.stage)
+        if error is not None:
+            STAGE_ERRORS.inc(stage=self.stage)
+            self.attrs.setdefault("error", type(error).__name__)
+        _emit(self.to_dict())
+
+    def to_dict(self) -> dict:
+        return {"trace": self.trace_id, "span": self.id, "parent": self.parent, "stage": self.stage,
+                "start": round(self.start, 6), "seconds": round(self.duration or 0.0, 6), **self.attrs}
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("cad_metrics_span", default=None)
+_sinks: list = []
+
+
+def current() -> Optional[Span]:
+    return _current.get()
+
+
+def start_span(stage: str, parent: Optional[Span] = None, **attrs) -> Span:
+    """
+    A span under `parent` (default: the current span), not made current
+    itself: for code that cannot use a `with` block, e.g. across the yields
+    of a generator. Call finish() on it.
+    """
+    parent = parent or _current.get()
+    return Span(stage, parent.trace_id if parent else uuid.uuid4().hex, parent.id if parent else None, attrs)
+
+
+@contextmanager
+def span(stage: str, parent: Optional[Span] = None, **attrs):
+    """
+    Time a stage of the current request; yields the Span for set(). Pass
+    `parent` to continue a trace in another task.
+    """
+    s = start_span(stage, parent, **attrs)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as exc:
+        s.finish(exc)
+        raise
+    else:
+        s.finish()
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def trace(stage: str, **attrs):
+    """Like span(), but always starts a new trace (one per request or batch row)."""
+    token = _current.set(None)
+    try:
+        with span(stage, **attrs) as s:
+            yield s
+    finally:
+        _current.reset(token)
+
+
+def stage_summary() -> str:
+    """One line with the total time per stage, slowest first."""
+    totals = sorted(STAGE_SECONDS.totals("stage").items(), key=lambda item: -item[1][1])
+    return ", ".join(f"{stage} {total:.1f}s ({count}x)" for stage, (count, total) in totals)
+
+
+def add_sink(sink):
+    """Send finished spans to `sink.write(record)`, e.g. a JsonlSink."""
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def _emit(record: dict):
+    for sink in list(_sinks):
+        try:
+            sink.write(record)
+        except Exception as exc:
+            print(f"Metrics sink {sink!r} failed: {exc}")
+
+
+class JsonlSink:
+    """
+    Buffered JSON-lines writer: records are written out every `buffer_size`
+    records or `flush_interval` seconds, and on close/exit, so logging costs
+    no write per event.
+    """
+
+    def __init__(self, path: str, buffer_size: int = 256, flush_interval: float = 5.0):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._fh = open(path, "a", encoding="utf-8")
+        self._buffer: list = []
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self._buffer.append(line)
+            if (len(self._buffer) >= self.buffer_size
+                    or time.monotonic() - self._flushed >= self.flush_interval):
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._fh is None:
+            return
+        if self._buffer:
+            self._fh.writelines(self._buffer)
+            self._buffer.clear()
+            self._fh.flush()
+        self._flushed = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+        remove_sink(self)
+
+    def __repr__(self):
+        return f"JsonlSink({self.path!r})"
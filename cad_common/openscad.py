@@ -0,0 +1,89 @@
+"""
+Thin wrapper around the OpenSCAD CLI with timeouts and cancellation.
+
+Unlike openscad_runner.OpenScadRunner this exposes the child process while
+it runs (so a job can kill it) and always captures stderr.
+"""
+import os
+import subprocess
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from . import metrics
+from .params import format_defines
+
+OPENSCAD = os.getenv("OPENSCAD", "openscad")
+IMAGE_EXTS = {"png", "gif"}
+
+OPENSCAD_RUNS = metrics.counter("cad_openscad_runs_total", "OpenSCAD processes by output format and outcome")
+
+
+@dataclass
+class RenderResult:
+    ok: bool
+    path: Optional[str] = None
+    cache_hit: bool = False
+    returncode: Optional[int] = None
+    stderr: str = ""
+    elapsed: float = 0.0
+    timed_out: bool = False
+    cancelled: bool = False
+
+
+def build_command(scad_path: str, out_path: str, mode: str = "preview",
+                  imgsize=(800, 600), defines: Optional[dict] = None) -> list:
+    """
+    `defines` ({name: number}) become `-D name=value` overrides of the
+    file's top-level assignments.
+    """
+    cmd = [OPENSCAD, "-o", out_path] + format_defines(defines)
+    ext = os.path.splitext(out_path)[1].lstrip(".").lower()
+    if ext in IMAGE_EXTS:
+        cmd += [f"--imgsize={int(imgsize[0])},{int(imgsize[1])}",
+                "--view=axes,scales", "--projection=p"]
+        cmd.append("--render" if mode == "render" else "--preview")
+    cmd.append(scad_path)
+    return cmd
+
+
+def run(cmd: list, out_path: str, timeout: Optional[float] = None,
+        on_start: Optional[Callable[[subprocess.Popen], None]] = None,
+        is_cancelled: Optional[Callable[[], bool]] = None) -> RenderResult:
+    """
+    Run OpenSCAD and wait for it. `on_start` receives the Popen handle so
+    the caller can kill it to cancel; `is_cancelled` distinguishes that from
+    a crash afterwards.
+    """
+    fmt = os.path.splitext(out_path)[1].lstrip(".").lower()
+    with metrics.span("openscad_render", format=fmt) as span:
+        result = _run(cmd, out_path, timeout, on_start, is_cancelled)
+        outcome = ("ok" if result.ok else "timeout" if result.timed_out
+                   else "cancelled" if result.cancelled else "error")
+        span.set(outcome=outcome)
+    OPENSCAD_RUNS.inc(format=fmt, outcome=outcome)
+    return result
+
+
+def _run(cmd, out_path, timeout, on_start, is_cancelled) -> RenderResult:
+    started = time.monotonic()
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                text=True, errors="replace")
+    except FileNotFoundError:
+        return RenderResult(False, stderr=f"OpenSCAD executable not found: {cmd[0]}")
+    if on_start is not None:
+        on_start(proc)
+    timed_out = False
+    try:
+        _, stderr = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        _, stderr = proc.communicate()
+        timed_out = True
+    cancelled = bool(is_cancelled and is_cancelled())
+    ok = (proc.returncode == 0 and not timed_out and not cancelled
+          and os.path.exists(out_path) and os.path.getsize(out_path) > 0)
+    return RenderResult(ok, out_path if ok else None, returncode=proc.returncode,
+                        stderr=stderr or "", elapsed=time.monotonic() - started,
+                        timed_out=timed_out, cancelled=cancelled)
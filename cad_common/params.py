@@ -0,0 +1,203 @@
+"""
+Parameter schema for generated SCAD, for re-rendering without the LLM.
+
+`lift_literals` moves literal dimensions of primitives (cube size,
+cylinder h/r/d, sphere r/d) into top-level variables. `parameters` then
+lists every top-level numeric assignment with a slider range. Overrides go
+to OpenSCAD as `-D name=value`, which replaces the assignment, so a tweak
+is one (usually cached) render and no model call.
+
+    code = lift_literals(code)
+    schema = parameters(code)
+    defines = resolve_overrides(schema, {"cube1_x": 120})
+"""
+import math
+import re
+from typing import Optional
+
+from .scad_lint import LintError, tokenize
+
+MAX_LIFTED = 24
+
+# positional and named arguments that are plain dimensions
+PRIMITIVE_DIMS = {
+    "cube": (["size"], {"size"}),
+    "sphere": (["r"], {"r", "d"}),
+    "cylinder": (["h", "r1", "r2"], {"h", "r", "r1", "r2", "d", "d1", "d2"}),
+    "square": (["size"], {"size"}),
+    "circle": (["r"], {"r", "d"}),
+}
+AXES = "xyz"
+
+_NAME = re.compile(r"\$?[A-Za-z_]\w*")
+
+
+def _offsets(code: str) -> list:
+    starts = [0]
+    for i, c in enumerate(code):
+        if c == "\n":
+            starts.append(i + 1)
+    return starts
+
+
+def _number(text: str):
+    value = float(text)
+    return int(value) if value.is_integer() and re.fullmatch(r"\d+", text) else value
+
+
+def lift_literals(code: str, max_lifted: int = MAX_LIFTED) -> str:
+    """
+    Replace literal dimensions in primitive calls by top-level variables
+    declared at the top of the file. Returns `code` unchanged if it cannot
+    be tokenised or has nothing to lift.
+    """
+    try:
+        tokens = tokenize(code)
+    except LintError:
+        return code
+    taken = {t.value for t in tokens if t.kind == "id"}
+    counters: dict = {}
+    lifted = []  # (token, name)
+    stack = []  # open brackets: [kind, call, arg_index, arg_name]
+
+    for i, tok in enumerate(tokens):
+        if tok.kind != "op" and tok.kind != "num":
+            continue
+        if tok.kind == "op":
+            if tok.value == "(":
+                prev = tokens[i - 1] if i else None
+                call = prev.value if prev is not None and prev.kind == "id" and prev.value in PRIMITIVE_DIMS else None
+                if call:
+                    counters[call] = counters.get(call, 0) + 1
+                    call = f"{call}{counters[call]}", call
+                stack.append(["(", call, 0, None])
+            elif tok.value in "[{":
+                stack.append([tok.value, None, 0, None])
+            elif tok.value in ")]}" and stack:
+                stack.pop()
+            elif tok.value == "," and stack:
+                stack[-1][2] += 1
+                if stack[-1][0] == "(":
+                    stack[-1][3] = None
+            elif tok.value == "=" and stack and stack[-1][0] == "(" and tokens[i - 1].kind == "id":
+                stack[-1][3] = tokens[i - 1].value
+            continue
+
+        # a number that is a whole argument, or a whole element of a vector argument
+        if len(lifted) >= max_lifted or not stack:
+            continue
+        before, after = tokens[i - 1], tokens[i + 1]
+        if before.kind != "op" or before.value not in "(,=[" or after.kind != "op" or after.value not in ",)]":
+            continue
+        frame, element = stack[-1], None
+        if frame[0] == "[" and len(stack) > 1 and stack[-2][0] == "(" and before.value in "[,":
+            frame, element = stack[-2], frame[2]
+        elif frame[0] != "(":
+            continue
+        if not frame[1]:
+            continue
+        (label, call), (positional, named) = frame[1], PRIMITIVE_DIMS[frame[1][1]]
+        arg = frame[3] or (positional[frame[2]] if frame[2] < len(positional) else None)
+        if arg is None or arg not in named:
+            continue
+        name = f"{label}_{arg}" if element is None else f"{label}_{AXES[element] if element < 3 else element}"
+        if name in taken:
+            continue
+        taken.add(name)
+        lifted.append((tok, name))
+
+    if not lifted:
+        return code
+    starts = _offsets(code)
+    out, pos = [], 0
+    for tok, name in lifted:
+        offset = starts[tok.line - 1] + tok.col - 1
+        out.append(code[pos:offset])
+        out.append(name)
+        pos = offset + len(tok.value)
+    out.append(code[pos:])
+    header = "".join(f"{name} = {tok.value};\n" for tok, name in lifted)
+    return f"// Parameters\n{header}\n" + "".join(out)
+
+
+def _range(value, integer: bool) -> tuple:
+    magnitude = abs(value)
+    step = 10 ** (math.floor(math.log10(magnitude)) - 2) if magnitude else 0.1
+    if integer:
+        step = max(1, int(step))
+    if value > 0:
+        return step, max(2 * value, 1), step
+    if value < 0:
+        return 2 * value, -value, step
+    return -10, 10, step
+
+
+def parameters(code: str) -> list:
+    """
+    Top-level `name = <number>;` assignments as
+    [{"name", "value", "min", "max", "step"}], in file order. A later
+    assignment to the same name wins, as in OpenSCAD.
+    """
+    try:
+        tokens = tokenize(code)
+    except LintError:
+        return []
+    found: dict = {}
+    depth = 0
+    for i, tok in enumerate(tokens):
+        if tok.kind == "op" and tok.value in "([{":
+            depth += 1
+        elif tok.kind == "op" and tok.value in ")]}":
+            depth -= 1
+        if depth or tok.kind != "id":
+            continue
+        prev = tokens[i - 1] if i else None
+        if prev is not None and not (prev.kind == "op" and prev.value in ";}"):
+            continue
+        rest = tokens[i + 1:i + 5]
+        sign = 1
+        if len(rest) > 2 and rest[1].kind == "op" and rest[1].value == "-":
+            sign, rest = -1, rest[:1] + rest[2:]
+        if (len(rest) >= 3 and rest[0].value == "=" and rest[1].kind == "num"
+                and rest[2].kind == "op" and rest[2].value == ";"):
+            value = sign * _number(rest[1].value)
+            integer = isinstance(value, int)
+            low, high, step = _range(value, integer)
+            if tok.value == "$fn":
+                low = 3
+            found.pop(tok.value, None)
+            found[tok.value] = {"name": tok.value, "value": value, "min": low, "max": high, "step": step}
+    return list(found.values())
+
+
+def resolve_overrides(schema: list, overrides: Optional[dict]) -> dict:
+    """
+    Validated `-D` defines for `overrides` ({name: number}): names must be
+    in the schema and values finite numbers. Values equal to the defaults are
+    dropped, so an untouched slider maps to the cached base render.
+    """
+    defaults = {p["name"]: p["value"] for p in schema}
+    defines = {}
+    for name, value in (overrides or {}).items():
+        if name not in defaults:
+            raise ValueError(f"Unknown parameter: {name}")
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Parameter {name} must be a number") from None
+        if not math.isfinite(value):
+            raise ValueError(f"Parameter {name} must be finite")
+        if value == defaults[name]:
+            continue
+        defines[name] = int(value) if value.is_integer() else value
+    return defines
+
+
+def format_defines(defines: Optional[dict]) -> list:
+    """OpenSCAD command line arguments for {name: number}."""
+    args = []
+    for name, value in sorted((defines or {}).items()):
+        if not _NAME.fullmatch(name) or isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"Invalid define {name}={value!r}")
+        args += ["-D", f"{name}={value!r}"]
+    return args
@@ -0,0 +1,504 @@
+"""
+Pluggable async LLM provider clients (OpenAI, Anthropic, Together, Gemini).
+
+Every provider posts through one pooled aiohttp session per event loop, so
+TLS handshakes and keep-alive connections are reused, and shares the
+per-model RateLimiter from cad_common.ratelimit. Throttling and transient
+server errors are retried with non-blocking backoff.
+
+    provider = get_provider("claude", "claude-3-5-sonnet-latest")
+    completion = await provider.complete(user_msg, system=SYSTEM_PROMPT)
+
+    async for delta in provider.stream(user_msg, system=SYSTEM_PROMPT):
+        ...
+"""
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+import aiohttp
+
+from . import metrics
+from .ratelimit import (
+    ModelLimits, RETRYABLE_STATUSES, backoff_delay, estimate_tokens,
+    get_limiter, parse_retry_after,
+)
+
+# defaults for interactive use; batch scripts pass their own ModelLimits
+DEFAULT_LIMITS = ModelLimits(requests_per_second=10, initial_concurrency=8, max_concurrency=64)
+
+
+class ProviderError(RuntimeError):
+    def __init__(self, provider: str, status: int, body):
+        super().__init__(f"{provider} error {status}: {body}")
+        self.provider = provider
+        self.status = status
+        self.body = body
+
+
+@dataclass
+class Completion:
+    text: str
+    provider: str
+    model: str
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    latency: float = 0.0
+
+    @property
+    def total_tokens(self) -> Optional[int]:
+        if self.prompt_tokens is None or self.completion_tokens is None:
+            return None
+        return self.prompt_tokens + self.completion_tokens
+
+
+_SESSIONS: dict = {}
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Pooled keep-alive session bound to the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    session = _SESSIONS.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=100, limit_per_host=32,
+                                         keepalive_timeout=60, ttl_dns_cache=300)
+        session = aiohttp.ClientSession(connector=connector)
+        _SESSIONS[loop] = session
+    return session
+
+
+async def close_session():
+    session = _SESSIONS.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+class Provider:
+    """
+    Base class: subclasses describe the wire format, this class does the
+    HTTP, rate limiting and retries.
+    """
+    name = ""
+    display_name = ""
+    env_key = ""
+    base_url = ""
+    base_url_env = ""  # e.g. point OPENAI_BASE_URL at bench/stub_server.py
+
+    def __init__(self, model: str, api_key: Optional[str] = None,
+                 limits: Optional[ModelLimits] = None, timeout: float = 90,
+                 max_attempts: int = 4, base_url: Optional[str] = None):
+        self.model = model
+        self._api_key = api_key
+        self.base_url = (base_url or os.getenv(self.base_url_env) or self.base_url).rstrip("/")
+        self.limiter = get_limiter(f"{self.name}:{model}", limits, default=DEFAULT_LIMITS)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_attempts = max_attempts
+
+    @property
+    def api_key(self) -> str:
+        key = self._api_key or os.getenv(self.env_key)
+        if not key:
+            raise ValueError(f"{self.env_key} not configured")
+        return key
+
+    # -- wire format -------------------------------------------------------
+    def url(self) -> str:
+        raise NotImplementedError
+
+    def headers(self) -> dict:
+        raise NotImplementedError
+
+    def payload(self, prompt: str, system: Optional[str], temperature: Optional[float],
+                max_tokens: int, **extra) -> dict:
+        raise NotImplementedError
+
+    def parse(self, data: dict) -> Completion:
+        raise NotImplementedError
+
+    def parse_all(self, data: dict) -> list:
+        """Every choice in a response; usage is for the whole request."""
+        return [self.parse(data)]
+
+    def stream_url(self) -> str:
+        return self.url()
+
+    def stream_payload(self, payload: dict) -> dict:
+        return {**payload, "stream": True}
+
+    def parse_delta(self, event: dict) -> str:
+        """Text carried by one decoded server-sent event ("" if none)."""
+        raise NotImplementedError
+
+    # -- transport ---------------------------------------------------------
+    async def complete(self, prompt: str, system: Optional[str] = None,
+                       temperature: Optional[float] = None, max_tokens: int = 2048,
+                       **extra) -> Completion:
+        payload = self.payload(prompt, system, temperature, max_tokens, **extra)
+        return (await self._complete(payload, estimate_tokens(system, prompt) + max_tokens))[0]
+
+    async def complete_n(self, prompt: str, n: int, system: Optional[str] = None,
+                         temperature: Optional[float] = None, max_tokens: int = 2048,
+                         **extra) -> list:
+        """
+        `n` independent completions of one prompt, sampled concurrently.
+        Calls that fail are dropped; raises only when every call failed.
+        Providers whose API samples several choices per request override
+        this with a single call.
+        """
+        results = await asyncio.gather(
+            *(self.complete(prompt, system, temperature, max_tokens, **extra) for _ in range(n)),
+            return_exceptions=True)
+        completions = [r for r in results if isinstance(r, Completion)]
+        if not completions:
+            raise results[0]
+        return completions
+
+    async def _complete(self, payload: dict, estimate: int) -> list:
+        started = time.monotonic()
+        with metrics.span("llm_call", provider=self.name, model=self.model) as span:
+            try:
+                data = await self._post(self.url(), payload, estimate, lambda d: self.parse(d).total_tokens)
+            except Exception:
+                metrics.LLM_ERRORS.inc(provider=self.name, model=self.model)
+                raise
+            usage = self.parse(data)
+            completions = self.parse_all(data)
+            for completion in completions:
+                completion.latency = time.monotonic() - started
+            span.set(tokens_in=usage.prompt_tokens, tokens_out=usage.completion_tokens)
+        metrics.record_llm(self.name, self.model, time.monotonic() - started,
+                           usage.prompt_tokens, usage.completion_tokens)
+        return completions
+
+    async def stream(self, prompt: str, system: Optional[str] = None,
+                     temperature: Optional[float] = None, max_tokens: int = 2048,
+                     **extra) -> AsyncIterator[str]:
+        """
+        Yield the completion text as it is generated. Throttling and
+        transient errors are retried like complete() as long as nothing has
+        been yielded yet; after the first token an error is raised as is.
+        """
+        payload = self.stream_payload(self.payload(prompt, system, temperature, max_tokens, **extra))
+        # a generator may be resumed from different tasks, so the span is
+        # finished by hand instead of being made current
+        span = metrics.start_span("llm_stream", provider=self.name, model=self.model)
+        tokens_in = estimate_tokens(system, prompt)
+        t0, chars = time.monotonic(), 0
+        deltas = self._stream(payload, tokens_in + max_tokens)
+        try:
+            async for delta in deltas:
+                if not chars:
+                    span.set(first_token=round(time.monotonic() - t0, 6))
+                    metrics.LLM_FIRST_TOKEN.observe(time.monotonic() - t0, provider=self.name, model=self.model)
+                chars += len(delta)
+                yield delta
+        except BaseException as exc:
+            if isinstance(exc, Exception):  # not a cancellation or an early close
+                metrics.LLM_ERRORS.inc(provider=self.name, model=self.model)
+            span.set(tokens_in=tokens_in, tokens_out=chars // 4)
+            span.finish(exc)
+            raise
+        finally:
+            await deltas.aclose()
+        span.set(tokens_in=tokens_in, tokens_out=chars // 4)
+        span.finish()
+        metrics.record_llm(self.name, self.model, time.monotonic() - t0, tokens_in, chars // 4)
+
+    async def _stream(self, payload: dict, estimate: int) -> AsyncIterator[str]:
+        headers = self.headers()
+        session = get_session()
+        # no total timeout: a long answer may legitimately stream for minutes,
+        # so only the gap between chunks is bounded
+        timeout = aiohttp.ClientTimeout(sock_connect=self.timeout.total, sock_read=self.timeout.total)
+        started = False
+        for attempt in range(self.max_attempts):
+            retry_after = None
+            async with self.limiter.slot(estimate) as ticket:
+                try:
+                    async with session.post(self.stream_url(), headers=headers, json=payload,
+                                            timeout=timeout) as resp:
+                        if resp.status == 200:
+                            async for event in _sse_events(resp.content):
+                                delta = self.parse_delta(event)
+                                if delta:
+                                    started = True
+                                    yield delta
+                            ticket.success()
+                            return
+                        body = await resp.text()
+                        error = ProviderError(self.display_name, resp.status, body)
+                        if resp.status not in RETRYABLE_STATUSES:
+                            ticket.failed()
+                            raise error
+                        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                        if resp.status == 429:
+                            ticket.throttled(retry_after)
+                        else:
+                            ticket.failed()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                    ticket.failed()
+                    if started:
+                        raise  # a retry would repeat text the caller already has
+                    error = exc
+            if attempt + 1 < self.max_attempts:
+                await asyncio.sleep(retry_after if retry_after is not None else backoff_delay(attempt))
+        raise error
+
+    async def _post(self, url: str, payload: dict, estimate: int, tokens_used=None) -> dict:
+        """
+        POST `payload` under the rate limiter, retrying throttling and
+        transient errors. `tokens_used(data)` reports real usage back to the
+        token budget. Returns the decoded JSON body.
+        """
+        headers = self.headers()
+        session = get_session()
+        for attempt in range(self.max_attempts):
+            retry_after = None
+            async with self.limiter.slot(estimate) as ticket:
+                try:
+                    async with session.post(url, headers=headers, json=payload,
+                                            timeout=self.timeout) as resp:
+                        if resp.status == 200:
+                            data = await resp.json()
+                            ticket.success(tokens_used(data) if tokens_used else None)
+                            return data
+                        try:
+                            body = await resp.json()
+                        except (aiohttp.ContentTypeError, ValueError):
+                            body = await resp.text()
+                        error = ProviderError(self.display_name, resp.status, body)
+                        if resp.status not in RETRYABLE_STATUSES:
+                            ticket.failed()
+                            raise error
+                        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                        if resp.status == 429:
+                            ticket.throttled(retry_after)
+                        else:
+                            ticket.failed()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                    ticket.failed()
+                    error = exc
+            if attempt + 1 < self.max_attempts:
+                await asyncio.sleep(retry_after if retry_after is not None else backoff_delay(attempt))
+        raise error
+
+
+async def _sse_events(content: aiohttp.StreamReader) -> AsyncIterator[dict]:
+    """
+    Decode a text/event-stream body into the JSON objects carried by its
+    `data:` fields, stopping at OpenAI's `[DONE]` sentinel.
+    """
+    data = []
+    async for raw in content:
+        line = raw.decode("utf-8").rstrip("\r\n")
+        if line.startswith("data:"):
+            data.append(line[5:].lstrip())
+            continue
+        if line or not data:
+            continue  # event:/id: fields, comments, keep-alives
+        chunk, data = "\n".join(data), []
+        if chunk == "[DONE]":
+            return
+        yield json.loads(chunk)
+    if data and data != ["[DONE]"]:
+        yield json.loads("\n".join(data))
+
+
+class OpenAIProvider(Provider):
+    name = "openai"
+    display_name = "OpenAI"
+    env_key = "OPENAI_API_KEY"
+    base_url = "https://api.openai.com/v1"
+    base_url_env = "OPENAI_BASE_URL"
+
+    def url(self):
+        return f"{self.base_url}/chat/completions"
+
+    def headers(self):
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        }
+
+    def payload(self, prompt, system, temperature, max_tokens, **extra):
+        messages = []
+        if system:
+            messages.append({"role": "system", "content": system})
+        messages.append({"role": "user", "content": prompt})
+        payload = {"model": self.model, "messages": messages, "max_tokens": max_tokens}
+        if temperature is not None:
+            payload["temperature"] = temperature
+        payload.update(extra)
+        return payload
+
+    def parse(self, data):
+        usage = data.get("usage") or {}
+        content = (data.get("choices") or [{}])[0].get("message", {}).get("content") or ""
+        return Completion(content, self.name, self.model,
+                          usage.get("prompt_tokens"), usage.get("completion_tokens"))
+
+    def parse_all(self, data):
+        usage = data.get("usage") or {}
+        return [Completion(choice.get("message", {}).get("content") or "", self.name, self.model,
+                           usage.get("prompt_tokens"), usage.get("completion_tokens"))
+                for choice in data.get("choices") or [{}]]
+
+    async def complete_n(self, prompt, n, system=None, temperature=None, max_tokens=2048, **extra):
+        # one request samples every choice, so the prompt is sent and billed once
+        payload = self.payload(prompt, system, temperature, max_tokens, n=n, **extra)
+        return await self._complete(payload, estimate_tokens(system, prompt) + n * max_tokens)
+
+    def parse_delta(self, event):
+        choices = event.get("choices") or [{}]
+        return (choices[0].get("delta") or {}).get("content") or ""
+
+    async def embed(self, text: str, dimensions: Optional[int] = None) -> list:
+        """
+        Embedding vector for `text`; `self.model` must be an embedding model.
+        """
+        payload = {"model": self.model, "input": text}
+        if dimensions:
+            payload["dimensions"] = dimensions
+        data = await self._post(f"{self.base_url}/embeddings", payload, estimate_tokens(text),
+                                lambda d: (d.get("usage") or {}).get("total_tokens"))
+        return data["data"][0]["embedding"]
+
+
+class TogetherProvider(OpenAIProvider):
+    # OpenAI-compatible chat completions
+    name = "together"
+    display_name = "Together"
+    env_key = "TOGETHER_API_KEY"
+    base_url = "https://api.together.xyz/v1"
+    base_url_env = "TOGETHER_BASE_URL"
+
+
+class AnthropicProvider(Provider):
+    name = "anthropic"
+    display_name = "Anthropic"
+    env_key = "CLAUDE_API_KEY"
+    base_url = "https://api.anthropic.com/v1"
+    base_url_env = "ANTHROPIC_BASE_URL"
+
+    def url(self):
+        return f"{self.base_url}/messages"
+
+    def headers(self):
+        return {
+            "x-api-key": self.api_key,
+            "anthropic-version": "2023-06-01",
+            "content-type": "application/json",
+            "accept": "application/json",
+        }
+
+    def payload(self, prompt, system, temperature, max_tokens, **extra):
+        payload = {
+            "model": self.model,
+            "max_tokens": max_tokens,
+            # Send content as a simple string for maximal compatibility
+            "messages": [{"role": "user", "content": prompt}],
+        }
+        if system:
+            payload["system"] = system
+        if temperature is not None:
+            payload["temperature"] = temperature
+        payload.update(extra)
+        return payload
+
+    def parse(self, data):
+        usage = data.get("usage") or {}
+        parts = data.get("content", [])
+        text = "".join(p.get("text", "") for p in parts if p.get("type") == "text")
+        return Completion(text, self.name, self.model,
+                          usage.get("input_tokens"), usage.get("output_tokens"))
+
+    def parse_delta(self, event):
+        if event.get("type") == "error":
+            raise ProviderError(self.display_name, 200, event.get("error"))
+        if event.get("type") != "content_block_delta":
+            return ""
+        return event.get("delta", {}).get("text", "")
+
+
+class GeminiProvider(Provider):
+    name = "gemini"
+    display_name = "Gemini"
+    env_key = "GEMINI_API_KEY"
+    base_url = "https://generativelanguage.googleapis.com/v1beta"
+    base_url_env = "GEMINI_BASE_URL"
+
+    def url(self):
+        return f"{self.base_url}/models/{self.model}:generateContent"
+
+    def stream_url(self):
+        return f"{self.base_url}/models/{self.model}:streamGenerateContent?alt=sse"
+
+    def stream_payload(self, payload):
+        return payload  # streaming is selected by the URL
+
+    def headers(self):
+        return {"x-goog-api-key": self.api_key, "Content-Type": "application/json"}
+
+    def payload(self, prompt, system, temperature, max_tokens, **extra):
+        config = {"maxOutputTokens": max_tokens}
+        if temperature is not None:
+            config["temperature"] = temperature
+        payload = {
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+            "generationConfig": config,
+        }
+        if system:
+            payload["system_instruction"] = {"parts": [{"text": system}]}
+        payload.update(extra)
+        return payload
+
+    def parse(self, data):
+        usage = data.get("usageMetadata") or {}
+        candidate = (data.get("candidates") or [{}])[0]
+        parts = candidate.get("content", {}).get("parts", [])
+        text = "".join(p.get("text", "") for p in parts)
+        return Completion(text, self.name, self.model,
+                          usage.get("promptTokenCount"), usage.get("candidatesTokenCount"))
+
+    def parse_delta(self, event):
+        return self.parse(event).text
+
+
+PROVIDERS = {
+    "openai": OpenAIProvider,
+    "gpt": OpenAIProvider,
+    "anthropic": AnthropicProvider,
+    "claude": AnthropicProvider,
+    "together": TogetherProvider,
+    "deepseek": TogetherProvider,
+    "gemini": GeminiProvider,
+}
+
+_INSTANCES: dict = {}
+
+
+def get_provider(name: str, model: str, **kwargs) -> Provider:
+    """
+    Shared provider instance for (name, model), created with `kwargs` on
+    first use; later calls may leave them out. Raises ValueError for an
+    unknown provider name, or for kwargs that differ from the ones the
+    instance was created with.
+    """
+    key = ((name or "").lower(), model)
+    if key not in _INSTANCES:
+        try:
+            cls = PROVIDERS[key[0]]
+        except KeyError:
+            raise ValueError(f"Unsupported provider: {name}") from None
+        _INSTANCES[key] = (cls(model, **kwargs), kwargs)
+    provider, created_with = _INSTANCES[key]
+    if kwargs and kwargs != created_with:
+        raise ValueError(f"Provider {name}:{model} already exists with other settings "
+                         f"({sorted(created_with)} vs {sorted(kwargs)})")
+    return provider
@@ -0,0 +1,202 @@
+"""
+Async rate limiting for LLM provider calls.
+
+Each model gets a RateLimiter combining:
+  * a request bucket (requests/second),
+  * an optional token bucket (tokens/minute), charged with an estimate up
+    front and settled against the real usage afterwards,
+  * AIMD concurrency: the number of in-flight requests grows by one per
+    window of successes and is halved when the provider throttles us,
+  * a shared pause honouring Retry-After, so one 429 stops every worker
+    instead of each of them hammering the endpoint.
+"""
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+# statuses worth retrying; everything else is a permanent failure
+RETRYABLE_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+@dataclass
+class ModelLimits:
+    requests_per_second: float = 3.0
+    tokens_per_minute: Optional[float] = None
+    initial_concurrency: int = 3
+    max_concurrency: int = 32
+
+
+class TokenBucket:
+    """
+    Classic token bucket. Waiters sleep exactly as long as the deficit
+    needs instead of polling.
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        # a request bigger than the bucket would never fit; let it through on a full bucket
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, delta: float):
+        """
+        Give back (positive) or charge (negative) tokens after the fact.
+        The balance may go negative, which delays the next acquirers.
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + delta)
+
+
+class AdaptiveConcurrency:
+    """
+    Additive-increase / multiplicative-decrease limit on in-flight requests.
+    """
+    def __init__(self, initial: int = 3, minimum: int = 1, maximum: int = 32,
+                 decrease: float = 0.5):
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.in_flight = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self):
+        # +1 slot per full window of successes
+        self.limit = min(self.maximum, self.limit + 1.0 / max(self.limit, 1.0))
+
+    def on_throttle(self):
+        self.limit = max(self.minimum, self.limit * self.decrease)
+
+
+class RateLimiter:
+    """
+    Request + token budgets and adaptive concurrency for a single model.
+    """
+    def __init__(self, limits: ModelLimits):
+        self.limits = limits
+        self.requests = TokenBucket(limits.requests_per_second)
+        self.tokens = (TokenBucket(limits.tokens_per_minute / 60.0, limits.tokens_per_minute)
+                       if limits.tokens_per_minute else None)
+        self.concurrency = AdaptiveConcurrency(limits.initial_concurrency,
+                                               maximum=limits.max_concurrency)
+        self._paused_until = 0.0
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int = 0):
+        """
+        Wait for a concurrency slot and both budgets; yields a Ticket used
+        to report the outcome of the request.
+        """
+        await self.concurrency.acquire()
+        try:
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.requests.acquire()
+            if self.tokens is not None and estimated_tokens:
+                await self.tokens.acquire(estimated_tokens)
+            yield Ticket(self, estimated_tokens)
+        finally:
+            await self.concurrency.release()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class Ticket:
+    def __init__(self, limiter: RateLimiter, estimated_tokens: int):
+        self.limiter = limiter
+        self.estimated_tokens = estimated_tokens
+
+    def success(self, used_tokens: Optional[int] = None):
+        self.limiter.concurrency.on_success()
+        if self.limiter.tokens is not None and used_tokens is not None:
+            self.limiter.tokens.adjust(self.estimated_tokens - used_tokens)
+
+    def throttled(self, retry_after: Optional[float] = None):
+        self.limiter.concurrency.on_throttle()
+        if retry_after:
+            self.limiter.pause(retry_after)
+
+    def failed(self):
+        # transient server error: don't grow, but don't punish the whole pool either
+        if self.limiter.tokens is not None:
+            self.limiter.tokens.adjust(self.estimated_tokens)
+
+
+_LIMITERS: dict = {}
+
+
+def get_limiter(model: str, limits: Optional[ModelLimits] = None,
+                default: Optional[ModelLimits] = None) -> RateLimiter:
+    """
+    Return the process-wide limiter for `model`, creating it on first use
+    with `limits` (or `default`). Raises ValueError if `limits` differ from
+    those the limiter was created with: one model has one budget.
+    """
+    limiter = _LIMITERS.get(model)
+    if limiter is None:
+        limiter = _LIMITERS[model] = RateLimiter(limits or default or ModelLimits())
+    elif limits is not None and limits != limiter.limits:
+        raise ValueError(f"Rate limiter for {model} already exists with {limiter.limits}, not {limits}")
+    return limiter
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Retry-After is either a number of seconds or an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """
+    Exponential backoff with full jitter.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def estimate_tokens(*texts: str) -> int:
+    """
+    Rough prompt size (~4 characters per token), good enough for budgeting.
+    """
+    return sum(len(t or "") for t in texts) // 4 + 1
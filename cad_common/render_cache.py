@@ -0,0 +1,140 @@
+"""
+Content-addressed cache for OpenSCAD renders.
+
+Renders are keyed by a hash of the normalised SCAD source plus the render
+parameters, and stored as <root>/<key[:2]>/<key>.<ext>. The store is a
+size-bounded LRU: hits refresh the file's mtime, and the oldest files are
+evicted once the total size passes `max_bytes`.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Optional
+
+from . import openscad
+from .artifacts import sweep
+from . import metrics
+from .openscad import RenderResult
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+RENDER_CACHE = metrics.counter("cad_render_cache_total", "Render cache lookups by format and result")
+
+# progressive quality: a small thumbnail first, then the full preview; each
+# tier is cached on its own. Meshes need a full CGAL/Manifold render and are
+# only produced on request.
+TIERS = {
+    "thumb": {"ext": "png", "mode": "preview", "imgsize": (200, 150)},
+    "preview": {"ext": "png", "mode": "preview", "imgsize": (800, 600)},
+}
+MESH_FORMATS = ("stl", "3mf")
+
+
+def mesh_tier(fmt: str) -> dict:
+    if fmt not in MESH_FORMATS:
+        raise ValueError(f"Unsupported mesh format: {fmt}")
+    return {"ext": fmt, "mode": "render", "imgsize": (0, 0)}
+
+
+def normalise_scad(code: str) -> str:
+    """
+    Drop differences that cannot change the render: line endings, trailing
+    whitespace and blank lines.
+    """
+    lines = (line.rstrip() for line in code.replace("\r\n", "\n").split("\n"))
+    return "\n".join(line for line in lines if line)
+
+
+def render_key(code: str, **params) -> str:
+    blob = json.dumps({"scad": normalise_scad(code), "params": params},
+                      sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._size = None  # lazily computed total, kept up to date on put
+        self._lock = threading.Lock()
+
+    def path_for(self, key: str, ext: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.{ext}")
+
+    def get(self, key: str, ext: str) -> Optional[str]:
+        path = self.path_for(key, ext)
+        try:
+            os.utime(path)  # LRU: a hit makes the entry young again
+        except FileNotFoundError:
+            return None
+        return path
+
+    def tmp_path(self, ext: str) -> str:
+        """
+        Scratch file inside the cache volume, so `put` can move it in atomically.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix=f".{ext}", prefix=".tmp-", dir=self.root)
+        os.close(fd)
+        return path
+
+    def put(self, key: str, src_path: str, ext: str) -> str:
+        path = self.path_for(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(src_path, path)
+        with self._lock:
+            if self._size is not None:
+                self._size += os.path.getsize(path)
+            self._evict()
+        return path
+
+    def _evict(self):
+        if self._size is not None and self._size <= self.max_bytes:
+            return
+        self._size = sweep(self.root, self.max_bytes)
+
+    @staticmethod
+    def key(code: str, ext: str, mode: str, imgsize, defines: Optional[dict] = None) -> str:
+        params = {"ext": ext, "mode": mode, "imgsize": list(imgsize)}
+        if defines:
+            params["defines"] = defines
+        return render_key(code, **params)
+
+    def lookup(self, code: str, ext: str = "png", mode: str = "preview",
+               imgsize=(800, 600), defines: Optional[dict] = None) -> Optional[str]:
+        path = self.get(self.key(code, ext, mode, imgsize, defines), ext)
+        RENDER_CACHE.inc(format=ext, result="hit" if path else "miss")
+        return path
+
+    def render(self, scad_path: str, code: str, ext: str = "png", mode: str = "preview",
+               imgsize=(800, 600), timeout: Optional[float] = None, job=None,
+               defines: Optional[dict] = None) -> RenderResult:
+        """
+        Render through the cache. On a miss OpenSCAD renders straight into
+        the cache; failed renders are not cached. Pass a render_jobs.Job to
+        make the OpenSCAD process cancellable, and `defines` for `-D`
+        parameter overrides (part of the cache key).
+        """
+        key = self.key(code, ext, mode, imgsize, defines)
+        cached = self.get(key, ext)
+        RENDER_CACHE.inc(format=ext, result="hit" if cached else "miss")
+        if cached:
+            return RenderResult(True, cached, cache_hit=True)
+
+        out_path = self.tmp_path(ext)
+        result = openscad.run(
+            openscad.build_command(scad_path, out_path, mode, imgsize, defines), out_path,
+            timeout=job.remaining() if job is not None else timeout,
+            on_start=job.attach if job is not None else None,
+            is_cancelled=(lambda: job.cancelled) if job is not None else None,
+        )
+        if not result.ok:
+            try:
+                os.remove(out_path)
+            except FileNotFoundError:
+                pass
+            return result
+        result.path = self.put(key, out_path, ext)
+        return result
@@ -0,0 +1,202 @@
+"""
+Background render jobs.
+
+A bounded pool (one slot per core by default) runs OpenSCAD processes off
+the request thread. Each job gets an id the web apps hand back immediately,
+a wall-clock timeout and can be cancelled, which kills its OpenSCAD child.
+Job state lives in the process that created it. Jobs run in the
+submitter's context, so their metrics spans join the request's trace.
+"""
+import contextvars
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from . import metrics
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = {DONE, FAILED, CANCELLED}
+
+QUEUE_WAIT = metrics.histogram("cad_render_queue_wait_seconds", "Time render jobs spend queued")
+JOBS = metrics.counter("cad_render_jobs_total", "Finished render jobs by status")
+
+
+class Job:
+    def __init__(self, timeout: Optional[float]):
+        self.id = uuid.uuid4().hex
+        self.status = QUEUED
+        self.timeout = timeout
+        self.result: dict = {}
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self._cancel = threading.Event()
+        self._procs: list = []
+        self._callbacks: list = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def attach(self, proc):
+        """
+        Register a child process (passed as an `on_start` callback) so
+        cancel() can kill it.
+        """
+        with self._lock:
+            self._procs.append(proc)
+            if self.cancelled:
+                proc.kill()
+
+    def remaining(self) -> Optional[float]:
+        """
+        Seconds left of the job's timeout, for the next subprocess.
+        """
+        if self.timeout is None or self.started is None:
+            return self.timeout
+        return max(0.1, self.timeout - (time.time() - self.started))
+
+    def update(self, **fields):
+        """
+        Publish partial results while the job runs (e.g. a thumbnail before
+        the full preview); they show up in to_dict() right away.
+        """
+        self.result = {**self.result, **fields}
+
+    def add_done_callback(self, fn: Callable):
+        """
+        Call `fn(job)` once the job has finished, or right away if it has.
+        """
+        with self._lock:
+            if self.status not in FINISHED:
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _start(self) -> bool:
+        """Queued -> running; False if the job was finished (cancelled) first."""
+        with self._lock:
+            if self.status != QUEUED:
+                return False
+            self.status = RUNNING
+            self.started = time.time()
+            return True
+
+    def _finish(self, status: str, queued_only: bool = False) -> bool:
+        """
+        Set the final status and run the callbacks, once: False, changing
+        nothing, if the job has finished already (or, with `queued_only`,
+        has started).
+        """
+        with self._lock:
+            if self.status in FINISHED or (queued_only and self.status != QUEUED):
+                return False
+            self.status = status
+            self.finished = time.time()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+        return True
+
+    def cancel(self):
+        self._cancel.set()
+        with self._lock:
+            for proc in self._procs:
+                if proc.poll() is None:
+                    proc.kill()
+
+    def to_dict(self) -> dict:
+        data = {"job": self.id, "status": self.status, "created": self.created,
+                "started": self.started, "finished": self.finished}
+        if self.error:
+            data["error"] = self.error
+        data.update(self.result)
+        return data
+
+
+class RenderQueue:
+    def __init__(self, workers: Optional[int] = None, timeout: Optional[float] = 120,
+                 keep: int = 1000):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.keep = keep
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="openscad")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Job:
+        """
+        Queue `fn(job, *args, **kwargs)`. It returns a dict merged into the
+        job status, or raises to fail the job.
+        """
+        job = Job(self.timeout)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._pool.submit(contextvars.copy_context().run, self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED:
+            return False
+        job.cancel()
+        # a running job is finished by _run once its processes are killed
+        job._finish(CANCELLED, queued_only=True)
+        return True
+
+    def _run(self, job: Job, fn, args, kwargs):
+        if job.cancelled:
+            job._finish(CANCELLED)
+            return
+        if not job._start():
+            return
+        QUEUE_WAIT.observe(job.started - job.created)
+        status = FAILED
+        try:
+            with metrics.span("render_job", job=job.id):
+                job.update(**(fn(job, *args, **kwargs) or {}))
+            status = CANCELLED if job.cancelled else DONE
+        except Exception as exc:
+            job.error = str(exc)
+            status = CANCELLED if job.cancelled else FAILED
+        finally:
+            if job._finish(status):
+                JOBS.inc(status=status)
+
+    def _prune(self):
+        # forget the oldest finished jobs once we hold more than `keep`
+        excess = len(self._jobs) - self.keep
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].status in FINISHED:
+                del self._jobs[job_id]
+                excess -= 1
+
+
+def run_child(parent: Optional[Job], render_queue: RenderQueue, fn: Callable, *args,
+              poll: float = 0.2, **kwargs) -> Job:
+    """
+    Run `fn(child_job, *args, **kwargs)` as a job of its own on
+    `render_queue` and return it once it has finished. A job that mostly
+    waits (on a model, or on other jobs) runs on another queue and holds a
+    render slot only for the renders. Cancelling `parent` cancels the child.
+    """
+    finished = threading.Event()
+    child = render_queue.submit(fn, *args, **kwargs)
+    child.add_done_callback(lambda c: finished.set())
+    while not finished.wait(poll):
+        if parent is not None and parent.cancelled:
+            render_queue.cancel(child.id)
+    return child
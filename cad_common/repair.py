@@ -0,0 +1,99 @@
+"""
+Generate -> validate -> repair loop.
+
+When generated SCAD fails the pre-validator or the OpenSCAD render, only
+the error messages and the offending code are sent back to the model for a
+targeted fix, instead of the user resubmitting for a full new generation.
+Attempts and total wall-clock time are both bounded.
+"""
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from .openscad import RenderResult
+from .render_jobs import CANCELLED, DONE, Job, RenderQueue, run_child
+from .scad_lint import lint
+
+MAX_STDERR_CHARS = 2000
+
+REPAIR_PROMPT = (
+    "The following OpenSCAD code does not work.\n\n"
+    "Errors:\n{errors}\n\n"
+    "Code:\n{code}\n\n"
+    "Fix the errors while keeping the design the same. "
+    "Answer ONLY with the complete corrected OpenSCAD code."
+)
+
+
+def render_errors(stderr: str) -> str:
+    """
+    The useful part of OpenSCAD's stderr: ERROR/WARNING lines, or the
+    tail of the output when there are none.
+    """
+    lines = [line for line in stderr.splitlines() if line.strip()]
+    relevant = [line for line in lines if "ERROR" in line or "WARNING" in line] or lines[-20:]
+    return "\n".join(relevant)[-MAX_STDERR_CHARS:]
+
+
+def repair_prompt(code: str, errors: str) -> str:
+    return REPAIR_PROMPT.format(errors=errors, code=code)
+
+
+def queued_render(job: Optional[Job], render_queue: RenderQueue,
+                  render: Callable[[Job, str], RenderResult]) -> Callable[[str], RenderResult]:
+    """
+    A `render(code)` for repair_loop that runs `render(child_job, code)` as
+    a job of its own on `render_queue`. The repair job then waits on the
+    model without holding one of the OpenSCAD slots.
+    """
+    def run(code: str) -> RenderResult:
+        child = run_child(job, render_queue, lambda child_job: {"render": render(child_job, code)})
+        if child.status == DONE:
+            return child.result["render"]
+        if child.status == CANCELLED:
+            return RenderResult(False, cancelled=True)
+        raise RuntimeError(child.error or "Render job failed")
+    return run
+
+
+@dataclass
+class RepairOutcome:
+    code: str
+    ok: bool
+    render: Optional[RenderResult] = None
+    attempts: list = field(default_factory=list)  # [{"stage": ..., "errors": ...}]
+    error: Optional[str] = None
+
+
+def repair_loop(code: str, render: Callable[[str], RenderResult],
+                fix: Callable[[str, str, float], str], max_attempts: int = 2,
+                budget: float = 90.0) -> RepairOutcome:
+    """
+    Validate and render `code`; on failure ask `fix(code, errors, seconds_left)`
+    for a corrected version and try again, at most `max_attempts` times and
+    within `budget` seconds overall.
+    """
+    deadline = time.monotonic() + budget
+    outcome = RepairOutcome(code, False)
+    while True:
+        checked = lint(outcome.code)
+        if checked.ok:
+            result = render(outcome.code)
+            outcome.render = result
+            if result.ok:
+                outcome.ok = True
+                return outcome
+            if result.timed_out or result.cancelled:
+                # not something the model can fix
+                outcome.error = "OpenSCAD rendering timed out" if result.timed_out else "Render cancelled"
+                return outcome
+            stage, errors = "render", render_errors(result.stderr) or "OpenSCAD rendering failed"
+        else:
+            stage, errors = "validate", checked.summary(limit=10)
+
+        outcome.attempts.append({"stage": stage, "errors": errors})
+        outcome.error = errors
+        left = deadline - time.monotonic()
+        if len(outcome.attempts) > max_attempts or left <= 0:
+            return outcome
+        outcome.code = fix(outcome.code, errors, left)
@@ -0,0 +1,192 @@
+"""
+Two-level cache for LLM responses, persisted in SQLite.
+
+  1. exact: keyed on (provider, model, system prompt, normalised prompt);
+  2. semantic: the prompt embedding is compared against cached embeddings
+     of the same provider/model/system prompt, and the closest one is
+     reused when its cosine similarity reaches `threshold` and the two
+     prompts have the same numbers ("10 mm cube" embeds almost exactly
+     like "20 mm cube").
+
+Entries expire after `ttl` seconds and the least recently used ones are
+evicted past `max_entries`. The database runs in WAL mode so several
+worker processes can share one file.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import numpy as np
+
+from . import metrics
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key        TEXT PRIMARY KEY,
+    scope      TEXT NOT NULL,
+    prompt     TEXT NOT NULL,
+    response   TEXT NOT NULL,
+    source     TEXT,
+    embedding  BLOB,
+    numbers    TEXT,
+    created    REAL NOT NULL,
+    accessed   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_scope ON responses (scope);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+RESPONSE_CACHE = metrics.counter("cad_response_cache_total", "Response cache lookups by result (exact, semantic, miss)")
+
+
+def normalise_prompt(prompt: str) -> str:
+    """
+    Case, whitespace, trailing punctuation and "10 mm" vs "10mm" don't
+    change what the user asked for.
+    """
+    text = " ".join(prompt.lower().split())
+    text = re.sub(r"(\d)\s+(mm|cm|m|in|deg)\b", r"\1\2", text)
+    return text.strip(" .!?")
+
+
+def prompt_numbers(prompt: str) -> str:
+    """
+    The numbers of a prompt with their units, in order: "10mm 2 45deg";
+    a size "100x50x2 mm" gives "100 50 2mm".
+    """
+    text = re.sub(r"(\d)\s*[x\u00d7*]\s*(?=\d)", r"\1 ", normalise_prompt(prompt))
+    return " ".join(re.findall(r"\d+(?:\.\d+)?(?:mm|cm|m|in|deg)?\b", text))
+
+
+@dataclass
+class CachedResponse:
+    response: str
+    source: Optional[str]
+    kind: str  # "exact" or "semantic"
+    similarity: float = 1.0
+
+
+class ResponseCache:
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600, max_entries: int = 5000,
+                 threshold: float = 0.95, embed: Optional[Callable[[str], list]] = None):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]  # metrics label
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.embed = embed
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _scope(provider: str, model: str, system: str) -> str:
+        return hashlib.sha256(f"{provider}\0{model}\0{system}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _key(scope: str, prompt: str) -> str:
+        return hashlib.sha256(f"{scope}\0{normalise_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+    def get_or_generate(self, provider: str, model: str, system: str, prompt: str,
+                        generate: Callable[[], tuple]) -> tuple:
+        """
+        Return (response, source, cached) where `cached` is None on a miss
+        or the CachedResponse that was reused. On a miss `generate()` is
+        called and its (response, source) stored.
+        """
+        hit, embedding = self.lookup(provider, model, system, prompt)
+        if hit is not None:
+            return hit.response, hit.source, hit
+
+        response, source = generate()
+        self.store(provider, model, system, prompt, response, source, embedding)
+        return response, source, None
+
+    def lookup(self, provider: str, model: str, system: str, prompt: str) -> tuple:
+        """
+        Return (cached, embedding): the CachedResponse or None, and the
+        prompt embedding (if computed) to hand to store() after a miss. For
+        callers that produce the response themselves, e.g. by streaming.
+        """
+        with metrics.span("cache_lookup", cache=self.name) as span:
+            scope = self._scope(provider, model, system)
+            hit = self._get_exact(self._key(scope, prompt))
+            embedding = None
+            if hit is None and self.embed is not None and self.threshold:
+                try:
+                    embedding = _unit(self.embed(normalise_prompt(prompt)))
+                except Exception as exc:
+                    print(f"Response cache: embedding failed, exact match only: {exc}")
+                if embedding is not None:
+                    hit = self._get_semantic(scope, embedding, prompt_numbers(prompt))
+            span.set(result=hit.kind if hit else "miss")
+        RESPONSE_CACHE.inc(cache=self.name, result=hit.kind if hit else "miss")
+        return hit, embedding
+
+    def store(self, provider: str, model: str, system: str, prompt: str,
+              response: str, source: str, embedding: Optional[np.ndarray] = None):
+        if response and response.strip():
+            scope = self._scope(provider, model, system)
+            self._put(self._key(scope, prompt), scope, prompt, response, source, embedding)
+
+    def _get_exact(self, key: str) -> Optional[CachedResponse]:
+        now = time.time()
+        row = self._conn().execute(
+            "SELECT response, source FROM responses WHERE key = ? AND created > ?",
+            (key, now - self.ttl)).fetchone()
+        if row is None:
+            return None
+        self._conn().execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return CachedResponse(row[0], row[1], "exact")
+
+    def _get_semantic(self, scope: str, embedding: np.ndarray, numbers: str) -> Optional[CachedResponse]:
+        now = time.time()
+        rows = self._conn().execute(
+            "SELECT key, response, source, embedding FROM responses "
+            "WHERE scope = ? AND embedding IS NOT NULL AND numbers = ? AND created > ?",
+            (scope, numbers, now - self.ttl)).fetchall()
+        rows = [r for r in rows if len(r[3]) == embedding.nbytes]
+        if not rows:
+            return None
+        matrix = np.frombuffer(b"".join(r[3] for r in rows), dtype=np.float32)
+        scores = matrix.reshape(len(rows), -1) @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        key, response, source, _ = rows[best]
+        self._conn().execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return CachedResponse(response, source, "semantic", float(scores[best]))
+
+    def _put(self, key, scope, prompt, response, source, embedding):
+        now = time.time()
+        blob = embedding.tobytes() if embedding is not None else None
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses "
+            "(key, scope, prompt, response, source, embedding, numbers, created, accessed) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, scope, prompt, response, source, blob, prompt_numbers(prompt), now, now))
+        conn.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,))
+        conn.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+            "ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+
+def _unit(vector) -> Optional[np.ndarray]:
+    v = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm else None
@@ -0,0 +1,161 @@
+"""
+Latency-aware routing with hedged requests across LLM providers.
+
+Every provider has a rolling profile of its recent calls: latency, and
+whether the answer was usable. A request goes to the fastest healthy
+provider. If that provider has not answered after its p95 latency (clamped
+to [min_delay, max_delay]), a hedged duplicate goes to the next provider.
+The first answer that passes `validate` wins and the other call is
+cancelled. A failed or invalid answer moves on to the next provider at
+once, so a provider that is down costs one failed call rather than a
+timeout on every request. Providers with too many recent failures are
+skipped for `cooldown` seconds and then tried again.
+
+    router = Router(["openai", "claude", "gemini"])
+    text, name = await router.call(ask, validate=lambda text: lint(text).ok)
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from . import metrics
+
+HEDGES = metrics.counter("cad_router_hedges_total", "Hedged duplicates sent, by provider")
+WINS = metrics.counter("cad_router_wins_total", "Routed requests answered, by provider")
+FAILURES = metrics.counter("cad_router_failures_total", "Routed calls that failed or gave an invalid answer")
+
+
+class RoutingError(RuntimeError):
+    pass
+
+
+class ProviderProfile:
+    def __init__(self, window: int = 50):
+        self.samples: deque = deque(maxlen=window)  # (seconds, ok)
+        self.consecutive_failures = 0
+        self.last_failure = 0.0
+
+    def record(self, seconds: float, ok: bool):
+        self.samples.append((seconds, ok))
+        if ok:
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+            self.last_failure = time.monotonic()
+
+    def percentile(self, q: float) -> Optional[float]:
+        latencies = sorted(s for s, ok in self.samples if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    def to_dict(self) -> dict:
+        return {"calls": len(self.samples), "p50": self.percentile(0.5), "p95": self.percentile(0.95),
+                "error_rate": round(self.error_rate(), 3), "consecutive_failures": self.consecutive_failures}
+
+
+class Router:
+    def __init__(self, names: list, window: int = 50, hedge_quantile: float = 0.95,
+                 min_delay: float = 1.0, max_delay: float = 30.0, default_delay: float = 8.0,
+                 max_error_rate: float = 0.5, max_failures: int = 3, cooldown: float = 30.0):
+        self.names = list(names)
+        self.profiles = {name: ProviderProfile(window) for name in self.names}
+        self.hedge_quantile = hedge_quantile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.default_delay = default_delay
+        self.max_error_rate = max_error_rate
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+
+    def healthy(self, name: str) -> bool:
+        profile = self.profiles[name]
+        failing = (profile.consecutive_failures >= self.max_failures
+                   or (len(profile.samples) >= 5 and profile.error_rate() > self.max_error_rate))
+        # after the cooldown a failing provider gets one call again (half-open)
+        return not failing or time.monotonic() - profile.last_failure >= self.cooldown
+
+    def ranked(self) -> list:
+        """
+        Healthy providers by median latency; ones without data first, so
+        they get measured. Unhealthy providers follow as a last resort.
+        """
+        def median(name):
+            return self.profiles[name].percentile(0.5) or 0.0
+        healthy = sorted((n for n in self.names if self.healthy(n)), key=median)
+        failing = sorted((n for n in self.names if not self.healthy(n)),
+                         key=lambda n: self.profiles[n].last_failure)
+        return healthy + failing
+
+    def hedge_delay(self, name: str) -> float:
+        p = self.profiles[name].percentile(self.hedge_quantile)
+        return min(self.max_delay, max(self.min_delay, p if p is not None else self.default_delay))
+
+    async def call(self, fn: Callable[[str], Awaitable], validate: Optional[Callable] = None,
+                   hedge: bool = True) -> tuple:
+        """
+        Run `fn(name)` on the best provider, hedged and with failover.
+        Returns (result, provider name) for the first result accepted by
+        `validate`; raises RoutingError when every provider failed.
+        """
+        order = self.ranked()
+        if not order:
+            raise RoutingError("No providers configured")
+        pending: dict = {}  # task -> (name, started)
+        errors = []
+        hedged = False
+
+        def launch():
+            name = order.pop(0)
+            pending[asyncio.ensure_future(fn(name))] = (name, time.monotonic())
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if hedge and not hedged and order and len(pending) == 1:
+                    name, started = next(iter(pending.values()))
+                    timeout = max(0.0, started + self.hedge_delay(name) - time.monotonic())
+                done, _ = await asyncio.wait(set(pending), timeout=timeout,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    HEDGES.inc(provider=order[0])
+                    launch()
+                    continue
+                for task in done:
+                    name, started = pending.pop(task)
+                    elapsed = time.monotonic() - started
+                    try:
+                        result = task.result()
+                        if validate is not None and not validate(result):
+                            raise ValueError("invalid answer")
+                    except Exception as exc:
+                        self.profiles[name].record(elapsed, False)
+                        FAILURES.inc(provider=name)
+                        errors.append(f"{name}: {exc}")
+                        if order:
+                            launch()  # failover
+                        continue
+                    self.profiles[name].record(elapsed, True)
+                    WINS.inc(provider=name)
+                    # losers are cancelled before they answer: the hedge
+                    # started later, so its own time so far would rank it
+                    # ahead of the winner. It was no faster than the winner.
+                    for other_name, other_started in pending.values():
+                        self.profiles[other_name].record(max(elapsed, time.monotonic() - other_started), True)
+                    return result, name
+            raise RoutingError("All providers failed: " + "; ".join(errors))
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def to_dict(self) -> dict:
+        return {name: {**self.profiles[name].to_dict(), "healthy": self.healthy(name)}
+                for name in self.names}
@@ -0,0 +1,629 @@
+"""
+In-process OpenSCAD pre-validator.
+
+Tokenises and parses SCAD source in a few milliseconds and returns
+structured diagnostics, so broken model output is rejected before an
+OpenSCAD process is ever started. It checks for:
+
+  * leftover markdown (code fences, backticks),
+  * unbalanced or mismatched brackets,
+  * syntax errors (recursive-descent parser for the OpenSCAD grammar),
+  * calls to modules that are neither built in nor defined in the file,
+  * obviously degenerate primitives (zero/negative sizes) and files that
+    never instantiate any geometry.
+
+    result = lint(code)
+    if not result.ok:
+        return {"error": "SCAD validation failed", "diagnostics": result.to_list()}
+"""
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+ERROR, WARNING = "error", "warning"
+
+BUILTIN_MODULES = {
+    # 3D / 2D primitives
+    "cube", "sphere", "cylinder", "polyhedron", "square", "circle", "polygon", "text",
+    "import", "surface", "projection", "linear_extrude", "rotate_extrude", "roof",
+    # transformations
+    "translate", "rotate", "scale", "resize", "mirror", "multmatrix", "color", "offset",
+    "hull", "minkowski", "render", "fill",
+    # booleans
+    "union", "difference", "intersection",
+    # flow control and misc
+    "for", "intersection_for", "if", "let", "each", "echo", "assert", "children", "group",
+}
+
+BUILTIN_FUNCTIONS = {
+    "abs", "sign", "sin", "cos", "tan", "acos", "asin", "atan", "atan2", "floor", "round",
+    "ceil", "ln", "log", "pow", "sqrt", "exp", "rands", "min", "max", "norm", "cross",
+    "len", "concat", "lookup", "str", "chr", "ord", "search", "version", "version_num",
+    "parent_module", "is_undef", "is_bool", "is_num", "is_string", "is_list", "is_function",
+    "echo", "assert", "let", "object", "has_key", "textmetrics", "fontmetrics",
+}
+
+
+@dataclass
+class Diagnostic:
+    severity: str
+    code: str
+    message: str
+    line: int
+    col: int
+
+
+@dataclass
+class LintResult:
+    diagnostics: list = field(default_factory=list)
+
+    @property
+    def errors(self) -> list:
+        return [d for d in self.diagnostics if d.severity == ERROR]
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def to_list(self) -> list:
+        return [asdict(d) for d in self.diagnostics]
+
+    def summary(self, limit: int = 5) -> str:
+        return "\n".join(f"line {d.line}:{d.col} {d.severity}: {d.message}"
+                         for d in self.diagnostics[:limit])
+
+
+# ---------------------------------------------------------------- tokenizer
+@dataclass
+class Token:
+    kind: str  # num, str, id, op, path, eof
+    value: str
+    line: int
+    col: int
+
+
+_NUMBER = re.compile(r"(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+_WORD = re.compile(r"\$?[A-Za-z0-9_]+")
+_OPS = ("<=", ">=", "==", "!=", "&&", "||",
+        "!", "+", "-", "*", "/", "%", "^", "<", ">", "?", ":", "=", ".", ",", ";",
+        "(", ")", "[", "]", "{", "}", "#")
+
+
+class LintError(Exception):
+    def __init__(self, code: str, message: str, line: int, col: int):
+        super().__init__(message)
+        self.diagnostic = Diagnostic(ERROR, code, message, line, col)
+
+
+def tokenize(code: str) -> list:
+    tokens = []
+    i, line, line_start = 0, 1, 0
+    n = len(code)
+    while i < n:
+        c = code[i]
+        col = i - line_start + 1
+        if c == "\n":
+            line += 1
+            line_start = i + 1
+            i += 1
+        elif c.isspace():
+            i += 1
+        elif code.startswith("//", i):
+            end = code.find("\n", i)
+            i = n if end == -1 else end
+        elif code.startswith("/*", i):
+            end = code.find("*/", i + 2)
+            if end == -1:
+                raise LintError("unterminated-comment", "Unterminated /* comment", line, col)
+            line += code.count("\n", i, end)
+            if "\n" in code[i:end]:
+                line_start = code.rfind("\n", i, end) + 1
+            i = end + 2
+        elif c == "`":
+            raise LintError("markdown", "Leftover markdown (backtick or ``` fence) in code", line, col)
+        elif c == '"':
+            j = i + 1
+            while j < n and code[j] != '"':
+                if code[j] == "\\":
+                    j += 1
+                elif code[j] == "\n":
+                    break
+                j += 1
+            if j >= n or code[j] != '"':
+                raise LintError("unterminated-string", "Unterminated string literal", line, col)
+            tokens.append(Token("str", code[i + 1:j], line, col))
+            i = j + 1
+        else:
+            m = _NUMBER.match(code, i)
+            if m and not (m.end() < n and (code[m.end()].isalpha() or code[m.end()] == "_")):
+                tokens.append(Token("num", m.group(), line, col))
+                i = m.end()
+                continue
+            m = _WORD.match(code, i)
+            if m:
+                word = m.group()
+                tokens.append(Token("id", word, line, col))
+                i = m.end()
+                if word in ("include", "use"):
+                    # include <path> / use <path>
+                    j = i
+                    while j < n and code[j] in " \t":
+                        j += 1
+                    if j < n and code[j] == "<":
+                        end = code.find(">", j)
+                        if end == -1 or "\n" in code[j:end]:
+                            raise LintError("syntax", f"Unterminated {word} <...> path", line, col)
+                        tokens.append(Token("path", code[j + 1:end], line, j - line_start + 1))
+                        i = end + 1
+                continue
+            for op in _OPS:
+                if code.startswith(op, i):
+                    tokens.append(Token("op", op, line, col))
+                    i += len(op)
+                    break
+            else:
+                raise LintError("syntax", f"Unexpected character {c!r}", line, col)
+    tokens.append(Token("eof", "", line, i - line_start + 1))
+    return tokens
+
+
+def check_brackets(tokens: list) -> list:
+    pairs = {")": "(", "]": "[", "}": "{"}
+    stack, diags = [], []
+    for tok in tokens:
+        if tok.kind != "op":
+            continue
+        if tok.value in "([{":
+            stack.append(tok)
+        elif tok.value in pairs:
+            if not stack:
+                diags.append(Diagnostic(ERROR, "unbalanced", f"Unmatched '{tok.value}'", tok.line, tok.col))
+            elif stack[-1].value != pairs[tok.value]:
+                open_tok = stack.pop()
+                diags.append(Diagnostic(ERROR, "unbalanced",
+                                        f"'{tok.value}' closes '{open_tok.value}' opened at line {open_tok.line}",
+                                        tok.line, tok.col))
+            else:
+                stack.pop()
+    for tok in stack:
+        diags.append(Diagnostic(ERROR, "unbalanced", f"'{tok.value}' is never closed", tok.line, tok.col))
+    return diags
+
+
+# ------------------------------------------------------------------- parser
+@dataclass
+class Call:
+    name: str
+    args: list  # [(name or None, expr)]
+    line: int
+    col: int
+    top_level: bool
+
+
+class Parser:
+    """
+    Recursive-descent parser. Expressions are returned as small tuples
+    (("num", 1.0), ("vec", [...]), ("neg", e), ...) which is all the
+    degenerate-geometry checks need.
+    """
+    def __init__(self, tokens: list):
+        self.tokens = tokens
+        self.pos = 0
+        self.depth = 0
+        self.calls: list = []
+        self.modules: set = set()
+        self.functions: set = set()
+        self.variables: set = set()
+        self.function_calls: list = []
+        self.uses_libraries = False
+
+    # -- helpers
+    @property
+    def tok(self) -> Token:
+        return self.tokens[self.pos]
+
+    def peek(self, offset: int = 1) -> Token:
+        return self.tokens[min(self.pos + offset, len(self.tokens) - 1)]
+
+    def at(self, value: str) -> bool:
+        return self.tok.kind == "op" and self.tok.value == value
+
+    def at_word(self, value: str) -> bool:
+        return self.tok.kind == "id" and self.tok.value == value
+
+    def advance(self) -> Token:
+        tok = self.tok
+        if tok.kind != "eof":
+            self.pos += 1
+        return tok
+
+    def expect(self, value: str) -> Token:
+        if not self.at(value):
+            self.error(f"Expected '{value}'")
+        return self.advance()
+
+    def expect_id(self) -> Token:
+        if self.tok.kind != "id":
+            self.error("Expected an identifier")
+        return self.advance()
+
+    def error(self, message: str):
+        tok = self.tok
+        found = "end of input" if tok.kind == "eof" else repr(tok.value)
+        raise LintError("syntax", f"{message}, found {found}", tok.line, tok.col)
+
+    # -- statements
+    def parse(self):
+        while self.tok.kind != "eof":
+            self.statement()
+
+    def statement(self):
+        tok = self.tok
+        if self.at(";"):
+            self.advance()
+        elif self.at("{"):
+            self.advance()
+            while not self.at("}"):
+                if self.tok.kind == "eof":
+                    self.error("Expected '}'")
+                self.statement()
+            self.advance()
+        elif tok.kind == "id" and tok.value in ("include", "use"):
+            self.advance()
+            if self.tok.kind != "path":
+                self.error(f"Expected <file> after {tok.value}")
+            self.advance()
+            self.uses_libraries = True
+        elif self.at_word("module"):
+            self.advance()
+            self.modules.add(self.expect_id().value)
+            self.params()
+            self.depth += 1
+            self.statement()
+            self.depth -= 1
+        elif self.at_word("function"):
+            self.advance()
+            self.functions.add(self.expect_id().value)
+            self.params()
+            self.expect("=")
+            self.expr()
+            self.expect(";")
+        elif tok.kind == "id" and self.peek().kind == "op" and self.peek().value == "=":
+            self.variables.add(self.advance().value)
+            self.advance()
+            self.expr()
+            self.expect(";")
+        else:
+            self.instantiation()
+
+    def instantiation(self):
+        while self.tok.kind == "op" and self.tok.value in ("!", "#", "%", "*"):
+            self.advance()
+        if self.at_word("if"):
+            self.advance()
+            self.expect("(")
+            self.expr()
+            self.expect(")")
+            self.child()
+            if self.at_word("else"):
+                self.advance()
+                self.child()
+            return
+        tok = self.tok
+        if tok.kind != "id":
+            self.error("Expected a statement")
+        self.advance()
+        args = self.args()
+        self.calls.append(Call(tok.value, args, tok.line, tok.col, self.depth == 0))
+        if tok.value in ("for", "intersection_for", "let"):
+            self.variables.update(name for name, _ in args if name)
+        self.child()
+
+    def child(self):
+        if self.at(";"):
+            self.advance()
+        else:
+            self.statement()
+
+    def params(self):
+        self.expect("(")
+        while not self.at(")"):
+            self.variables.add(self.expect_id().value)
+            if self.at("="):
+                self.advance()
+                self.expr()
+            if not self.at(","):
+                break
+            self.advance()
+        self.expect(")")
+
+    def args(self) -> list:
+        self.expect("(")
+        args = []
+        while not self.at(")"):
+            name = None
+            if self.tok.kind == "id" and self.peek().kind == "op" and self.peek().value == "=":
+                name = self.advance().value
+                self.advance()
+            args.append((name, self.expr()))
+            if not self.at(","):
+                break
+            self.advance()
+        self.expect(")")
+        return args
+
+    # -- expressions
+    def expr(self):
+        if self.at_word("function"):
+            self.advance()
+            self.params()
+            self.expr()
+            return ("other",)
+        if self.tok.kind == "id" and self.tok.value in ("let", "assert", "echo") \
+                and self.peek().kind == "op" and self.peek().value == "(":
+            word = self.advance().value
+            args = self.args()
+            if word == "let":
+                self.variables.update(name for name, _ in args if name)
+            if self.at(";") or self.at(")") or self.at(",") or self.at("]"):
+                return ("other",)
+            self.expr()
+            return ("other",)
+        cond = self.binary(0)
+        if self.at("?"):
+            self.advance()
+            self.expr()
+            self.expect(":")
+            self.expr()
+            return ("other",)
+        return cond
+
+    _BINARY = [("||",), ("&&",), ("==", "!="), ("<", "<=", ">", ">="), ("+", "-"), ("*", "/", "%"), ("^",)]
+
+    def binary(self, level: int):
+        if level == len(self._BINARY):
+            return self.unary()
+        left = self.binary(level + 1)
+        while self.tok.kind == "op" and self.tok.value in self._BINARY[level]:
+            self.advance()
+            self.binary(level + 1)
+            left = ("other",)
+        return left
+
+    def unary(self):
+        if self.tok.kind == "op" and self.tok.value in ("-", "+", "!"):
+            op = self.advance().value
+            operand = self.unary()
+            if op == "-":
+                return ("neg", operand)
+            return operand if op == "+" else ("other",)
+        return self.postfix()
+
+    def postfix(self):
+        node = self.primary()
+        while True:
+            if self.at("("):
+                if node[0] == "id":
+                    self.function_calls.append(node)
+                self.args()
+                node = ("other",)
+            elif self.at("["):
+                self.advance()
+                self.expr()
+                self.expect("]")
+                node = ("other",)
+            elif self.at("."):
+                self.advance()
+                self.expect_id()
+                node = ("other",)
+            else:
+                return node
+
+    def primary(self):
+        tok = self.tok
+        if tok.kind == "num":
+            self.advance()
+            return ("num", float(tok.value))
+        if tok.kind == "str":
+            self.advance()
+            return ("str", tok.value)
+        if tok.kind == "id":
+            self.advance()
+            if tok.value in ("true", "false", "undef"):
+                return ("other",)
+            return ("id", tok.value, tok.line, tok.col)
+        if self.at("("):
+            self.advance()
+            node = self.expr()
+            self.expect(")")
+            return node
+        if self.at("["):
+            return self.vector()
+        self.error("Expected an expression")
+
+    def vector(self):
+        self.expect("[")
+        items = []
+        while not self.at("]"):
+            items.append(self.element())
+            if self.at(":"):
+                # range [start : step : end]
+                self.advance()
+                self.expr()
+                if self.at(":"):
+                    self.advance()
+                    self.expr()
+                self.expect("]")
+                return ("other",)
+            if not self.at(","):
+                break
+            self.advance()
+        self.expect("]")
+        return ("vec", items)
+
+    def comprehension_for(self):
+        # for (i = [..], j = [..])  or C-style  for (i = 0; i < n; i = i + 1)
+        self.expect("(")
+        while not self.at(")") and not self.at(";"):
+            self.variables.add(self.expect_id().value)
+            self.expect("=")
+            self.expr()
+            if not self.at(","):
+                break
+            self.advance()
+        if self.at(";"):
+            self.advance()
+            self.expr()
+            self.expect(";")
+            while not self.at(")"):
+                self.expect_id()
+                self.expect("=")
+                self.expr()
+                if not self.at(","):
+                    break
+                self.advance()
+        self.expect(")")
+
+    def element(self):
+        # list comprehension elements
+        if self.tok.kind == "id" and self.peek().kind == "op" and self.peek().value == "(" \
+                and self.tok.value in ("for", "let", "if"):
+            word = self.advance().value
+            if word == "if":
+                self.expect("(")
+                self.expr()
+                self.expect(")")
+                self.element()
+                if self.at_word("else"):
+                    self.advance()
+                    self.element()
+                return ("other",)
+            if word == "for":
+                self.comprehension_for()
+            else:
+                args = self.args()
+                self.variables.update(name for name, _ in args if name)
+            self.element()
+            return ("other",)
+        if self.at_word("each"):
+            self.advance()
+            self.element()
+            return ("other",)
+        if self.at("("):
+            # parenthesised comprehension element
+            save = self.pos
+            self.advance()
+            if self.tok.kind == "id" and self.tok.value in ("for", "let", "if", "each"):
+                self.element()
+                self.expect(")")
+                return ("other",)
+            self.pos = save
+        return self.expr()
+
+
+# ---------------------------------------------------------------- checks
+def _number(node) -> Optional[float]:
+    if node[0] == "num":
+        return node[1]
+    if node[0] == "neg":
+        value = _number(node[1])
+        return -value if value is not None else None
+    return None
+
+
+def _numbers(node) -> Optional[list]:
+    """Literal number or literal vector of numbers, else None."""
+    value = _number(node)
+    if value is not None:
+        return [value]
+    if node[0] == "vec":
+        values = [_number(item) for item in node[1]]
+        if values and all(v is not None for v in values):
+            return values
+    return None
+
+
+def _arg(call: Call, name: str, position: Optional[int] = None):
+    for arg_name, expr in call.args:
+        if arg_name == name:
+            return expr
+    positional = [expr for arg_name, expr in call.args if arg_name is None]
+    if position is not None and position < len(positional):
+        return positional[position]
+    return None
+
+
+def _degenerate(call: Call) -> Optional[str]:
+    def nonpositive(expr):
+        values = _numbers(expr) if expr is not None else None
+        return values is not None and any(v <= 0 for v in values)
+
+    name = call.name
+    if name in ("cube", "square") and nonpositive(_arg(call, "size", 0)):
+        return f"{name}() with a zero or negative size"
+    if name in ("sphere", "circle"):
+        if nonpositive(_arg(call, "r", 0)) or nonpositive(_arg(call, "d")):
+            return f"{name}() with a zero or negative radius"
+    if name == "cylinder":
+        if nonpositive(_arg(call, "h", 0)):
+            return "cylinder() with a zero or negative height"
+        radii = [_number(e) for e in (_arg(call, "r1", 1), _arg(call, "r2", 2)) if e is not None]
+        if len(radii) == 2 and all(r is not None and r <= 0 for r in radii):
+            return "cylinder() with both radii zero"
+        if nonpositive(_arg(call, "r")) or nonpositive(_arg(call, "d")):
+            return "cylinder() with a zero or negative radius"
+    if name == "linear_extrude" and nonpositive(_arg(call, "height", 0)):
+        return "linear_extrude() with a zero or negative height"
+    if name == "scale":
+        factor = _arg(call, "v", 0)
+        values = _numbers(factor) if factor is not None else None
+        if values is not None and any(v == 0 for v in values):
+            return "scale() by zero flattens the geometry"
+    return None
+
+
+def lint(code: str) -> LintResult:
+    result = LintResult()
+    if not code or not code.strip():
+        result.diagnostics.append(Diagnostic(ERROR, "empty", "No OpenSCAD code", 1, 1))
+        return result
+    try:
+        tokens = tokenize(code)
+    except LintError as exc:
+        result.diagnostics.append(exc.diagnostic)
+        return result
+
+    brackets = check_brackets(tokens)
+    if brackets:
+        result.diagnostics.extend(brackets)
+        return result
+
+    parser = Parser(tokens)
+    try:
+        parser.parse()
+    except LintError as exc:
+        result.diagnostics.append(exc.diagnostic)
+        return result
+
+    known_modules = BUILTIN_MODULES | parser.modules
+    # with use/include the callee may live in a library we can't see
+    severity = WARNING if parser.uses_libraries else ERROR
+    for call in parser.calls:
+        if call.name not in known_modules:
+            result.diagnostics.append(Diagnostic(severity, "unknown-module",
+                                                 f"Unknown module '{call.name}'", call.line, call.col))
+        problem = _degenerate(call)
+        if problem:
+            result.diagnostics.append(Diagnostic(WARNING, "degenerate", problem, call.line, call.col))
+
+    known_functions = BUILTIN_FUNCTIONS | parser.functions | parser.variables
+    for node in parser.function_calls:
+        if node[1] not in known_functions:
+            result.diagnostics.append(Diagnostic(WARNING, "unknown-function",
+                                                 f"Unknown function '{node[1]}'", node[2], node[3]))
+
+    if not any(call.top_level and call.name not in ("echo", "assert") for call in parser.calls):
+        message = ("Modules are defined but never instantiated" if parser.modules
+                   else "The code does not create any geometry")
+        result.diagnostics.append(Diagnostic(ERROR, "no-geometry", message, 1, 1))
+    return result
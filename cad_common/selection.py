@@ -0,0 +1,66 @@
+"""
+Best-of-N selection over render jobs.
+
+Each candidate is checked by its own job on a RenderQueue, so candidates
+render in parallel on the shared pool. The first job whose result has
+`"ok": True` wins and the others are cancelled, which kills their OpenSCAD
+processes. If none passes, the finished result with the highest `"score"`
+is returned instead. The caller waits on a job of its own (see
+`select_first`); cancelling that job cancels every candidate.
+
+    winner, results = select_first(job, render_queue, check_candidate, candidates)
+"""
+import queue as queue_module
+from typing import Callable, Optional
+
+from . import metrics
+from .render_jobs import DONE, Job, RenderQueue
+
+SELECTED = metrics.counter("cad_best_of_total", "Best-of-N selections by outcome (passed, best_effort, none)")
+
+
+def select_first(job: Optional[Job], render_queue: RenderQueue, fn: Callable,
+                 candidates: list, poll: float = 0.2) -> tuple:
+    """
+    Run `fn(child_job, candidate)` for every candidate on `render_queue`.
+    Returns (index of the chosen candidate or None, per-candidate results,
+    in candidate order). `job` is the waiting job, watched for
+    cancellation.
+    """
+    finished: queue_module.Queue = queue_module.Queue()
+    children = []
+    for i, candidate in enumerate(candidates):
+        child = render_queue.submit(fn, candidate)
+        child.add_done_callback(lambda c, i=i: finished.put(i))
+        children.append(child)
+    results: list = [None] * len(children)
+    winner = None
+    try:
+        pending = len(children)
+        while pending and winner is None:
+            if job is not None and job.cancelled:
+                break
+            try:
+                i = finished.get(timeout=poll)
+            except queue_module.Empty:
+                continue
+            pending -= 1
+            child = children[i]
+            if child.status == DONE:
+                results[i] = dict(child.result)
+            else:
+                results[i] = {"ok": False, "reason": child.error or child.status}
+            if results[i].get("ok"):
+                winner = i
+    finally:
+        for child in children:
+            render_queue.cancel(child.id)
+    if winner is not None:
+        SELECTED.inc(outcome="passed")
+        return winner, results
+    scored = [(r["score"], i) for i, r in enumerate(results) if r and r.get("score") is not None]
+    if not scored or (job is not None and job.cancelled):
+        SELECTED.inc(outcome="none")
+        return None, results
+    SELECTED.inc(outcome="best_effort")
+    return max(scored)[1], results
@@ -7,66 +7,307 @@ Q-A-CoT pairs in JSON format: {prompt, code_scad, chain_of_thought}.
 import argparse
 import asyncio
 import aiohttp
-import pandas as pd
-import random
-import time
 import json
-from collections import deque
+import hashlib
+import os
+import contextvars
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-from google import genai
-from google.genai import types
 
-# Rate-limit settings
-MAX_CONCURRENT_REQUESTS = 3
-REQUEST_TIMESTAMPS = deque()
+from cad_common import metrics
+from cad_common.dataset import ParquetShardWriter, summary
+from cad_common.extract import extract_answer
+from cad_common.mesh import mesh_stats
+from cad_common.providers import ProviderError, close_session, get_provider
+from cad_common.ratelimit import ModelLimits
+from cad_common.render_cache import TIERS, RenderCache, mesh_tier, render_key
+from cad_common.repair import render_errors
+from cad_common.scad_lint import lint
 
-# API endpoints & keys
-TOGETHER_API_URL = "https://api.together.xyz/v1/chat/completions"
-TOGETHER_API_KEY = json.load(open("keys.json"))['together']
+# Rate-limit settings (per model)
+MODEL_LIMITS = {
+    "deepseek-ai/DeepSeek-R1": ModelLimits(requests_per_second=3, initial_concurrency=3),
+}
+MAX_CONCURRENT_REQUESTS = 16
+MAX_ATTEMPTS = 6
 
-async def enforce_rate_limit():
-    while True:
-        now = time.time()
-        # drop timestamps older than 1s
-        while REQUEST_TIMESTAMPS and now - REQUEST_TIMESTAMPS[0] > 1:
-            REQUEST_TIMESTAMPS.popleft()
-        if len(REQUEST_TIMESTAMPS) < MAX_CONCURRENT_REQUESTS:
-            REQUEST_TIMESTAMPS.append(now)
-            return
-        await asyncio.sleep(0.05)
+# API keys
+TOGETHER_API_KEY = json.load(open("keys.json"))['together']
 
-async def fetch_completion(session, sem, prompt, system_prompt, model_name, temperature=0.6, top_p=0.95, max_tokens=12000):
+async def fetch_completion(prompt, system_prompt, model_name, temperature=0.6, top_p=0.95, max_tokens=12000):
     """
     Call Together API for DeepSeek-R1 to generate OpenSCAD + CoT JSON.
+    429s, 5xx and connection errors are retried by the provider layer with
+    jittered exponential backoff (or the server's Retry-After) before the
+    row is recorded as an error.
+    """
+    provider = get_provider("together", model_name, api_key=TOGETHER_API_KEY,
+                            limits=MODEL_LIMITS.get(model_name),
+                            timeout=600, max_attempts=MAX_ATTEMPTS)
+    try:
+        completion = await provider.complete(
+            prompt,
+            system=system_prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+        )
+    except ProviderError as exc:
+        return {"prompt": prompt, "model": model_name, "error": f"HTTP {exc.status}: {exc.body}"}
+    except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+        return {"prompt": prompt, "model": model_name, "error": f"{type(exc).__name__}: {exc}"}
+    return {"prompt": prompt, "model": model_name, "response": completion.text,
+            "latency": round(completion.latency, 3), "prompt_tokens": completion.prompt_tokens,
+            "completion_tokens": completion.completion_tokens}
+
+def prompt_hash(prompt):
+    """
+    Stable key for a prompt; whitespace differences don't produce a new key.
+    """
+    normalised = " ".join(prompt.split())
+    return hashlib.sha256(normalised.encode("utf-8")).hexdigest()
+
+def load_completed(partial_file, reparse=False):
+    """
+    Index the finished rows of an existing partial JSONL by prompt hash.
+    Maps hash -> byte offset of the row so completed results are re-read
+    lazily instead of held in memory. Error rows, and responses that don't
+    parse to an answer (the parse_status the writer saved with the row),
+    are left out so they get retried; a truncated last line (crash
+    mid-write) is ignored. With `reparse` every response is parsed again,
+    so a better extractor recovers rows that failed before.
+    """
+    completed = {}
+    if not os.path.exists(partial_file):
+        return completed
+    with open(partial_file, "rb") as f:
+        offset = 0
+        for line in f:
+            start, offset = offset, offset + len(line)
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "response" not in row:
+                continue
+            # rows written before the status was saved are parsed once here
+            status = None if reparse else row.get("parse_status")
+            status = status or safe_parse_result(row)["parse_status"]
+            if status != "ok":
+                continue
+            key = row.get("prompt_hash") or prompt_hash(row.get("prompt", ""))
+            completed[key] = start
+    return completed
+
+def iter_prompts(input_file):
+    """
+    Lazily yield non-empty prompt lines from the input file.
+    """
+    with open(input_file, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+def parse_result(result):
     """
-    async with sem:
-        await enforce_rate_limit()
-        headers = {
-            "Authorization": f"Bearer {TOGETHER_API_KEY}",
-            "Content-Type": "application/json"
+    Turn a raw completion record into a CAD-THOUGHTS row. Every row carries
+    the request metadata (model, latency, tokens), its parse status and
+    whether the SCAD passes the linter. The answer is extracted from
+    reasoning blocks, fences and sloppy JSON (cad_common.extract); only a
+    response with no JSON answer and no fenced SCAD is a parse error.
+    """
+    meta = {
+        'prompt_hash': result.get('prompt_hash') or prompt_hash(result['prompt']),
+        'model': result.get('model'),
+        'latency': result.get('latency'),
+        'prompt_tokens': result.get('prompt_tokens'),
+        'completion_tokens': result.get('completion_tokens'),
+    }
+    if 'response' not in result:
+        return {'prompt': result['prompt'], **meta, 'parse_status': 'request_error',
+                'error': result.get('error')}
+    parsed = extract_answer(result['response'])
+    if parsed is None:
+        return {
+            'prompt': result['prompt'],
+            **meta,
+            'parse_status': 'parse_error',
+            'error': 'No JSON answer or fenced SCAD in the response',
+            'raw_response': result['response']
         }
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        messages.append({"role": "user", "content": prompt})
-
-        payload = {
-            "model": model_name,
-            "messages": messages,
-            "temperature": temperature,
-            "top_p": top_p,
-            "max_completion_tokens": max_tokens
+    row = {
+        'prompt': result['prompt'],
+        'code_scad': parsed.get('code_scad'),
+        'chain_of_thought': parsed.get('chain_of_thought'),
+        **meta,
+        'parse_status': 'ok',
+        'extraction': parsed['extraction'],
+    }
+    checked = lint(row['code_scad'] or "")
+    row['valid'] = checked.ok
+    row['lint_errors'] = len(checked.errors)
+    return row
+
+def safe_parse_result(result):
+    """
+    parse_result, but a response that breaks the parser becomes a parse
+    error row instead of stopping the run.
+    """
+    try:
+        return parse_result(result)
+    except Exception as exc:
+        return {
+            'prompt': result.get('prompt'),
+            'prompt_hash': result.get('prompt_hash') or prompt_hash(result.get('prompt', '')),
+            'model': result.get('model'),
+            'parse_status': 'parse_error',
+            'error': f"{type(exc).__name__}: {exc}",
+            'raw_response': result.get('response'),
         }
-        async with session.post(TOGETHER_API_URL, headers=headers, json=payload) as resp:
-            if resp.status != 200:
-                text = await resp.text()
-                return {"prompt": prompt, "error": f"HTTP {resp.status}: {text}"}
-            data = await resp.json()
-            # Together returns choices list
-            content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-            return {"prompt": prompt, "response": content}
-
-async def generate_cad_thoughts(prompts, args):
+
+class RenderChecker:
+    """
+    Render-verify generated SCAD: a full render to STL gives the status and
+    mesh statistics, then a thumbnail is rendered. OpenSCAD runs from a
+    thread pool, one process per core by default, while the workers keep
+    waiting on the network. Every outcome, failures included, is cached on
+    disk by code hash next to the renders, so repeated code and resumed runs
+    are never rendered twice.
+    """
+    def __init__(self, root, workers=None, timeout=120):
+        self.cache = RenderCache(root, max_bytes=4 * 1024 * 1024 * 1024)
+        self.timeout = timeout
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="openscad")
+
+    async def check(self, code):
+        # the copied context keeps OpenSCAD spans in the row's trace
+        return await asyncio.get_running_loop().run_in_executor(
+            self.pool, contextvars.copy_context().run, self._check, code)
+
+    def _check(self, code):
+        record_path = self.cache.path_for(render_key(code, record="render_check"), "json")
+        try:
+            with open(record_path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+            if not record.get("thumbnail") or os.path.exists(record["thumbnail"]):
+                return record
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        record = self._render(code)
+        # a timeout might pass on a less loaded machine, so it isn't cached
+        if record["render_status"] != "timeout":
+            tmp = self.cache.tmp_path("json")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(record, f)
+            self.cache.put(os.path.basename(record_path)[:-5], tmp, "json")
+        return record
+
+    def _render(self, code):
+        os.makedirs(self.cache.root, exist_ok=True)
+        fd, scad_path = tempfile.mkstemp(suffix=".scad", prefix=".tmp-", dir=self.cache.root)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(code)
+        try:
+            stl = self.cache.render(scad_path, code, timeout=self.timeout, **mesh_tier("stl"))
+            if not stl.ok:
+                return {"render_status": "timeout" if stl.timed_out else "failed",
+                        "render_error": render_errors(stl.stderr)}
+            try:
+                stats = mesh_stats(stl.path)
+            except ValueError as exc:
+                return {"render_status": "failed", "render_error": str(exc)}
+            if stats.triangles == 0:
+                return {"render_status": "empty", "mesh": stats.to_dict()}
+            thumb = self.cache.render(scad_path, code, timeout=self.timeout, **TIERS["thumb"])
+            return {"render_status": "ok", "mesh": stats.to_dict(),
+                    "thumbnail": thumb.path if thumb.ok else None}
+        finally:
+            os.remove(scad_path)
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+def _open_partial(partial_file):
+    """
+    Open the partial file for appending, terminating a half-written last line first.
+    """
+    needs_newline = False
+    if os.path.exists(partial_file) and os.path.getsize(partial_file) > 0:
+        with open(partial_file, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    partial = open(partial_file, "a", encoding="utf-8")
+    if needs_newline:
+        partial.write("\n")
+    return partial
+
+class ShardedJSONLWriter:
+    """
+    Append rows to a JSONL file, rolling over to a new shard every
+    `shard_size` rows (0 = single file).
+    """
+    def __init__(self, path, shard_size=0):
+        self.path = path
+        self.shard_size = shard_size
+        self.paths = []
+        self._fh = None
+        self._rows = 0
+
+    def _shard_path(self, index):
+        if not self.shard_size:
+            return self.path
+        root, ext = os.path.splitext(self.path)
+        return f"{root}-{index:05d}{ext or '.jsonl'}"
+
+    def write(self, row):
+        if self._fh is None or (self.shard_size and self._rows % self.shard_size == 0 and self._rows):
+            if self._fh is not None:
+                self._fh.close()
+            path = self._shard_path(len(self.paths))
+            self.paths.append(path)
+            self._fh = open(path, "w", encoding="utf-8")
+        self._fh.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self._rows += 1
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+def jsonl_to_json_array(paths, json_path):
+    """
+    Stream JSONL shards into a single JSON array file, one row at a time.
+    """
+    with open(json_path, "w", encoding="utf-8") as out:
+        out.write("[")
+        first = True
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    out.write("\n  " if first else ",\n  ")
+                    out.write(line)
+                    first = False
+        out.write("\n]\n")
+
+async def generate_cad_thoughts(args):
+    """
+    Bounded producer/consumer pipeline: prompts are read lazily from
+    --input_file, a fixed pool of workers calls the model and a single
+    writer streams raw results to --partial_file and parsed rows to
+    --output_file. With --render, rows are render-verified on a pool of
+    OpenSCAD processes before they are written, overlapping with the
+    requests still in flight. Memory use does not grow with the size of the
+    input. Returns the list of output shard paths.
+    """
     # fixed model/provider for CAD-THOUGHTS
     model_name = "deepseek-ai/DeepSeek-R1"
     system_prompt = (
@@ -74,61 +315,195 @@ async def generate_cad_thoughts(prompts, args):
         "For the following design specification, generate an OpenSCAD module and then provide a detailed step-by-step chain-of-thought explaining your design decisions. "
         "Output **only** valid JSON** with keys 'code_scad' (string) and 'chain_of_thought' (array of strings)."
     )
-    sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-    async with aiohttp.ClientSession() as session:
-        tasks = [fetch_completion(session, sem, p, system_prompt, model_name,
-                                  args.temperature, args.top_p, args.max_tokens)
-                 for p in prompts]
-        pbar = tqdm(total=len(tasks), desc="Generating CAD-THOUGHTS")
-        cad_data = []
-        with open(args.partial_file, "a", encoding="utf-8") as partial:
-            for coro in asyncio.as_completed(tasks):
-                result = await coro
-                partial.write(json.dumps(result, ensure_ascii=False) + "\n")
-                # parse JSON response
-                if 'response' in result:
-                    try:
-                        parsed = json.loads(result['response'])
-                        cad_data.append({
-                            'prompt': result['prompt'],
-                            'code_scad': parsed.get('code_scad'),
-                            'chain_of_thought': parsed.get('chain_of_thought')
-                        })
-                    except Exception:
-                        cad_data.append({
-                            'prompt': result['prompt'],
-                            'error': 'Failed to parse JSON',
-                            'raw_response': result['response']
-                        })
+
+    completed = (load_completed(args.partial_file, reparse=args.reparse_only)
+                 if args.resume or args.reparse_only else {})
+    prompt_queue = asyncio.Queue(maxsize=args.workers * 2)
+    result_queue = asyncio.Queue(maxsize=args.workers * 2)
+    stats = {"prompts": 0, "duplicates": 0, "resumed": 0, "generated": 0, "rendered": 0, "unrecovered": 0}
+    checker = RenderChecker(args.render_dir, args.render_workers, args.render_timeout) if args.render else None
+
+    async def producer():
+        seen = set()
+        for p in iter_prompts(args.input_file):
+            stats["prompts"] += 1
+            h = prompt_hash(p)
+            # collapse duplicate prompts into a single request each
+            if h in seen:
+                stats["duplicates"] += 1
+                continue
+            seen.add(h)
+            if h in completed:
+                stats["resumed"] += 1
+                await result_queue.put(("resumed", completed[h]))
+            elif args.reparse_only:
+                stats["unrecovered"] += 1  # would be requested again without --reparse_only
+            else:
+                await prompt_queue.put(p)
+        for _ in range(args.workers):
+            await prompt_queue.put(None)
+
+    async def worker():
+        while True:
+            p = await prompt_queue.get()
+            if p is None:
+                return
+            with metrics.trace("thought") as span:
+                result = await fetch_completion(p, system_prompt, model_name,
+                                                args.temperature, args.top_p, args.max_tokens)
+                result["prompt_hash"] = prompt_hash(p)
+                span.set(prompt_hash=result["prompt_hash"], ok="response" in result)
+            # the writer records its file I/O under this row's trace
+            await result_queue.put(("new", (result, span)))
+
+    async def emit(row, span, pbar):
+        if checker is not None and row.get('code_scad'):
+            if row.get('valid'):
+                with metrics.span("render", parent=span) as render_span:
+                    row.update(await checker.check(row['code_scad']))
+                    render_span.set(status=row['render_status'])
+            else:
+                row['render_status'] = 'invalid'  # rejected by the linter, not worth a process
+            stats["rendered"] += row['render_status'] == 'ok'
+        with metrics.span("file_io", parent=span, op="write"):
+            for output in outputs:
+                output.write(row)
+        pbar.update(1)
+
+    async def render_and_emit(row, span, pbar, slot):
+        try:
+            await emit(row, span, pbar)
+        finally:
+            slot.release()
+
+    async def writer(partial, previous, outputs, pbar):
+        # renders overlap with generation; the slots bound the rows in flight
+        slots = asyncio.Semaphore(checker.workers * 2 if checker else 1)
+        pending = set()
+        try:
+            while True:
+                item = await result_queue.get()
+                if item is None:
+                    break
+                kind, payload = item
+                if kind == "resumed":
+                    # completed rows are re-read from the partial file by offset
+                    previous.seek(payload)
+                    result, span = json.loads(previous.readline()), None
+                    row = safe_parse_result(result)
                 else:
-                    cad_data.append(result)
-                pbar.update(1)
-        return cad_data
+                    result, span = payload
+                    with metrics.span("parse", parent=span):
+                        row = safe_parse_result(result)
+                    result["parse_status"] = row["parse_status"]
+                    with metrics.span("file_io", parent=span, op="append"):
+                        partial.write(json.dumps(result, ensure_ascii=False) + "\n")
+                        partial.flush()
+                    stats["generated"] += 1
+                if checker is None:
+                    await emit(row, span, pbar)
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(render_and_emit(row, span, pbar, slots))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            await asyncio.gather(*pending)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    output = ShardedJSONLWriter(args.output_file, args.shard_size)
+    outputs = [output]
+    if args.parquet_dir:
+        # columnar copy for fine-tuning and filtering without loading the JSON
+        outputs.append(ParquetShardWriter(args.parquet_dir, args.parquet_rows_per_shard))
+    # per-row spans (provider call, parse, file I/O) as buffered JSON lines
+    sink = metrics.add_sink(metrics.JsonlSink(args.metrics_file)) if args.metrics_file else None
+    pbar = tqdm(desc="Generating CAD-THOUGHTS", unit="prompt")
+    with _open_partial(args.partial_file) as partial, \
+            open(args.partial_file, "rb") as previous:
+        workers = [asyncio.create_task(worker()) for _ in range(args.workers)]
+
+        async def end_of_results():
+            await asyncio.gather(*workers)
+            await result_queue.put(None)
+
+        stages = [asyncio.create_task(producer()), *workers, asyncio.create_task(end_of_results()),
+                  asyncio.create_task(writer(partial, previous, outputs, pbar))]
+        try:
+            # waiting on one stage at a time would hang on a full queue once
+            # another stage has died; the first failure stops the run
+            done, _ = await asyncio.wait(stages, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        finally:
+            for task in stages:
+                task.cancel()
+            for out in outputs:
+                out.close()
+            if checker is not None:
+                checker.close()
+            pbar.close()
+            if sink is not None:
+                sink.close()
+            await close_session()
+
+    print(f"{stats['prompts']} prompts, {stats['duplicates']} duplicates, "
+          f"{stats['resumed']} resumed, {stats['generated']} generated"
+          + (f", {stats['rendered']} rendered" if checker else "")
+          + (f", {stats['unrecovered']} missing or unrecoverable" if args.reparse_only else ""))
+    print(f"Time per stage: {metrics.stage_summary()}")
+    if args.parquet_dir:
+        print(summary(args.parquet_dir).to_string(index=False))
+    return output.paths
 
 async def main():
     parser = argparse.ArgumentParser(description="Generate CAD-THOUGHTS with DeepSeek-R1")
     parser.add_argument("--input_file", type=str, required=True,
                         help="Path to text file with one design prompt per line")
     parser.add_argument("--output_file", type=str, required=True,
-                        help="Path to save CAD-THOUGHTS JSON list")
+                        help="Path to save CAD-THOUGHTS rows as JSONL")
+    parser.add_argument("--shard_size", type=int, default=0,
+                        help="Rows per output shard (<output_file>-NNNNN.jsonl); 0 writes a single file")
+    parser.add_argument("--json_output", type=str, default=None,
+                        help="Optionally convert the JSONL output into a single JSON list at this path")
+    parser.add_argument("--parquet_dir", type=str, default=None,
+                        help="Also write the rows as zstd Parquet shards into this directory "
+                             "(read them with cad_common.dataset)")
+    parser.add_argument("--parquet_rows_per_shard", type=int, default=100_000,
+                        help="Rows per Parquet shard (part-NNNNN.parquet)")
+    parser.add_argument("--render", action="store_true",
+                        help="Render-verify every code_scad (STL + thumbnail) while generating")
+    parser.add_argument("--render_dir", type=str, default="cad_renders",
+                        help="Render cache: meshes, thumbnails and per-code render results")
+    parser.add_argument("--render_workers", type=int, default=0,
+                        help="Parallel OpenSCAD processes; 0 uses every core")
+    parser.add_argument("--render_timeout", type=float, default=120,
+                        help="Seconds per OpenSCAD render")
     parser.add_argument("--partial_file", type=str, default="cad_partial.jsonl",
                         help="File to append intermediate results")
+    parser.add_argument("--metrics_file", type=str, default="cad_metrics.jsonl",
+                        help="JSON lines file for per-row timing spans; empty to disable")
+    parser.add_argument("--no_resume", dest="resume", action="store_false",
+                        help="Ignore prompts already completed in --partial_file and regenerate them")
+    parser.add_argument("--reparse_only", action="store_true",
+                        help="Rebuild the outputs from --partial_file without calling the model, "
+                             "e.g. after the answer extraction improved")
+    parser.add_argument("--workers", type=int, default=MAX_CONCURRENT_REQUESTS,
+                        help="Upper bound on concurrent requests; the rate limiter adapts below it")
     parser.add_argument("--temperature", type=float, default=0.6)
     parser.add_argument("--top_p", type=float, default=0.95)
     parser.add_argument("--max_tokens", type=int, default=12000)
     args = parser.parse_args()
 
-    # load prompts
-    with open(args.input_file, 'r', encoding='utf-8') as f:
-        prompts = [line.strip() for line in f if line.strip()]
-
     # generate
-    cad_thoughts = await generate_cad_thoughts(prompts, args)
+    shards = await generate_cad_thoughts(args)
+    print(f"Done! CAD-THOUGHTS saved to {', '.join(shards) or args.output_file}")
 
-    # save full output
-    with open(args.output_file, 'w', encoding='utf-8') as out:
-        json.dump(cad_thoughts, out, ensure_ascii=False, indent=2)
-    print(f"Done! CAD-THOUGHTS saved to {args.output_file}")
+    # optional post-processing into one JSON list
+    if args.json_output:
+        jsonl_to_json_array(shards, args.json_output)
+        print(f"JSON list saved to {args.json_output}")
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,16 +1,28 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, send_file
 import os
 import re
+import sys
 import json
-import time
-from datetime import datetime
+import math
 from dotenv import load_dotenv
-from openai import OpenAI
-from openscad_runner import RenderMode, OpenScadRunner
-import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cad_common import metrics
+from cad_common.aio import iter_sync, run_sync
+from cad_common.artifacts import ArtifactStore, valid_id
+from cad_common.mesh import expected_size, mesh_stats, verify
+from cad_common.params import lift_literals, parameters, resolve_overrides
+from cad_common.providers import get_provider
+from cad_common.render_cache import MESH_FORMATS, TIERS, RenderCache, mesh_tier
+from cad_common.render_jobs import RenderQueue
+from cad_common.repair import queued_render, repair_loop, repair_prompt
+from cad_common.response_cache import ResponseCache
+from cad_common.routing import Router
+from cad_common.scad_lint import lint
+from cad_common.selection import select_first
 
 # -------------------------------------------------
-# Config & OpenAI client
+# Config & provider keys
 # -------------------------------------------------
 load_dotenv()
 
@@ -40,8 +52,22 @@ def _load_keys(json_path: str = "keys.json") -> dict:
 
 keys = _load_keys()
 
-# OpenAI client (works already for you)
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", keys.get("gpt")))
+IMAGES_DIR = os.path.join("static", "images")
+render_cache = RenderCache(os.path.join(IMAGES_DIR, "cache"),
+                           max_bytes=int(os.getenv("RENDER_CACHE_MAX_BYTES", 512 * 1024 * 1024)))
+# generated .scad files: random ids, sharded directories, swept in the background
+scad_store = ArtifactStore("scad_scripts",
+                           max_bytes=int(os.getenv("ARTIFACT_MAX_BYTES", 1024 * 1024 * 1024)),
+                           max_age=float(os.getenv("ARTIFACT_MAX_AGE", 7 * 24 * 3600))).start_gc()
+# OpenSCAD runs off the request thread, one process per core by default
+render_queue = RenderQueue(workers=int(os.getenv("RENDER_WORKERS", 0)) or None,
+                           timeout=float(os.getenv("RENDER_TIMEOUT", 120)))
+# full CGAL/Manifold renders for mesh export: few slots, so they never starve previews
+mesh_queue = RenderQueue(workers=int(os.getenv("MESH_WORKERS", 0)) or max(1, (os.cpu_count() or 2) // 2),
+                         timeout=float(os.getenv("MESH_TIMEOUT", 600)))
+# best-of-N and repair jobs only wait, on render jobs and model calls, so
+# they get their own threads instead of a render slot
+select_queue = RenderQueue(workers=int(os.getenv("SELECT_WORKERS", 8)), timeout=None)
 
 SYSTEM_PROMPT = (
     "You are an expert CAD engineer who writes clear, idiomatic OpenSCAD. "
@@ -57,6 +83,49 @@ MODEL_MAP = {
     "gemini": "gemini-1.5-pro",
 }
 
+SOURCE_LABELS = {
+    "openai": "OpenAI GPT-4o",
+    "claude": "Anthropic Claude 3.5 Sonnet",
+    "deepseek": "Together / DeepSeek V3",
+    "together": "Together / DeepSeek V3",
+    "gemini": "Google Gemini 1.5 Pro",
+}
+
+def _configured_providers() -> list:
+    # one entry per distinct backend (deepseek and together are the same) with a key
+    names, seen = [], set()
+    for name, model in MODEL_MAP.items():
+        backend = get_provider(name, model)
+        if (type(backend), model) in seen:
+            continue
+        try:
+            backend.api_key
+        except ValueError:
+            continue
+        seen.add((type(backend), model))
+        names.append(name)
+    return names
+
+# provider="auto": fastest healthy provider, hedged to the next one after its p95
+router = Router(_configured_providers(),
+                min_delay=float(os.getenv("HEDGE_MIN_DELAY", 1)),
+                max_delay=float(os.getenv("HEDGE_MAX_DELAY", 30)),
+                default_delay=float(os.getenv("HEDGE_DEFAULT_DELAY", 8)))
+
+EMBED_MODEL = "text-embedding-3-small"
+
+def _embed(text: str) -> list:
+    return run_sync(get_provider("openai", EMBED_MODEL).embed(text, dimensions=256))
+
+# exact + embedding-similarity cache of model answers, shared by all workers
+response_cache = ResponseCache(
+    os.getenv("RESPONSE_CACHE_PATH", os.path.join("cache", "responses.sqlite3")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", 7 * 24 * 3600)),
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 5000)),
+    threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", 0.95)),
+    embed=_embed if os.getenv("OPENAI_API_KEY") else None,
+)
+
 def _strip_to_scad(code: str) -> str:
     # strip fenced code if present
     m = re.search(r"```(?:scad|openscad)?\s*([\s\S]*?)```", code, flags=re.IGNORECASE)
@@ -66,127 +135,198 @@ def _strip_to_scad(code: str) -> str:
     code = re.sub(r"\bopenscad\b", "", code, flags=re.IGNORECASE)
     return code.strip()
 
-def generate_scad(request_str: str, provider: str = "gpt") -> tuple[str, str]:
+def _resolve_provider(provider: str) -> str:
     provider = (provider or "gpt").lower()
-    user_msg = (
+    if provider == "gpt":
+        provider = "openai"
+    if provider not in MODEL_MAP and provider != "auto":
+        raise ValueError(f"Unsupported provider: {provider}")
+    return provider
+
+def _complete(provider: str, prompt: str, timeout: float = None) -> tuple[str, str]:
+    """
+    One model call, as (text, source label). With provider "auto" the
+    router picks the provider, hedges slow calls and fails over; only an
+    answer that already passes validation is accepted.
+    """
+    async def ask(name: str) -> str:
+        completion = await get_provider(name, MODEL_MAP[name]).complete(
+            prompt,
+            system=SYSTEM_PROMPT,
+            temperature=0.2,   # deterministic for CAD code
+            max_tokens=2048,
+        )
+        return completion.text.strip()
+
+    # pooled async client; 429/5xx backoff happens on the shared event loop,
+    # not by sleeping in this Flask worker
+    if provider == "auto":
+        text, name = run_sync(router.call(ask, validate=lambda text: lint(_strip_to_scad(text)).ok),
+                              timeout=timeout)
+        return text, f"{SOURCE_LABELS[name]} (auto)"
+    return run_sync(ask(provider), timeout=timeout), SOURCE_LABELS[provider]
+
+def _user_msg(request_str: str) -> str:
+    return (
         f"Create the OpenSCAD code to generate the 3D model for a {request_str}. "
         "Answer ONLY with the code."
     )
 
-    # -------------------------- OpenAI --------------------------
-    if provider in {"gpt", "openai"}:
-        resp = client.chat.completions.create(
-            model=MODEL_MAP["openai"],
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_msg},
-            ],
-        )
-        return resp.choices[0].message.content.strip(), "OpenAI GPT-4o"
-
-    # -------------------------- Anthropic (Claude) --------------------------
-    if provider == "claude":
-        api_key = os.getenv("CLAUDE_API_KEY", keys.get("claude"))
-        if not api_key:
-            raise ValueError("CLAUDE_API_KEY not configured")
-
-        url = "https://api.anthropic.com/v1/messages"
-        headers = {
-            "x-api-key": api_key,
-            "anthropic-version": "2023-06-01",
-            "content-type": "application/json",
-            "accept": "application/json",
-        }
-        payload = {
-            # Use the 'latest' alias to avoid 400s due to a dated id you don't have access to
-            "model": MODEL_MAP["claude"],
-            "max_tokens": 2048,
-            "system": SYSTEM_PROMPT,
-            # Send content as a simple string for maximal compatibility
-            "messages": [{"role": "user", "content": user_msg}],
-        }
-        resp = requests.post(url, headers=headers, json=payload, timeout=90)
-        if not resp.ok:
-            # Bubble up exact Anthropic error to the UI
-            try:
-                err = resp.json()
-            except Exception:
-                err = resp.text
-            raise RuntimeError(f"Anthropic error {resp.status_code}: {err}")
-        data = resp.json()
-        parts = data.get("content", [])
-        scad = "".join(p.get("text", "") for p in parts if p.get("type") == "text").strip()
-        return scad, "Anthropic Claude 3.5 Sonnet"
-
-    # -------------------------- Together / DeepSeek --------------------------
-    if provider in {"together", "deepseek"}:
-        api_key = os.getenv("TOGETHER_API_KEY", keys.get("together"))
-        if not api_key:
-            raise ValueError("TOGETHER_API_KEY not configured")
-
-        url = "https://api.together.xyz/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-        }
-        payload = {
-            "model": MODEL_MAP["together"],
-            "messages": [
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_msg},
-            ],
-            "temperature": 0.2,   # deterministic for CAD code
-            "max_tokens": 2048,
-        }
-        resp = requests.post(url, headers=headers, json=payload, timeout=90)
-        if not resp.ok:
-            try:
-                err = resp.json()
-            except Exception:
-                err = resp.text
-            raise RuntimeError(f"Together error {resp.status_code}: {err}")
-        data = resp.json()
-        return data["choices"][0]["message"]["content"].strip(), "Together / DeepSeek V3"
-
-    # -------------------------- Google Gemini --------------------------
-    if provider == "gemini":
-        api_key = os.getenv("GEMINI_API_KEY", keys.get("gemini"))
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY not configured")
-
-        url = (
-            "https://generativelanguage.googleapis.com/v1beta/models/"
-            f"{MODEL_MAP['gemini']}:generateContent?key={api_key}"
-        )
-        payload = {
-            "system_instruction": {"parts": [{"text": SYSTEM_PROMPT}]},
-            "contents": [{"role": "user", "parts": [{"text": user_msg}]}],
-            "generationConfig": {"temperature": 0.2, "maxOutputTokens": 2048},
-        }
-
-        # simple 429 backoff loop (handles free-tier rate limits)
-        for attempt in range(4):  # 1 try + up to 3 retries
-            resp = requests.post(url, json=payload, timeout=90)
-            if resp.status_code != 429:
-                break
-            # exponential backoff: 1s, 2s, 4s
-            time.sleep(2 ** attempt)
-        if not resp.ok:
-            try:
-                err = resp.json()
-            except Exception:
-                err = resp.text
-            raise RuntimeError(f"Gemini error {resp.status_code}: {err}")
-
-        data = resp.json()
-        candidate = (data.get("candidates") or [{}])[0]
-        parts = candidate.get("content", {}).get("parts", [])
-        scad = "".join(p.get("text", "") for p in parts).strip()
-        return scad, "Google Gemini 1.5 Pro"
-
-    # -------------------------- Unsupported --------------------------
-    raise ValueError(f"Unsupported provider: {provider}")
+def generate_scad(request_str: str, provider: str = "gpt") -> tuple[str, str]:
+    provider = _resolve_provider(provider)
+    with metrics.span("prompt_build"):
+        user_msg = _user_msg(request_str)
+
+    scad, source, cached = response_cache.get_or_generate(
+        provider, MODEL_MAP.get(provider, "router"), SYSTEM_PROMPT, request_str,
+        lambda: _complete(provider, user_msg))
+    if cached:
+        source = f"{source} (cached)"
+    return scad, source
+
+# best-of-N: candidates are sampled hotter than single answers, for variety
+MAX_SAMPLES = int(os.getenv("MAX_SAMPLES", 8))
+SAMPLE_TEMPERATURE = float(os.getenv("SAMPLE_TEMPERATURE", 0.8))
+
+def generate_candidates(request_str: str, provider: str, n: int) -> tuple[list, str]:
+    """
+    `n` independent answers, sampled concurrently: one request with `n`
+    choices where the API supports it, parallel calls otherwise. Not
+    cached, since the point is fresh samples.
+    """
+    provider = _resolve_provider(provider)
+    if provider == "auto":
+        if not router.names:
+            raise ValueError("No providers configured")
+        provider = router.ranked()[0]
+    with metrics.span("prompt_build"):
+        user_msg = _user_msg(request_str)
+    completions = run_sync(get_provider(provider, MODEL_MAP[provider]).complete_n(
+        user_msg, n, system=SYSTEM_PROMPT, temperature=SAMPLE_TEMPERATURE, max_tokens=2048))
+    return [c.text.strip() for c in completions], SOURCE_LABELS[provider]
+
+# max seconds between two streamed chunks before giving up
+STREAM_IDLE_TIMEOUT = float(os.getenv("STREAM_IDLE_TIMEOUT", 90))
+
+def stream_scad(request_str: str, provider: str, result: dict):
+    """
+    Like generate_scad, but yields the model output as it arrives. A cached
+    answer is yielded in one piece. When the generator is exhausted,
+    result["scad"] and result["source"] hold the complete answer.
+    """
+    provider = _resolve_provider(provider)
+    if provider == "auto":
+        # a hedged call can't be streamed; the winning answer arrives at once
+        scad, source = generate_scad(request_str, provider)
+        result.update(scad=scad, source=source)
+        yield scad
+        return
+    model = MODEL_MAP[provider]
+    cached, embedding = response_cache.lookup(provider, model, SYSTEM_PROMPT, request_str)
+    if cached:
+        result.update(scad=cached.response, source=f"{cached.source} (cached)")
+        yield cached.response
+        return
+
+    backend = get_provider(provider, model)
+    with metrics.span("prompt_build"):
+        user_msg = _user_msg(request_str)
+    parts = []
+    for delta in iter_sync(backend.stream(user_msg, system=SYSTEM_PROMPT,
+                                          temperature=0.2, max_tokens=2048),
+                           timeout=STREAM_IDLE_TIMEOUT):
+        parts.append(delta)
+        yield delta
+    scad = "".join(parts).strip()
+    response_cache.store(provider, model, SYSTEM_PROMPT, request_str, scad, SOURCE_LABELS[provider], embedding)
+    result.update(scad=scad, source=SOURCE_LABELS[provider])
+
+# opt-in server-side repair of code that fails validation or rendering
+REPAIR_MAX_ATTEMPTS = int(os.getenv("REPAIR_MAX_ATTEMPTS", 2))
+REPAIR_BUDGET = float(os.getenv("REPAIR_BUDGET", 90))
+
+def repair_scad(code: str, errors: str, provider: str, timeout: float) -> str:
+    # only the errors and the offending code go back to the same provider
+    text, _ = _complete(_resolve_provider(provider), repair_prompt(code, errors), timeout=timeout)
+    return _strip_to_scad(text)
+
+def _image_name(img_path: str) -> str:
+    # path relative to static/images, as the template expects
+    return os.path.relpath(img_path, IMAGES_DIR).replace(os.sep, "/")
+
+def _render_tier(job, scad_path: str, scad_code: str, tier: dict, defines: dict = None) -> str:
+    result = render_cache.render(scad_path, scad_code, job=job, defines=defines, **tier)
+    if not result.ok:
+        if result.timed_out:
+            raise RuntimeError("OpenSCAD rendering timed out")
+        raise RuntimeError("OpenSCAD rendering failed")
+    return _image_name(result.path)
+
+def _render_preview(job, scad_path: str, scad_code: str, defines: dict = None) -> dict:
+    # the thumbnail is published while the full-size preview still renders
+    job.update(thumbnail=_render_tier(job, scad_path, scad_code, TIERS["thumb"], defines))
+    return {"image": _render_tier(job, scad_path, scad_code, TIERS["preview"], defines)}
+
+def _render_mesh(job, scad_path: str, scad_code: str, fmt: str, defines: dict = None) -> dict:
+    return {"model": _render_tier(job, scad_path, scad_code, mesh_tier(fmt), defines), "format": fmt}
+
+def _cached_tiers(scad_code: str, defines: dict = None) -> dict:
+    """The best image tiers already in the render cache."""
+    found = {}
+    for name, field in (("thumb", "thumbnail"), ("preview", "image")):
+        path = render_cache.lookup(scad_code, defines=defines, **TIERS[name])
+        if path:
+            found[field] = _image_name(path)
+    return found
+
+def _check_candidate(job, candidate: dict) -> dict:
+    """
+    Render one best-of-N candidate to a mesh and check it. A candidate that
+    passes also gets its preview, so the winner is ready to show.
+    """
+    stl = render_cache.render(candidate["path"], candidate["code"], job=job, **mesh_tier("stl"))
+    if not stl.ok:
+        return {"ok": False, "reason": "OpenSCAD rendering timed out" if stl.timed_out else "OpenSCAD rendering failed"}
+    stats = mesh_stats(stl.path)
+    ok, reason, score = verify(stats, candidate["expected"])
+    result = {"ok": ok, "reason": reason, "mesh": stats.to_dict(), "score": score if math.isfinite(score) else None}
+    if ok:
+        result.update(_render_preview(job, candidate["path"], candidate["code"]))
+    return result
+
+def _select_candidate(job, candidates: list) -> dict:
+    # the first candidate that passes wins; the rest are cancelled
+    winner, results = select_first(job, render_queue, _check_candidate, candidates)
+    summary = [{"filename": c["filename"], **{k: (r or {}).get(k) for k in ("ok", "reason", "mesh")}}
+               for c, r in zip(candidates, results)]
+    if winner is None:
+        reasons = "; ".join(sorted({s["reason"] or "cancelled" for s in summary}))
+        raise RuntimeError(f"No candidate passed: {reasons}")
+    chosen, result = candidates[winner], results[winner]
+    out = {"filename": chosen["filename"], "code": chosen["code"], "params": chosen["params"],
+           "mesh": result["mesh"], "candidates": summary}
+    if not result["ok"]:
+        # best effort: the mesh closest to the requested size
+        out["warning"] = result["reason"]
+        result.update(_render_preview(job, chosen["path"], chosen["code"]))
+    out.update({k: result[k] for k in ("thumbnail", "image") if k in result})
+    return out
+
+def _render_with_repair(job, artifact_id: str, scad_code: str, provider: str) -> dict:
+    def render(render_job, code):
+        scad_store.save(code, "scad", artifact_id)
+        return render_cache.render(scad_store.path_for(artifact_id, "scad"), code, job=render_job, **TIERS["preview"])
+
+    # only the renders take a slot on render_queue, not the model calls
+    outcome = repair_loop(
+        scad_code, queued_render(job, render_queue, render),
+        lambda code, errors, left: repair_scad(code, errors, provider, left),
+        max_attempts=REPAIR_MAX_ATTEMPTS, budget=REPAIR_BUDGET,
+    )
+    if not outcome.ok:
+        raise RuntimeError(f"OpenSCAD rendering failed after {len(outcome.attempts) - 1} repair attempt(s):\n{outcome.error}")
+    return {"image": _image_name(outcome.render.path), "code": outcome.code,
+            "params": parameters(outcome.code), "repairs": len(outcome.attempts)}
 
 # -------------------------------------------------
 # Flask setup
@@ -205,39 +345,246 @@ def submit():
 
     try:
         provider = request.form.get("provider", "gpt").lower()
-        scad_code, source = generate_scad(text, provider)
-        scad_code = _strip_to_scad(scad_code)
-
-        # persist to file
-        ts = datetime.now().strftime("%Y%m%d-%H%M%S")
-        os.makedirs("scad_scripts", exist_ok=True)
-        os.makedirs(os.path.join("static", "images"), exist_ok=True)
-        scad_path = os.path.join("scad_scripts", f"{ts}.scad")
-        with open(scad_path, "w", encoding="utf-8") as f:
-            f.write(scad_code)
-
-        # render preview
-        img_path = os.path.join("static", "images", f"{ts}.png")
-        osr = OpenScadRunner(scad_path, img_path, render_mode=RenderMode.preview, imgsize=(800, 600))
-        osr.run()
-
-        if osr.good():
-            return jsonify({
-                "image": f"{ts}.png",
-                "filename": ts,
-                "code": scad_code,
-                "source": source
-            })
-        else:
-            return jsonify({"error": "OpenSCAD rendering failed", "code": scad_code})
+        repair = request.form.get("repair") == "on"
+        samples = max(1, min(MAX_SAMPLES, int(request.form.get("samples") or 1)))
+        with metrics.trace("submit", provider=provider, repair=repair, samples=samples):
+            if samples > 1:
+                candidates, source = generate_candidates(text, provider, samples)
+                return jsonify(_start_best_of(candidates, source, text))
+            scad_code, source = generate_scad(text, provider)
+            return jsonify(_start_render(scad_code, source, provider, repair))
 
     except Exception as exc:
         # return the exact upstream error content to your UI
         return jsonify({"error": f"Server error: {exc}"})
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route("/submit_stream")
+def submit_stream():
+    """
+    Server-Sent Events version of /submit: `token` events carry the code as
+    the model writes it, then one `result` event carries what /submit would
+    have returned (validation starts as soon as the model is done).
+    """
+    text = request.args.get("text", "").strip()
+    provider = request.args.get("provider", "gpt").lower()
+    repair = request.args.get("repair") == "on"
+    if not text:
+        return jsonify({"error": "Empty prompt"}), 400
+    try:
+        _resolve_provider(provider)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    def events():
+        try:
+            with metrics.trace("submit_stream", provider=provider, repair=repair):
+                result = {}
+                for delta in stream_scad(text, provider, result):
+                    yield _sse("token", {"text": delta})
+                yield _sse("result", _start_render(result["scad"], result["source"], provider, repair))
+        except Exception as exc:
+            yield _sse("result", {"error": f"Server error: {exc}"})
+
+    # no buffering anywhere between here and the browser
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _start_render(scad_code: str, source: str, provider: str, repair: bool) -> dict:
+    """
+    Save generated code, then answer from the render cache, reject it on
+    validation errors, or queue a render job. Returns the /submit response.
+    """
+    # literal dimensions become top-level variables the UI can override
+    with metrics.span("strip_scad"):
+        scad_code = lift_literals(_strip_to_scad(scad_code))
+        params = parameters(scad_code)
+
+    # persist to the artifact store; its id is the download filename
+    with metrics.span("file_io", op="save"):
+        artifact_id = scad_store.save(scad_code, "scad")
+        scad_path = scad_store.path_for(artifact_id, "scad")
+
+    # identical code + settings is served from the cache right away
+    cached = _cached_tiers(scad_code)
+    if "image" in cached:
+        return {
+            **cached,
+            "filename": artifact_id,
+            "code": scad_code,
+            "source": source,
+            "params": params
+        }
+
+    # with repair on, validation/render errors go back to the model in the job
+    if repair:
+        job = select_queue.submit(_render_with_repair, artifact_id, scad_code, provider)
+        return {
+            "job": job.id,
+            "status": job.status,
+            "filename": artifact_id,
+            "code": scad_code,
+            "source": source,
+            "params": params
+        }
+
+    # reject broken code before it costs an OpenSCAD process
+    with metrics.span("validate") as span:
+        checked = lint(scad_code)
+        span.set(ok=checked.ok)
+    if not checked.ok:
+        return {
+            "error": "SCAD validation failed:\n" + checked.summary(),
+            "diagnostics": checked.to_list(),
+            "code": scad_code,
+            "source": source
+        }
+
+    # otherwise render in the background; the page polls /jobs/<id>
+    job = render_queue.submit(_render_preview, scad_path, scad_code)
+    return {
+        **cached,
+        "job": job.id,
+        "status": job.status,
+        "filename": artifact_id,
+        "code": scad_code,
+        "source": source,
+        "params": params,
+        "diagnostics": checked.to_list()
+    }
+
+def _start_best_of(answers: list, source: str, request_str: str) -> dict:
+    """
+    Lint every sampled answer, save the survivors and queue a job that
+    renders them in parallel and keeps the first good mesh. The job's
+    result carries the winner's filename, code and images.
+    """
+    with metrics.span("strip_scad"):
+        # identical samples are only checked once
+        codes = list(dict.fromkeys(lift_literals(_strip_to_scad(a)) for a in answers))
+    with metrics.span("validate") as span:
+        checks = [(code, lint(code)) for code in codes]
+        survivors = [code for code, checked in checks if checked.ok]
+        span.set(ok=bool(survivors), candidates=len(codes), survivors=len(survivors))
+    if not survivors:
+        code, checked = checks[0]
+        return {
+            "error": f"SCAD validation failed for all {len(answers)} candidates:\n" + checked.summary(),
+            "diagnostics": checked.to_list(),
+            "code": code,
+            "source": source
+        }
+
+    expected = expected_size(request_str)
+    candidates = []
+    with metrics.span("file_io", op="save"):
+        for code in survivors:
+            artifact_id = scad_store.save(code, "scad")
+            candidates.append({"filename": artifact_id, "path": scad_store.path_for(artifact_id, "scad"),
+                               "code": code, "params": parameters(code), "expected": expected})
+
+    job = select_queue.submit(_select_candidate, candidates)
+    return {
+        "job": job.id,
+        "status": job.status,
+        "code": survivors[0],
+        "source": f"{source} (best of {len(answers)})",
+        "samples": len(answers),
+        "survivors": len(survivors)
+    }
+
+@app.route("/rerender", methods=["POST"])
+def rerender():
+    """
+    Re-render a generated design with parameter overrides (-D), without a
+    model call. Answers with the image on a render-cache hit, else a job.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = str(data.get("filename", ""))
+    if not valid_id(filename):
+        return jsonify({"error": "Invalid filename"}), 400
+    scad_code = scad_store.read(filename, "scad")
+    if scad_code is None:
+        return jsonify({"error": "Unknown design"}), 404
+    scad_path = scad_store.path_for(filename, "scad")
+    try:
+        defines = resolve_overrides(parameters(scad_code), data.get("params"))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    cached = _cached_tiers(scad_code, defines)
+    if "image" in cached:
+        return jsonify({**cached, "filename": filename, "defines": defines})
+    job = render_queue.submit(_render_preview, scad_path, scad_code, defines)
+    return jsonify({**cached, "job": job.id, "status": job.status, "filename": filename, "defines": defines})
+
+@app.route("/export", methods=["POST"])
+def export():
+    """
+    Full render of a generated design to a mesh (STL/3MF), with the same
+    parameter overrides as /rerender. Cached meshes come back right away;
+    otherwise the render runs as a job on the mesh queue.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = str(data.get("filename", ""))
+    fmt = str(data.get("format", "stl")).lower()
+    if not valid_id(filename):
+        return jsonify({"error": "Invalid filename"}), 400
+    if fmt not in MESH_FORMATS:
+        return jsonify({"error": f"Unsupported format: {fmt}"}), 400
+    scad_code = scad_store.read(filename, "scad")
+    if scad_code is None:
+        return jsonify({"error": "Unknown design"}), 404
+    try:
+        defines = resolve_overrides(parameters(scad_code), data.get("params"))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    model_path = render_cache.lookup(scad_code, defines=defines, **mesh_tier(fmt))
+    if model_path:
+        return jsonify({"model": _image_name(model_path), "format": fmt, "filename": filename})
+    job = mesh_queue.submit(_render_mesh, scad_store.path_for(filename, "scad"), scad_code, fmt, defines)
+    return jsonify({"job": job.id, "status": job.status, "format": fmt, "filename": filename})
+
+def _find_job(job_id: str):
+    for queue in (render_queue, mesh_queue, select_queue):
+        job = queue.get(job_id)
+        if job is not None:
+            return queue, job
+    return None, None
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    _, job = _find_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    queue, job = _find_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify({"cancelled": queue.cancel(job_id)})
+
+@app.route("/providers")
+def providers():
+    # rolling latency/error profile the "auto" provider routes on
+    return jsonify(router.to_dict())
+
+@app.route("/metrics")
+def metrics_endpoint():
+    # Prometheus text format: stage latencies, provider calls, cache and job counters
+    return Response(metrics.exposition(), content_type=metrics.CONTENT_TYPE)
+
 @app.route("/download/<filename>")
 def download_file(filename):
-    return send_from_directory("scad_scripts", f"{filename}.scad", as_attachment=True)
+    path = scad_store.get(filename, "scad")
+    if path is None:
+        return jsonify({"error": "Unknown design"}), 404
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=f"{filename}.scad")
 
 if __name__ == "__main__":
     app.run(debug=False)
@@ -0,0 +1,85 @@
+import contextvars
+import json
+
+import pytest
+
+from cad_common.decompose import decompose, default_assembly, parse_plan
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def plan(*parts):
+    return json.dumps({"parts": list(parts)})
+
+
+def test_dependency_order_and_unknown_references():
+    tasks = parse_plan(plan({"name": "Lid", "description": "a lid", "depends_on": ["base", "hinge"]},
+                            {"name": "base", "description": "a box"}))
+    assert [t.name for t in tasks] == ["base", "lid"]
+    assert tasks[1].depends_on == ["base"]
+
+
+def test_parts_given_by_name_only():
+    tasks = parse_plan(plan("base", "lid"))
+    assert [(t.name, t.description) for t in tasks] == [("base", "base"), ("lid", "lid")]
+
+
+def test_unusable_parts_are_skipped():
+    tasks = parse_plan(plan(3, None, {"name": "base", "depends_on": "lid"}, ["x"], {"name": "lid"}))
+    assert [t.name for t in tasks] == ["lid", "base"]
+    with pytest.raises(ValueError):
+        parse_plan(plan(3, None))
+    with pytest.raises(ValueError):
+        parse_plan('{"parts": "base and lid"}')
+
+
+def test_builtin_names_are_suffixed():
+    tasks = parse_plan(plan({"name": "cube"}, {"name": "Cylinder", "depends_on": ["cube"]}, {"name": "cube_part"}))
+    assert [t.name for t in tasks] == ["cube_part", "cube_part_2", "cylinder_part"]
+    assert tasks[2].depends_on == ["cube_part"]
+
+
+def test_cycles_are_rejected():
+    with pytest.raises(ValueError):
+        parse_plan(plan({"name": "a", "depends_on": ["b"]}, {"name": "b", "depends_on": ["a"]}))
+
+
+def test_unusable_plan_falls_back_to_one_part():
+    def complete(prompt):
+        if prompt.startswith("You have the following objective"):
+            return '{"parts": ["base", 7]'  # truncated JSON
+        if "Write the part" in prompt:
+            return "cube(10);"
+        return "model();"
+
+    design = decompose("10 mm cube", complete)
+    assert [p.name for p in design.parts] == ["model"]
+    assert "module model() {\n    cube(10);\n}" in design.code
+    assert design.assembly == "model();"
+
+
+def test_workers_run_in_the_callers_context():
+    seen = []
+
+    def complete(prompt):
+        seen.append(request_id.get())
+        if prompt.startswith("You have the following objective"):
+            return plan("base", {"name": "lid", "depends_on": ["base"]})
+        return "cube(1);"
+
+    request_id.set("r1")
+    design = decompose("box", complete, max_workers=2)
+    assert [p.name for p in design.parts] == ["base", "lid"]
+    assert seen == ["r1"] * 4
+
+
+def test_default_assembly_keeps_parts_that_are_only_fitted():
+    box, lid = parse_plan(plan({"name": "box"}, {"name": "lid", "depends_on": ["box"]}))
+    box.code = "module box() { cube(10); }"
+    lid.code = "module lid() { translate([0, 0, 10]) cube([10, 10, 1]); }"
+    assert default_assembly([box, lid]) == "union() {\n    box();\n    lid();\n}"
+    # a part that calls another one contains it
+    lid.code = "module lid() { box(); translate([0, 0, 10]) cube([10, 10, 1]); }"
+    assert default_assembly([box, lid]) == "union() {\n    lid();\n}"
+    lid.code = "module box() { cube(10); }\nmodule lid() { cube(1); }"
+    assert default_assembly([box, lid]) == "union() {\n    box();\n    lid();\n}"
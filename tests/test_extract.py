@@ -0,0 +1,95 @@
+import json
+import time
+
+from cad_common.extract import ObjectScanner, extract_answer
+
+CODE = "difference() {\n  cube([10, 10, 2]);\n  cylinder(d = 3, h = 5);\n}"
+
+
+def test_plain_json():
+    answer = extract_answer(json.dumps({"code_scad": CODE, "chain_of_thought": ["a"]}))
+    assert answer["code_scad"] == CODE
+    assert answer["chain_of_thought"] == ["a"]
+    assert answer["extraction"] == "json"
+
+
+def test_think_block_and_fenced_json():
+    text = ("<think>\nUse {braces} here.\n\nSecond step.\n</think>\n```json\n"
+            + json.dumps({"code_scad": CODE}) + "\n```")
+    answer = extract_answer(text)
+    assert answer["code_scad"] == CODE
+    assert answer["chain_of_thought"] == ["Use {braces} here.", "Second step."]
+
+
+def test_stray_brace_in_prose_does_not_hide_the_answer():
+    text = 'Note: use {braces carefully.\n{"code_scad": "cube(1);", "chain_of_thought": ["x"]}'
+    answer = extract_answer(text)
+    assert answer["code_scad"] == "cube(1);"
+    assert answer["extraction"] == "json"
+
+
+def test_truncated_object_before_the_answer():
+    text = '{"code_scad": "cube(' + "\n" + '{"code_scad": "sphere(2);"}'
+    assert extract_answer(text)["code_scad"] == "sphere(2);"
+
+
+def test_repaired_json():
+    text = '<think>x</think>{"code_scad": "cube([1,2,3]);\n// a\\d", "chain_of_thought": ["s",],}'
+    answer = extract_answer(text)
+    assert answer["code_scad"] == "cube([1,2,3]);\n// a\\d"
+    assert answer["extraction"] == "json_repaired"
+
+
+def test_code_as_list_of_lines():
+    answer = extract_answer(json.dumps({"code_scad": ["cube(1);", "sphere(2);"]}))
+    assert answer["code_scad"] == "cube(1);\nsphere(2);"
+
+
+def test_non_string_code_is_not_an_answer():
+    assert extract_answer(json.dumps({"code_scad": 5})) is None
+    assert extract_answer(json.dumps({"code_scad": {"a": 1}})) is None
+    assert extract_answer(json.dumps({"code_scad": ["cube(1);", 2]})) is None
+
+
+def test_non_string_code_falls_back_to_fenced_scad():
+    text = json.dumps({"code_scad": {"a": 1}}) + "\n```openscad\ncube(4);\n```"
+    answer = extract_answer(text)
+    assert answer["code_scad"] == "cube(4);"
+    assert answer["extraction"] == "fenced_scad"
+
+
+def test_fenced_scad_fallback():
+    answer = extract_answer("<think>step one\n\nstep two</think>\n```openscad\n" + CODE + "\n```")
+    assert answer["code_scad"] == CODE
+    assert answer["chain_of_thought"] == ["step one", "step two"]
+    assert answer["extraction"] == "fenced_scad"
+
+
+def test_nothing_usable():
+    assert extract_answer("<think>hmm</think> I can't.") is None
+    assert extract_answer("") is None
+
+
+def test_scanner_is_incremental():
+    scanner, found = ObjectScanner(), []
+    text = 'x {"a": "}{", "b": {"c": 1}} y {"d": 2}'
+    for i in range(0, len(text), 3):
+        found += scanner.feed(text[i:i + 3])
+    assert found == ['{"a": "}{", "b": {"c": 1}}', '{"d": 2}']
+
+
+def test_answer_after_other_objects_and_scad_blocks():
+    text = ('<think>module m() { cube(1); } and {"note": {"code_scad": ""}} then '
+            '{"code_scad": "cube(2);"}</think>')
+    assert extract_answer(text)["code_scad"] == "cube(2);"
+
+
+def test_long_truncated_reasoning_is_scanned_once():
+    draft = ('Maybe:\n```\nmodule m() {\n  difference() {\n    cube([10, 20, 3]);\n'
+             '    for (i = [0:3]) { translate([i*5, 5, -1]) cylinder(d=3, h=5); }\n  }\n}\n```\n'
+             'The "holes" are wrong {fix later.\n\n')
+    body = draft * (50_000 // len(draft))
+    text = "<think>" + body + json.dumps({"code_scad": "cube(1);"}) + body
+    started = time.perf_counter()
+    assert extract_answer(text)["code_scad"] == "cube(1);"
+    assert time.perf_counter() - started < 0.5
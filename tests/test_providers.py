@@ -0,0 +1,43 @@
+import pytest
+
+from cad_common.providers import DEFAULT_LIMITS, get_provider
+from cad_common.ratelimit import ModelLimits, get_limiter
+
+
+def test_provider_is_shared_and_kwargs_may_be_left_out():
+    first = get_provider("openai", "test-shared", timeout=30)
+    assert get_provider("openai", "test-shared", timeout=30) is first
+    assert get_provider("OpenAI", "test-shared") is first
+
+
+def test_provider_with_other_kwargs_is_rejected():
+    get_provider("together", "test-kwargs", api_key="a", timeout=30)
+    with pytest.raises(ValueError):
+        get_provider("together", "test-kwargs", api_key="b", timeout=30)
+    with pytest.raises(ValueError):
+        get_provider("together", "test-kwargs", api_key="a", timeout=60)
+
+
+def test_unknown_provider():
+    with pytest.raises(ValueError):
+        get_provider("nope", "test-model")
+
+
+def test_limiter_keeps_its_first_limits():
+    limits = ModelLimits(requests_per_second=1)
+    limiter = get_limiter("test-limiter", limits)
+    assert get_limiter("test-limiter") is limiter
+    assert get_limiter("test-limiter", ModelLimits(requests_per_second=1)) is limiter
+    with pytest.raises(ValueError):
+        get_limiter("test-limiter", ModelLimits(requests_per_second=5))
+
+
+def test_provider_limits_default_and_alias_share_the_limiter():
+    assert get_provider("gemini", "test-default").limiter.limits == DEFAULT_LIMITS
+    limits = ModelLimits(requests_per_second=2)
+    claude = get_provider("claude", "test-alias", limits=limits)
+    # the alias is another instance of the same provider and model
+    assert get_provider("anthropic", "test-alias").limiter is claude.limiter
+    get_provider("anthropic", "test-alias-2", limits=limits)
+    with pytest.raises(ValueError):
+        get_provider("claude", "test-alias-2", limits=ModelLimits(requests_per_second=9))
@@ -0,0 +1,53 @@
+import threading
+import time
+
+from cad_common.render_jobs import CANCELLED, DONE, FINISHED, RenderQueue
+
+
+def wait_finished(job, timeout=5):
+    deadline = time.time() + timeout
+    while job.status not in FINISHED and time.time() < deadline:
+        time.sleep(0.01)
+    return job.status
+
+
+def test_done_job_is_not_cancelled_afterwards():
+    queue = RenderQueue(workers=1)
+    calls = []
+    job = queue.submit(lambda job: {"ok": True})
+    job.add_done_callback(calls.append)
+    assert wait_finished(job) == DONE
+    assert queue.cancel(job.id) is False
+    job._finish(CANCELLED)
+    assert job.status == DONE
+    assert calls == [job]
+
+
+def test_queued_job_is_cancelled_once():
+    queue = RenderQueue(workers=1)
+    release = threading.Event()
+    blocker = queue.submit(lambda job: release.wait(5) and {})
+    calls, ran = [], []
+    job = queue.submit(lambda job: ran.append(job) or {})
+    job.add_done_callback(calls.append)
+    assert queue.cancel(job.id) is True
+    release.set()
+    assert wait_finished(blocker) == DONE
+    time.sleep(0.05)
+    assert job.status == CANCELLED
+    assert calls == [job]
+    assert ran == []
+
+
+def test_cancel_racing_run_finishes_every_job_once():
+    queue = RenderQueue(workers=4)
+    calls = []
+    jobs = [queue.submit(lambda job: {"ok": True}) for _ in range(200)]
+    for job in jobs:
+        job.add_done_callback(calls.append)
+    for job in jobs[::2]:
+        queue.cancel(job.id)
+    for job in jobs:
+        wait_finished(job)
+    assert sorted(map(id, calls)) == sorted(map(id, jobs))
+    assert all(job.status in (DONE, CANCELLED) for job in jobs)
@@ -0,0 +1,59 @@
+import threading
+
+from cad_common.openscad import RenderResult
+from cad_common.render_jobs import CANCELLED, DONE, RenderQueue
+from cad_common.repair import queued_render, repair_loop
+
+
+def test_repair_waits_on_the_model_without_a_render_slot():
+    render_queue, repair_queue = RenderQueue(workers=1), RenderQueue(workers=1, timeout=None)
+    model_called, release_model = threading.Event(), threading.Event()
+
+    def render(job, code):
+        return RenderResult(code == "cube(1);", stderr="ERROR: bad")
+
+    def fix(code, errors, left):
+        model_called.set()
+        release_model.wait(5)
+        return "cube(1);"
+
+    def repair(job):
+        outcome = repair_loop("cube(;", queued_render(job, render_queue, render), fix)
+        return {"ok": outcome.ok, "code": outcome.code}
+
+    job = repair_queue.submit(repair)
+    assert model_called.wait(5)
+    # the only render slot is free while the model is asked for a fix
+    other = render_queue.submit(lambda job: {"ok": True})
+    other_done = threading.Event()
+    other.add_done_callback(lambda j: other_done.set())
+    assert other_done.wait(5) and other.status == DONE
+    release_model.set()
+    finished = threading.Event()
+    job.add_done_callback(lambda j: finished.set())
+    assert finished.wait(5)
+    assert job.status == DONE and job.result == {"ok": True, "code": "cube(1);"}
+
+
+def test_cancelling_the_repair_job_cancels_its_render():
+    render_queue, repair_queue = RenderQueue(workers=1), RenderQueue(workers=1, timeout=None)
+    rendering, results = threading.Event(), []
+
+    def render(job, code):
+        rendering.set()
+        while not job.cancelled:
+            job._cancel.wait(0.05)
+        return RenderResult(False, cancelled=True)
+
+    def repair(job):
+        results.append(queued_render(job, render_queue, render)("cube(1);"))
+        return {}
+
+    job = repair_queue.submit(repair)
+    assert rendering.wait(5)
+    repair_queue.cancel(job.id)
+    finished = threading.Event()
+    job.add_done_callback(lambda j: finished.set())
+    assert finished.wait(5)
+    assert job.status == CANCELLED
+    assert results and results[0].cancelled
@@ -0,0 +1,60 @@
+import re
+
+from cad_common.response_cache import ResponseCache, prompt_numbers
+
+WORDS = ["cube", "sphere", "hole", "plate", "tall", "wide", "with", "a", "mm"]
+
+
+def embed(text):
+    # bag of words that ignores digits, so prompts differing only in their
+    # numbers embed identically: the worst case for a semantic cache
+    words = re.findall(r"[a-z]+", text)
+    return [words.count(w) + 0.01 for w in WORDS]
+
+
+def make(tmp_path, **kwargs):
+    return ResponseCache(str(tmp_path / "responses.sqlite3"), embed=embed, **kwargs)
+
+
+def generate(response):
+    return lambda: (response, "test")
+
+
+def test_exact_hit_ignores_case_and_spacing(tmp_path):
+    cache = make(tmp_path)
+    cache.get_or_generate("p", "m", "sys", "A 10 mm cube.", generate("cube(10);"))
+    answer, _, cached = cache.get_or_generate("p", "m", "sys", "a  10mm CUBE", generate("other"))
+    assert answer == "cube(10);"
+    assert cached.kind == "exact"
+
+
+def test_semantic_hit_with_the_same_numbers(tmp_path):
+    cache = make(tmp_path)
+    cache.get_or_generate("p", "m", "sys", "a 10 mm cube with a hole", generate("cube(10);"))
+    answer, _, cached = cache.get_or_generate("p", "m", "sys", "a cube with a hole 10 mm", generate("other"))
+    assert answer == "cube(10);"
+    assert cached.kind == "semantic"
+
+
+def test_near_duplicate_with_other_numbers_misses(tmp_path):
+    cache = make(tmp_path)
+    cache.get_or_generate("p", "m", "sys", "a 10 mm cube", generate("cube(10);"))
+    answer, _, cached = cache.get_or_generate("p", "m", "sys", "a 20 mm cube", generate("cube(20);"))
+    assert answer == "cube(20);"
+    assert cached is None
+
+
+def test_scopes_do_not_share_entries(tmp_path):
+    cache = make(tmp_path)
+    cache.get_or_generate("p", "gpt-4", "sys", "a 10 mm cube", generate("cube(10);"))
+    _, _, cached = cache.get_or_generate("p", "gpt-4o", "sys", "a 10 mm cube", generate("other"))
+    assert cached is None
+
+
+def test_prompt_numbers_keep_units():
+    assert prompt_numbers("A 10 mm cube, 2.5cm tall, rotated 45 deg") == "10mm 2.5cm 45deg"
+    assert prompt_numbers("a cube") == ""
+    assert prompt_numbers("plate 10x20x30") == "10 20 30"
+    assert prompt_numbers("plate 40 x 50 x 30") == "40 50 30"
+    assert prompt_numbers("box 100\u00d750\u00d72 mm") == "100 50 2mm"
+
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from cad_common.routing import Router, RoutingError
+
+LATENCY = {"a": 0.3, "b": 0.8}
+
+
+def router(**kwargs):
+    return Router(["a", "b"], min_delay=0.05, default_delay=0.1, **kwargs)
+
+
+async def ask(name):
+    await asyncio.sleep(LATENCY[name])
+    return f"answer from {name}"
+
+
+def test_slow_hedge_target_that_loses_ranks_behind_the_winner():
+    r = router()
+    result, name = asyncio.run(r.call(ask))
+    assert (result, name) == ("answer from a", "a")
+    assert r.profiles["b"].percentile(0.5) >= r.profiles["a"].percentile(0.5)
+    assert r.ranked() == ["a", "b"]
+    # the next request goes to the winner first
+    assert asyncio.run(r.call(ask))[1] == "a"
+
+
+def test_failover_on_invalid_answer():
+    r = router()
+    result, name = asyncio.run(r.call(ask, validate=lambda text: text.endswith("b"), hedge=False))
+    assert name == "b"
+    assert r.profiles["a"].consecutive_failures == 1
+
+
+def test_all_providers_failing():
+    async def fail(name):
+        raise RuntimeError("down")
+
+    with pytest.raises(RoutingError):
+        asyncio.run(router().call(fail))
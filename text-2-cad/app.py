@@ -1,69 +1,280 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, send_file
 import requests
-from PIL import Image, ImageDraw, ImageFont
 import os
-from openscad_runner import RenderMode, OpenScadRunner
+import sys
+import fcntl
+import functools
+import threading
+import time
 from openai import OpenAI
 from dotenv import load_dotenv
 import re
-from llama_index import StorageContext, load_index_from_storage
-import chromadb
-from llama_index.vector_stores import ChromaVectorStore
-from datetime import datetime
 import json
 
-with open("keys.json", "r") as f:
-    keys = json.load(f)
-OPENAI_API_KEY = keys["gpt"]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cad_common import metrics
+from cad_common.artifacts import ArtifactStore, valid_id
+from cad_common.decompose import decompose
+from cad_common.params import lift_literals, parameters, resolve_overrides
+from cad_common.render_cache import MESH_FORMATS, TIERS, RenderCache, mesh_tier
+from cad_common.render_jobs import RenderQueue
+from cad_common.repair import queued_render, repair_loop, repair_prompt
+from cad_common.response_cache import ResponseCache, normalise_prompt
+from cad_common.scad_lint import lint
+
+def load_keys(path="keys.json"):
+    """Read keys.json if it exists; its OpenAI key is used unless OPENAI_API_KEY is already set."""
+    try:
+        with open(path, "r") as f:
+            keys = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if "gpt" in keys and not os.getenv('OPENAI_API_KEY'):
+        os.environ['OPENAI_API_KEY'] = keys["gpt"]
+    return keys
+
+
+keys = load_keys()
 
 load_dotenv()  # take environment variables from .env.
 
-client = OpenAI(
+_client = None
+
+
+def get_client():
+    """OpenAI client, created on first use so a missing key doesn't break startup."""
+    global _client
+    if _client is None:
+        _client = OpenAI(
             api_key=os.getenv('OPENAI_API_KEY')
-        )   
+        )
+    return _client
+
+IMAGES_DIR = os.path.join("static", "images")
+render_cache = RenderCache(os.path.join(IMAGES_DIR, "cache"),
+                           max_bytes=int(os.getenv("RENDER_CACHE_MAX_BYTES", 512 * 1024 * 1024)))
+# generated scad files: random ids in sharded directories, swept in the background
+scad_store = ArtifactStore("scad_scripts",
+                           max_bytes=int(os.getenv("ARTIFACT_MAX_BYTES", 1024 * 1024 * 1024)),
+                           max_age=float(os.getenv("ARTIFACT_MAX_AGE", 7 * 24 * 3600))).start_gc()
+# OpenSCAD runs off the request thread, one process per core by default
+render_queue = RenderQueue(workers=int(os.getenv("RENDER_WORKERS", 0)) or None,
+                           timeout=float(os.getenv("RENDER_TIMEOUT", 120)))
+# full CGAL/Manifold renders for STL/3MF export get their own, smaller pool
+mesh_queue = RenderQueue(workers=int(os.getenv("MESH_WORKERS", 0)) or max(1, (os.cpu_count() or 2) // 2),
+                         timeout=float(os.getenv("MESH_TIMEOUT", 600)))
+# repair jobs mostly wait on the model, so they get their own threads and
+# hand only their renders to render_queue
+repair_queue = RenderQueue(workers=int(os.getenv("REPAIR_WORKERS", 8)), timeout=None)
+JOB_QUEUES = (render_queue, mesh_queue, repair_queue)
+
+
+
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", 4))
+# must match the model the collection was embedded with
+RAG_EMBED_MODEL = os.getenv("RAG_EMBED_MODEL", "text-embedding-ada-002")
+
+
+def embed_texts(texts, model=RAG_EMBED_MODEL):
+    response = get_client().embeddings.create(model=model, input=texts)
+    return [item.embedding for item in response.data]
+
+
+CHROMA_PATH = "./chroma_db"
+
+
+def ingest_docstore(collection, persist_dir="index", batch_size=100):
+    """
+    Migrate the JSON-persisted documentation nodes into the Chroma
+    collection: the ones it doesn't hold yet, so an interrupted ingest
+    resumes where it stopped.
+    """
+    with open(os.path.join(persist_dir, "docstore.json"), "r") as f:
+        data = json.load(f)["docstore/data"]
+    nodes = [(node_id, entry["__data__"]["text"]) for node_id, entry in data.items()
+             if entry.get("__data__", {}).get("text")]
+    del data
+    have = set(collection.get(include=[])["ids"])
+    nodes = [(node_id, text) for node_id, text in nodes if node_id not in have]
+    if not nodes:
+        return
+    print(f"Embedding {len(nodes)} documentation chunks into Chroma")
+    for i in range(0, len(nodes), batch_size):
+        batch = nodes[i:i + batch_size]
+        texts = [text for _, text in batch]
+        collection.add(ids=[node_id for node_id, _ in batch], documents=texts, embeddings=embed_texts(texts))
+
+
+def get_collection(ingest=False):
+    """
+    Open the Chroma collection. Only one process fills it: an empty
+    collection is ingested under a file lock, and the other workers wait
+    for the lock, then open the filled collection and only read it. With
+    `ingest`, missing nodes are added even to a non-empty collection.
+    """
+    # heavy import is deferred so the app can start serving before it loads
+    import chromadb
+
+    os.makedirs(CHROMA_PATH, exist_ok=True)
+    with open(os.path.join(CHROMA_PATH, ".ingest.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            # on-disk vector store: only the top-k chunks of a query are ever loaded
+            db = chromadb.PersistentClient(path=CHROMA_PATH)
+            chroma_collection = db.get_or_create_collection("quickstart")
+            if ingest or chroma_collection.count() == 0:
+                ingest_docstore(chroma_collection)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return chroma_collection
+
+
+# The RAG collection is opened in a background thread; plain OpenAI requests are
+# served while it warms up and RAG requests wait for it (up to RAG_WAIT_TIMEOUT).
+RAG_WAIT_TIMEOUT = float(os.getenv("RAG_WAIT_TIMEOUT", 60))
+rag_state = {"status": "loading", "error": None, "seconds": None}
+_rag_ready = threading.Event()
+doc_collection = None
+
+
+def warm_collection():
+    global doc_collection
+    started = time.time()
+    try:
+        doc_collection = get_collection()
+        rag_state["status"] = "ready"
+    except Exception as e:
+        print(f"Loading the RAG collection failed: {e}")
+        rag_state["status"] = "failed"
+        rag_state["error"] = str(e)
+    finally:
+        rag_state["seconds"] = round(time.time() - started, 2)
+        _rag_ready.set()
+
 
+def wait_for_collection(timeout=RAG_WAIT_TIMEOUT):
+    """Return the Chroma collection, or raise if it is not loaded within `timeout` seconds."""
+    if not _rag_ready.wait(timeout):
+        raise RuntimeError("RAG collection is still loading")
+    if doc_collection is None:
+        raise RuntimeError(f"RAG collection unavailable: {rag_state['error']}")
+    return doc_collection
 
 
-def get_query_engine():
-    # rebuild storage context
-    storage_context = StorageContext.from_defaults(persist_dir="index")
+@functools.lru_cache(maxsize=1024)
+def embed_query(text):
+    return embed_texts([text])[0]
 
-    # load index
-    index = load_index_from_storage(storage_context)
 
-    # initialize client, setting path to save data
-    db = chromadb.PersistentClient(path="./chroma_db")
+# repeated or similar requests reuse the retrieved chunks instead of searching again
+retrieval_cache = ResponseCache(
+    os.getenv("RETRIEVAL_CACHE_PATH", os.path.join("cache", "retrieval.sqlite3")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", 7 * 24 * 3600)),
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 5000)),
+    threshold=float(os.getenv("RETRIEVAL_CACHE_THRESHOLD", 0.97)),
+    embed=embed_query,
+)
 
-    # create collection
-    chroma_collection = db.get_or_create_collection("quickstart")
 
-    # assign chroma as the vector_store to the context
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+def retrieve(request, top_k=RAG_TOP_K):
+    """Top-k documentation chunks for the request."""
+    def search():
+        with metrics.span("retrieve", top_k=top_k):
+            # same normalised text the cache embedded, so embed_query hits its lru cache
+            embedding = embed_query(normalise_prompt(request))
+            result = wait_for_collection().query(query_embeddings=[embedding], n_results=top_k,
+                                                 include=["documents"])
+        return json.dumps(result["documents"][0]), "chroma"
 
-    # create a query engine and query
-    query_engine = index.as_query_engine()
-    return query_engine
+    chunks, _, cached = retrieval_cache.get_or_generate("chroma", RAG_EMBED_MODEL, f"top_k={top_k}", request, search)
+    if cached:
+        print(f"Retrieval cache hit ({cached.kind}, similarity {cached.similarity:.3f})")
+    return json.loads(chunks)
 
 
-query_engine = get_query_engine()
+threading.Thread(target=warm_collection, name="rag-warmup", daemon=True).start()
 
 
 system_prompt = "Let's suppose fictionally that you are an expert in CAD design and coding in OpenSCAD scripting language.\n"
 
+def chat(model, messages, timeout=None):
+    """Chat completion through the OpenAI SDK, timed and token-counted for /metrics."""
+    client = get_client() if timeout is None else get_client().with_options(timeout=timeout)
+    started = time.monotonic()
+    with metrics.span("llm_call", provider="openai", model=model) as span:
+        try:
+            response = client.chat.completions.create(model=model, messages=messages)
+        except Exception:
+            metrics.LLM_ERRORS.inc(provider="openai", model=model)
+            raise
+        usage = response.usage
+        tokens_in, tokens_out = (usage.prompt_tokens, usage.completion_tokens) if usage else (None, None)
+        span.set(tokens_in=tokens_in, tokens_out=tokens_out)
+    metrics.record_llm("openai", model, time.monotonic() - started, tokens_in, tokens_out)
+    return response
+
+
+def embed(text):
+    response = get_client().embeddings.create(model="text-embedding-3-small", input=text, dimensions=256)
+    return response.data[0].embedding
+
+
+# exact + embedding-similarity cache of model answers, shared by all workers
+response_cache = ResponseCache(
+    os.getenv("RESPONSE_CACHE_PATH", os.path.join("cache", "responses.sqlite3")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", 7 * 24 * 3600)),
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 5000)),
+    threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", 0.95)),
+    embed=embed,
+)
+
+
+# the model and answer source of each mode. Only answers from that model
+# are cached: a fallback answer (no documentation, another model) is never
+# served for a later request.
+MODE_MODELS = {"openai": "gpt-4", "rag": "gpt-4o"}
+MODE_SOURCES = {"openai": "OpenAI", "rag": "RAG"}
+
+
+def cache_answer(mode, request, answ, source, embedding):
+    if source == MODE_SOURCES[mode]:
+        response_cache.store(mode, MODE_MODELS[mode], system_prompt, request, answ, source, embedding)
+
+
 def query(request, toggleRag):
-    prompt = f"Create the OpenSCAD code to generate the 3D model for a {request}. Answer ONLY with the code, no comments or explanations.\n"
+    """Answer from the response cache when a same or similar request was seen before."""
+    mode = "rag" if toggleRag == "on" else "openai"
+    cached, embedding = response_cache.lookup(mode, MODE_MODELS[mode], system_prompt, request)
+    if cached:
+        print(f"Response cache hit ({cached.kind}, similarity {cached.similarity:.3f})")
+        return cached.response, f"{cached.source} (cached)"
+    answ, source = query_llm(request, toggleRag)
+    cache_answer(mode, request, answ, source, embedding)
+    return answ, source
+
+
+def query_llm(request, toggleRag):
+    with metrics.span("prompt_build"):
+        prompt = f"Create the OpenSCAD code to generate the 3D model for a {request}. Answer ONLY with the code, no comments or explanations.\n"
     if toggleRag == "on":
         # for rag:
         try:
-            answ = query_engine.query(prompt)
-            print(f"RAG response: {answ.response}")
-            if answ.response and answ.response.strip():
-                return answ.response, "RAG"
+            context = "\n---\n".join(retrieve(request))
+            response = chat(
+                model=MODE_MODELS["rag"],
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": f"Relevant OpenSCAD documentation:\n{context}\n---\n{prompt}"},
+                ]
+            )
+            answ = response.choices[0].message.content
+            print(f"RAG response: {answ}")
+            if answ and answ.strip():
+                return answ, MODE_SOURCES["rag"]
             else:
                 print("RAG returned empty response, falling back to OpenAI")
                 # Fallback to OpenAI if RAG returns empty
-                response = client.chat.completions.create(
+                response = chat(
                     model="gpt-4o",
                     messages=[
                         {"role": "system", "content": system_prompt},
@@ -74,7 +285,7 @@ def query(request, toggleRag):
         except Exception as e:
             print(f"RAG query failed: {e}")
             # Fallback to OpenAI if RAG fails
-            response = client.chat.completions.create(
+            response = chat(
                 model="gpt-4o-latest",
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -83,8 +294,8 @@ def query(request, toggleRag):
             )
             return response.choices[0].message.content, "OpenAI (RAG error fallback)"
     else:
-        response = client.chat.completions.create(
-            model="gpt-4",
+        response = chat(
+            model=MODE_MODELS["openai"],
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt},
@@ -92,11 +303,178 @@ def query(request, toggleRag):
             )
         
         answ = response.choices[0].message.content
-        return answ, "OpenAI"
+        return answ, MODE_SOURCES["openai"]
+
+
+# parallel part generation for the "complex design" mode
+DECOMPOSE_WORKERS = int(os.getenv("DECOMPOSE_WORKERS", 4))
+
+def complete(prompt):
+    response = chat(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt},
+        ]
+    )
+    return response.choices[0].message.content or ""
+
+
+def query_complex(request):
+    """
+    Complex design mode: split the design into parts, generate independent
+    parts concurrently and compose them into one SCAD file.
+    """
+    def generate():
+        design = decompose(request, complete, max_workers=DECOMPOSE_WORKERS)
+        print(f"Composed {len(design.parts)} parts in {design.elapsed:.1f}s: {design.to_dict()}")
+        return design.code, "OpenAI (complex design)"
+
+    answ, source, cached = response_cache.get_or_generate("complex", "gpt-4o", system_prompt, request, generate)
+    if cached:
+        print(f"Response cache hit ({cached.kind}, similarity {cached.similarity:.3f})")
+        source = f"{source} (cached)"
+    return answ, source
+
+
+def stream_llm(request, toggleRag, result):
+    """
+    Streaming version of query(): yields the answer as the model writes it
+    (a cached answer in one piece). Once exhausted, result['answer'] and
+    result['source'] hold the full answer.
+    """
+    mode = "rag" if toggleRag == "on" else "openai"
+    cached, embedding = response_cache.lookup(mode, MODE_MODELS[mode], system_prompt, request)
+    if cached:
+        print(f"Response cache hit ({cached.kind}, similarity {cached.similarity:.3f})")
+        result.update(answer=cached.response, source=f"{cached.source} (cached)")
+        yield cached.response
+        return
+
+    with metrics.span("prompt_build", rag=toggleRag == "on"):
+        prompt = f"Create the OpenSCAD code to generate the 3D model for a {request}. Answer ONLY with the code, no comments or explanations.\n"
+        model, source = MODE_MODELS["openai"], MODE_SOURCES["openai"]
+        if toggleRag == "on":
+            try:
+                context = "\n---\n".join(retrieve(request))
+                prompt = f"Relevant OpenSCAD documentation:\n{context}\n---\n{prompt}"
+                model, source = MODE_MODELS["rag"], MODE_SOURCES["rag"]
+            except Exception as e:
+                print(f"RAG retrieval failed: {e}")
+                model, source = "gpt-4o", "OpenAI (RAG error fallback)"
+    # timed by hand: a span can't stay current across the yields
+    span = metrics.start_span("llm_stream", provider="openai", model=model)
+    started = time.monotonic()
+    response, error, parts = None, None, []
+    try:
+        response = get_client().chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt},
+            ],
+            stream=True,
+        )
+        for chunk in response:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                if not parts:
+                    first_token = time.monotonic() - started
+                    span.set(first_token=round(first_token, 6))
+                    metrics.LLM_FIRST_TOKEN.observe(first_token, provider="openai", model=model)
+                parts.append(delta)
+                yield delta
+    except Exception as e:
+        error = e
+        metrics.LLM_ERRORS.inc(provider="openai", model=model)
+        raise
+    finally:
+        if response is not None:
+            response.close()  # also when the browser goes away mid-stream
+        tokens_in, tokens_out = (len(system_prompt) + len(prompt)) // 4, len("".join(parts)) // 4
+        span.set(tokens_in=tokens_in, tokens_out=tokens_out)
+        span.finish(error)
+    metrics.record_llm("openai", model, time.monotonic() - started, tokens_in, tokens_out)
+    answ = "".join(parts)
+    cache_answer(mode, request, answ, source, embedding)
+    result.update(answer=answ, source=source)
     
 
     
 
+def extract_code(answer):
+    """Strip markdown fences and the 'openscad' language tag from a model answer."""
+    if "```" in answer:
+        answer = answer.split("```")[1]
+    elif "`" in answer:
+        answer = answer.split("`")[1]
+    return re.sub(r'openscad', '', answer, flags=re.IGNORECASE)
+
+
+# opt-in server-side repair of code that fails validation or rendering
+REPAIR_MAX_ATTEMPTS = int(os.getenv("REPAIR_MAX_ATTEMPTS", 2))
+REPAIR_BUDGET = float(os.getenv("REPAIR_BUDGET", 90))
+
+def repair_scad(code, errors, timeout):
+    """Send only the errors and the offending code back for a targeted fix."""
+    response = chat(
+        timeout=timeout,
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": repair_prompt(code, errors)},
+        ]
+    )
+    return extract_code(response.choices[0].message.content or "")
+
+
+def render_tier(job, scad_path, answer, tier, defines=None):
+    """Render one quality tier (see render_cache.TIERS) through the cache; returns the static path."""
+    result = render_cache.render(scad_path, answer, job=job, defines=defines, **tier)
+    print(f"Rendered {scad_path} ({tier['ext']}, {tier['imgsize'][0]}x{tier['imgsize'][1]}): "
+          f"ok={result.ok} cache_hit={result.cache_hit} in {result.elapsed:.1f}s")
+    if not result.ok:
+        if result.timed_out:
+            raise RuntimeError('OpenSCAD rendering timed out.')
+        raise RuntimeError('OpenSCAD rendering failed.')
+    return os.path.relpath(result.path, IMAGES_DIR).replace(os.sep, "/")
+
+
+def render_preview(job, scad_path, answer, defines=None):
+    """Render job: thumbnail first (visible while the job runs), then the full png preview."""
+    job.update(thumbnail=render_tier(job, scad_path, answer, TIERS["thumb"], defines))
+    return {'image': render_tier(job, scad_path, answer, TIERS["preview"], defines)}
+
+
+def render_mesh(job, scad_path, answer, fmt, defines=None):
+    """Render job: full CGAL render of the scad file to an STL/3MF mesh."""
+    return {'model': render_tier(job, scad_path, answer, mesh_tier(fmt), defines), 'format': fmt}
+
+
+def cached_tiers(answer, defines=None):
+    """Image tiers of this code that are already in the render cache."""
+    found = {}
+    for tier, field in (("thumb", "thumbnail"), ("preview", "image")):
+        path = render_cache.lookup(answer, defines=defines, **TIERS[tier])
+        if path:
+            found[field] = os.path.relpath(path, IMAGES_DIR).replace(os.sep, "/")
+    return found
+
+
+def render_with_repair(job, artifact_id, answer):
+    """Render job that feeds validation/render errors back to the model until the code renders."""
+    def render(render_job, code):
+        scad_store.save(code, "scad", artifact_id)
+        return render_cache.render(scad_store.path_for(artifact_id, "scad"), code, job=render_job, **TIERS["preview"])
+
+    outcome = repair_loop(answer, queued_render(job, render_queue, render), repair_scad, max_attempts=REPAIR_MAX_ATTEMPTS, budget=REPAIR_BUDGET)
+    print(f"Repair of {artifact_id}: ok={outcome.ok} after {len(outcome.attempts)} failed attempt(s)")
+    if not outcome.ok:
+        raise RuntimeError(f'OpenSCAD rendering failed after {len(outcome.attempts) - 1} repair attempt(s):\n{outcome.error}')
+    return {'image': os.path.relpath(outcome.render.path, IMAGES_DIR).replace(os.sep, "/"),
+            'code': outcome.code, 'params': parameters(outcome.code), 'repairs': len(outcome.attempts)}
+
+
 app = Flask(__name__)
 
 
@@ -108,50 +486,22 @@ def index():
 def submit():
     text = request.form['text']
     toggleRag = request.form['toggleRag']
+    repair = request.form.get('repair') == 'on'
+    complex_design = request.form.get('mode') == 'complex'
     
     try:
-        answer, source = query(text, toggleRag)
-        print(f"Generated answer: {answer}")
-        print(f"Source: {source}")
-
-        if not answer or not answer.strip():
-            return jsonify({'error': 'Failed to generate OpenSCAD code', 'image': '', 'filename': '', 'code': '', 'source': ''})
-
-        if "```" in answer:
-            answer = answer.split("```")[1]
-        elif "`" in answer:
-            answer = answer.split("`")[1]
-
-        answer = re.sub(r'openscad', '', answer, flags=re.IGNORECASE)
-
-        # save the scad file with the timestamp as the filename
-        curr_timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-        scad_path = os.path.join("scad_scripts", curr_timestamp + ".scad")
-
-        # save a scad file with the answer
-        os.makedirs(os.path.dirname(scad_path), exist_ok=True)
-        # ensure the static/images directory exists for output images
-        os.makedirs(os.path.join("static", "images"), exist_ok=True)
-        with open(scad_path, 'w') as f:
-            f.write(answer)
-        
-        # render the scad file
-        # png
-        osr = OpenScadRunner(scad_path, f"static/images/{curr_timestamp}.png", render_mode=RenderMode.preview, imgsize=(800,600))
-
-        print(f"Timestamp: {curr_timestamp}")
-        print(f"SCAD path: {scad_path}")
+        with metrics.trace('submit', rag=toggleRag == 'on', repair=repair, complex=complex_design):
+            if complex_design:
+                answer, source = query_complex(text)
+            else:
+                answer, source = query(text, toggleRag)
+            print(f"Generated answer: {answer}")
+            print(f"Source: {source}")
 
-        # gif
-        # osr = OpenScadRunner(filename + ".scad", f"static/images/{filename}.gif", imgsize=(320,200), animate=36, animate_duration=200)
+            if not answer or not answer.strip():
+                return jsonify({'error': 'Failed to generate OpenSCAD code', 'image': '', 'filename': '', 'code': '', 'source': ''})
 
-        osr.run()
-        
-        if osr.good():
-            return jsonify({'image': f"{curr_timestamp}.png", 'filename': curr_timestamp, 'code': answer, 'source': source})
-        else:
-            # Return error but with empty image and filename fields for frontend compatibility
-            return jsonify({'error': 'OpenSCAD rendering failed.', 'image': '', 'filename': '', 'code': answer, 'source': source})
+            return jsonify(start_render(answer, source, repair))
     
     except Exception as e:
         print(f"Error in submit: {e}")
@@ -159,17 +509,193 @@ def submit():
 
 
 
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route('/submit_stream', methods=['GET'])
+def submit_stream():
+    """
+    Server-Sent Events version of /submit: 'token' events carry the answer as
+    it is generated, then a single 'result' event carries what /submit returns.
+    """
+    text = request.args.get('text', '')
+    toggleRag = request.args.get('toggleRag', 'off')
+    repair = request.args.get('repair') == 'on'
+    complex_design = request.args.get('mode') == 'complex'
+
+    def events():
+        try:
+            with metrics.trace('submit_stream', rag=toggleRag == 'on', repair=repair, complex=complex_design):
+                if complex_design:
+                    # parts are generated in parallel, the composed file arrives at once
+                    answer, source = query_complex(text)
+                    yield sse('token', {'text': answer})
+                else:
+                    result = {}
+                    for delta in stream_llm(text, toggleRag, result):
+                        yield sse('token', {'text': delta})
+                    answer, source = result['answer'], result['source']
+                print(f"Source: {source}")
+                if not answer or not answer.strip():
+                    yield sse('result', {'error': 'Failed to generate OpenSCAD code', 'image': '', 'filename': '', 'code': '', 'source': ''})
+                    return
+                yield sse('result', start_render(answer, source, repair))
+        except Exception as e:
+            print(f"Error in submit_stream: {e}")
+            yield sse('result', {'error': f'Server error: {str(e)}', 'image': '', 'filename': '', 'code': '', 'source': ''})
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def start_render(answer, source, repair):
+    """Save the generated code and start validating/rendering it; returns the /submit response."""
+    # literal dimensions become top-level variables the UI can override
+    with metrics.span('strip_scad'):
+        answer = lift_literals(extract_code(answer))
+        params = parameters(answer)
+
+    # save the scad file; its artifact id is the download filename
+    with metrics.span('file_io', op='save'):
+        artifact_id = scad_store.save(answer, "scad")
+        scad_path = scad_store.path_for(artifact_id, "scad")
+    print(f"SCAD path: {scad_path}")
+
+    # render the scad file
+    # png, straight from the render cache if this exact code was rendered before
+    cached = cached_tiers(answer)
+    if 'image' in cached:
+        return {**cached, 'filename': artifact_id, 'code': answer, 'source': source, 'params': params}
+
+    # gif
+    # osr = OpenScadRunner(filename + ".scad", f"static/images/{filename}.gif", imgsize=(320,200), animate=36, animate_duration=200)
+
+    # with repair on, validation/render errors go back to the model inside the job
+    if repair:
+        job = repair_queue.submit(render_with_repair, artifact_id, answer)
+        return {'job': job.id, 'status': job.status, 'image': '', 'filename': artifact_id, 'code': answer,
+            'source': source, 'params': params}
+
+    # reject broken code before it costs an OpenSCAD process
+    with metrics.span('validate') as span:
+        checked = lint(answer)
+        span.set(ok=checked.ok)
+    if not checked.ok:
+        print(f"SCAD validation failed:\n{checked.summary()}")
+        return {'error': 'SCAD validation failed:\n' + checked.summary(), 'diagnostics': checked.to_list(),
+            'image': '', 'filename': '', 'code': answer, 'source': source}
+
+    # otherwise queue the render and let the page poll /jobs/<id>; the thumbnail shows up first
+    job = render_queue.submit(render_preview, scad_path, answer)
+    return {**cached, 'job': job.id, 'status': job.status, 'image': '', 'filename': artifact_id, 'code': answer,
+            'source': source, 'params': params, 'diagnostics': checked.to_list()}
+
+
+@app.route('/rerender', methods=['POST'])
+def rerender():
+    """
+    Re-render a generated design with parameter overrides (OpenSCAD -D), no
+    model call. Returns the image on a render-cache hit, otherwise a job.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = str(data.get('filename', ''))
+    if not valid_id(filename):
+        return jsonify({'error': 'Invalid filename'}), 400
+    answer = scad_store.read(filename, "scad")
+    if answer is None:
+        return jsonify({'error': 'Unknown design'}), 404
+    scad_path = scad_store.path_for(filename, "scad")
+    try:
+        defines = resolve_overrides(parameters(answer), data.get('params'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    cached = cached_tiers(answer, defines)
+    if 'image' in cached:
+        return jsonify({**cached, 'filename': filename, 'defines': defines})
+    job = render_queue.submit(render_preview, scad_path, answer, defines)
+    return jsonify({**cached, 'job': job.id, 'status': job.status, 'filename': filename, 'defines': defines})
+
+
+@app.route('/export', methods=['POST'])
+def export():
+    """
+    Full render of a generated design to STL/3MF, with the same parameter
+    overrides as /rerender. Only runs on request: returns the cached mesh,
+    otherwise a job on the mesh queue.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = str(data.get('filename', ''))
+    fmt = str(data.get('format', 'stl')).lower()
+    if not valid_id(filename):
+        return jsonify({'error': 'Invalid filename'}), 400
+    if fmt not in MESH_FORMATS:
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+    answer = scad_store.read(filename, "scad")
+    if answer is None:
+        return jsonify({'error': 'Unknown design'}), 404
+    try:
+        defines = resolve_overrides(parameters(answer), data.get('params'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    model_path = render_cache.lookup(answer, defines=defines, **mesh_tier(fmt))
+    if model_path:
+        model = os.path.relpath(model_path, IMAGES_DIR).replace(os.sep, "/")
+        return jsonify({'model': model, 'format': fmt, 'filename': filename})
+    job = mesh_queue.submit(render_mesh, scad_store.path_for(filename, "scad"), answer, fmt, defines)
+    return jsonify({'job': job.id, 'status': job.status, 'format': fmt, 'filename': filename})
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe. The app serves as soon as it starts; pass ?require=rag to wait for the index too."""
+    body = {'status': 'ok', 'rag': rag_state['status'], 'rag_load_seconds': rag_state['seconds']}
+    if request.args.get('require') == 'rag' and rag_state['status'] != 'ready':
+        return jsonify(body), 503
+    return jsonify(body)
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Poll a render or export job; 'thumbnail' appears early, 'image'/'model' once it is done."""
+    job = next((q.get(job_id) for q in JOB_QUEUES if q.get(job_id)), None)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued or running render or export job."""
+    queue = next((q for q in JOB_QUEUES if q.get(job_id)), None)
+    if queue is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify({'cancelled': queue.cancel(job_id)})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics: per-stage latencies, model calls and tokens, cache and render job counters."""
+    return Response(metrics.exposition(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route('/download/<filename>', methods=['GET'])
 def download_file(filename):
     """Send the requested SCAD file to the user."""
-    directory = os.path.join(app.root_path, 'scad_scripts')
-    print(directory)
-    print(filename)
-    return send_from_directory(directory, filename + ".scad", as_attachment=True)
+    path = scad_store.get(filename, "scad")
+    if path is None:
+        return jsonify({'error': 'Unknown design'}), 404
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=filename + ".scad")
 
 
 
 
 if __name__ == '__main__':
-    app.run(debug=False)
+    if sys.argv[1:] == ['ingest']:
+        # fill the RAG collection ahead of starting the workers
+        print(f"{get_collection(ingest=True).count()} documentation chunks in {CHROMA_PATH}")
+    else:
+        app.run(debug=False)
 